@@ -1,7 +1,11 @@
+import asyncio, json, logging, os, threading
+from typing import Dict, List, Optional
+
 from langchain.agents import create_openai_functions_agent, AgentExecutor
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import SystemMessage
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_function
 from clients.web_search_tool import get_brave_tool
 from clients.email_tool import send_email_tool
 from clients.database_tool import db_tool
@@ -10,9 +14,103 @@ from clients.query_rag_tool import query_rag_tool
 from clients.concept_map_tool import concept_map_tool
 from clients.exam_tool import generate_exam_tool
 from clients.lesson_plan_tool import lesson_plan_tool
+from clients.embeddings import embed_texts, cosine
+from clients.llm_gateway import chat_model
+
+# Selezione dinamica dei tool per query (embedding domanda vs descrizioni tool)
+TOOL_TOP_K = int(os.getenv("AGENT_TOOL_TOP_K", 3))
+TOOL_MARGIN = float(os.getenv("AGENT_TOOL_MARGIN", 0.08))  # tieni i tool entro questo scarto dal migliore
+TOOL_SELECTION = os.getenv("AGENT_TOOL_SELECTION", "1") != "0"
+
+
+def _count_tokens(text: str) -> int:
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    except Exception:
+        return len(text) // 4  # stima grezza
+
+
+class DynamicToolAgent:
+    """
+    Wrapper dell'AgentExecutor: per ogni domanda sceglie il sottoinsieme di tool
+    più pertinente (similarità coseno con vettori precalcolati delle descrizioni)
+    e costruisce la lista di funzioni solo con quelli.
+    """
+
+    def __init__(self, llm, tools: List[BaseTool], prompt):
+        self.llm = llm
+        self.tools = tools
+        self.prompt = prompt
+        self._tool_vectors: Optional[List[List[float]]] = None
+        self._schema_tokens = {
+            t.name: _count_tokens(json.dumps(convert_to_openai_function(t), ensure_ascii=False))
+            for t in tools
+        }
+        self._executors: Dict[tuple, AgentExecutor] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "tool_tokens_full": 0, "tool_tokens_sent": 0}
+
+    def _executor(self, tools: List[BaseTool]) -> AgentExecutor:
+        key = tuple(t.name for t in tools)
+        with self._lock:
+            ex = self._executors.get(key)
+        if ex is None:
+            agent = create_openai_functions_agent(llm=self.llm, tools=tools, prompt=self.prompt)
+            ex = AgentExecutor(agent=agent, tools=tools, verbose=True, handle_parsing_errors=True)
+            with self._lock:
+                self._executors[key] = ex
+        return ex
+
+    def select_tools(self, query: str) -> List[BaseTool]:
+        if not TOOL_SELECTION:
+            return self.tools
+        try:
+            if self._tool_vectors is None:
+                self._tool_vectors = embed_texts([f"{t.name}: {t.description}" for t in self.tools])
+            qv = embed_texts([query])[0]
+        except Exception:
+            logging.warning("Selezione tool non disponibile, uso tutti i tool", exc_info=True)
+            return self.tools
+        scored = sorted(
+            ((cosine(qv, tv), i) for i, tv in enumerate(self._tool_vectors)),
+            reverse=True,
+        )
+        best = scored[0][0]
+        keep = sorted(i for sim, i in scored[:TOOL_TOP_K] if sim >= best - TOOL_MARGIN)
+        return [self.tools[i] for i in keep]
+
+    def _account(self, tools: List[BaseTool]) -> None:
+        full = sum(self._schema_tokens.values())
+        sent = sum(self._schema_tokens[t.name] for t in tools)
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["tool_tokens_full"] += full
+            self._stats["tool_tokens_sent"] += sent
+        logging.info("[agent] tool selezionati: %s (%d/%d token schema)",
+                     [t.name for t in tools], sent, full)
+
+    def invoke(self, inputs: dict, **kwargs):
+        tools = self.select_tools(inputs.get("input", ""))
+        self._account(tools)
+        return self._executor(tools).invoke(inputs, **kwargs)
+
+    async def ainvoke(self, inputs: dict, **kwargs):
+        tools = await asyncio.to_thread(self.select_tools, inputs.get("input", ""))
+        self._account(tools)
+        return await self._executor(tools).ainvoke(inputs, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s["tool_tokens_saved"] = s["tool_tokens_full"] - s["tool_tokens_sent"]
+        s["saved_ratio"] = round(s["tool_tokens_saved"] / s["tool_tokens_full"], 3) if s["tool_tokens_full"] else 0.0
+        s["schema_tokens_per_tool"] = dict(self._schema_tokens)
+        return s
+
 
 def create_agent():
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
+    llm = chat_model("gpt-4o", temperature=0.3, priority="interactive")
 
     tools = [
         get_brave_tool(),
@@ -22,9 +120,9 @@ def create_agent():
         ingest_directory_tool,
         query_rag_tool,
         concept_map_tool,
-        generate_exam_tool, 
+        generate_exam_tool,
         lesson_plan_tool,
-        
+
     ]
 
     prompt = ChatPromptTemplate.from_messages([
@@ -37,13 +135,4 @@ Usa solo strumenti disponibili tramite function calling."""),
         MessagesPlaceholder(variable_name="agent_scratchpad"),
     ])
 
-    agent = create_openai_functions_agent(llm=llm, tools=tools, prompt=prompt)
-
-    agent_executor = AgentExecutor(
-        agent=agent,
-        tools=tools,
-        verbose=True,
-        handle_parsing_errors=True
-    )
-
-    return agent_executor
+    return DynamicToolAgent(llm=llm, tools=tools, prompt=prompt)
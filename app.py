@@ -1,25 +1,46 @@
 from __future__ import annotations
 from dotenv import load_dotenv
 load_dotenv()
-import logging, re
-from io import BytesIO
+import hashlib, json, logging, os, uuid
+from urllib.parse import quote
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, stream_with_context
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
 from agent import create_agent
-from clients.exam_tool import Exam, generate_exam, grade_exam
-from clients.concept_map_tool import generate_concept_map, ConceptMap
+from clients.exam_tool import Exam, generate_exam, grade_exam, grade_exam_bulk, parse_submissions
+from clients.concept_map_tool import (
+    ConceptMap,
+    expand_concept_node,
+    generate_concept_map,
+    generate_concept_outline,
+    stream_concept_map,
+)
+from clients.fast_concept_map import fast_concept_map
 from clients.lesson_plan_tool import (
     LessonPlan,
     generate_custom_lesson_plan,
+    plan_pdf_artifact,
+    stream_custom_lesson_plan,
 )
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
-from reportlab.lib import colors
-from clients.slide_tool import generate_slides_pptx
+from clients.slide_tool import generate_slides_artifact, stream_slides_artifact
 from clients.summarize_tool import summarize_topic_and_optional_file
+from clients.question_bank import ensure_bank_schema
+from clients.intent_router import Route, route as route_intent, router_stats
+from clients.history_store import ensure_conversation_schema, ensure_history_schema, list_events, get_event
+from clients.jobs import JOBS_DIR, QueueFull, get_job_manager, job_file_name, job_params, parse_priority, sse_stream
+from clients.singleflight import flights, make_key
+from clients.llm_gateway import gateway_stats
+from clients.admission import Rejected, admission
+from clients.structured import structured_stats
+from clients.slide_images import slide_image_stats
+from clients.email_outbox import email_outbox_stats, get_outbox
+from clients.web_search_tool import brave_stats
+from clients.artifact_cache import Artifact, artifact_cache_stats, artifacts, etag_for, etag_matches, model_digest
+from clients.telemetry import begin_request, end_request, metrics_payload
+from clients import profiler
+from clients.conversation_memory import get_chat_history, record_turn, clear_conversation
 
 
 
@@ -30,6 +51,104 @@ logging.basicConfig(level=logging.INFO)
 app = Flask(__name__)
 agent = create_agent()
 
+try:
+    ensure_bank_schema()
+    ensure_conversation_schema()
+    ensure_history_schema()
+except Exception:
+    logging.warning("Schema DB non inizializzato (DB non raggiungibile?)")
+
+def _client_id(data: dict | None = None) -> str:
+    return ((data or {}).get("client_id") or request.headers.get("X-Client-Id")
+            or request.args.get("client_id") or "").strip()
+
+# ───────────────────────── Telemetria ──────────────────────────
+
+@app.before_request
+def _begin_telemetry():
+    rule = request.url_rule.rule if request.url_rule else "unmatched"
+    g.telemetry = begin_request(rule)
+
+@app.after_request
+def _end_telemetry(resp):
+    state = g.pop("telemetry", None)
+    if state is not None:
+        resp.headers["Server-Timing"] = end_request(state, request.method, resp.status_code)
+    return resp
+
+@app.get("/metrics")
+def metrics_ep():
+    body, content_type = metrics_payload()
+    return Response(body, content_type=content_type)
+
+# ───────────────────── Ammissione / load shedding ───────────────────
+
+@app.before_request
+def _admit():
+    if request.method != "POST" or request.url_rule is None:
+        return None
+    client_id = _client_id(request.get_json(silent=True))
+    try:
+        g.admission = admission.admit(request.url_rule.rule, request.remote_addr or "", client_id)
+    except Rejected as e:
+        resp = jsonify({"error": "Server occupato, riprova tra poco.", "reason": e.reason})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = str(e.retry_after)
+        return resp
+    return None
+
+@app.teardown_request
+def _release_admission(exc):
+    ticket = g.pop("admission", None)
+    if ticket is not None:
+        admission.release(ticket)
+
+# ───────────────────── Profilazione su richiesta ───────────────────
+
+@app.before_request
+def _begin_profile():
+    rule = request.url_rule.rule if request.url_rule else "unmatched"
+    if profiler.should_profile(rule, request.headers.get("X-Profile"), request.headers.get("X-Profile-Token")):
+        g.profile = profiler.start(rule)
+
+@app.after_request
+def _end_profile(resp):
+    prof = g.pop("profile", None)
+    if prof is not None:
+        resp.headers["X-Profile-Id"] = prof.id
+        resp.call_on_close(prof.finish)   # a corpo inviato: include gli stream SSE
+    return resp
+
+def _profiling_forbidden():
+    if profiler.authorized(request.headers.get("X-Profile-Token")):
+        return None
+    return jsonify({"error": "forbidden"}), 403
+
+@app.route("/profiling", methods=["GET", "POST"])
+def profiling_settings_ep():
+    if (denied := _profiling_forbidden()) is not None:
+        return denied
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        return jsonify(profiler.configure(data.get("sample_rate", 0), data.get("endpoints")))
+    return jsonify(profiler.settings())
+
+@app.get("/profiles")
+def profiles_ep():
+    if (denied := _profiling_forbidden()) is not None:
+        return denied
+    return jsonify(profiler.list_profiles())
+
+@app.get("/profiles/<profile_id>")
+def profile_download_ep(profile_id: str):
+    if (denied := _profiling_forbidden()) is not None:
+        return denied
+    path = profiler.profile_path(profile_id)
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": "profilo non trovato"}), 404
+    return send_file(os.path.abspath(path), mimetype="text/plain", as_attachment=True,
+                     download_name=f"profile_{profile_id}.folded")
+
 # ─────────────── Helper: Concept-map Pydantic ──────────────
 
 def _is_concept_map(obj) -> bool:
@@ -39,8 +158,24 @@ def _is_concept_map(obj) -> bool:
         and hasattr(obj, "linkDataArray")
     )
 
-# regex tipo “esame di storia”
-EXAM_RE = re.compile(r"(?:esame|quiz|test)\s+(?:di|su|in)\s+([\w\sàèéìòù]+)", re.I)
+def _dispatch_route(r: Route) -> dict:
+    """Esegue direttamente la funzione associata all'intento riconosciuto dal router."""
+    if r.intent == "exam":
+        exam = generate_exam(r.topic.title(), r.n or 5, "medium", subject=r.subject)
+        return {"exam": exam.model_dump()}
+    if r.intent == "concept_map":
+        cm = flights.do(make_key("concept_map", topic=r.topic, max_nodes=20, top_k=8),
+                        lambda: generate_concept_map(topic=r.topic))
+        return {"concept_map": cm.model_dump(by_alias=True)}
+    if r.intent == "lesson_plan":
+        plan = generate_custom_lesson_plan(
+            subject=r.topic, topic=r.topic, grade="Scuola Elementare", lesson_minutes=45,
+        )
+        return {"plan": plan.model_dump()}
+    if r.intent == "summary":
+        payload = summarize_topic_and_optional_file(topic=r.topic)
+        return {"summary": payload.model_dump()}
+    raise ValueError(f"intent non gestito: {r.intent}")
 
 # ───────────────────────── Routes ──────────────────────────
 
@@ -56,38 +191,95 @@ def ask():
     if not query:
         return jsonify({"error": "No question provided."}), 400
 
-    # Quick-quiz?
-    m = EXAM_RE.search(query)
-    if m:
-        subject = m.group(1).strip().title()
+    client_id = _client_id(data)
+
+    # Router locale: richieste note → funzione diretta, senza agente
+    r = route_intent(query)
+    if r:
         try:
-            exam = generate_exam(subject, 5, "medium")
-            return jsonify({"exam": exam.model_dump()})
+            payload = _dispatch_route(r)
         except Exception:
-            logging.exception("Exam generation failed")
-            return jsonify({"error": "Exam generation failed"}), 500
+            logging.exception("Routed %s failed", r.intent)
+            return jsonify({"error": "generation failed"}), 500
+        record_turn(client_id, query, f"[{r.intent} generato su: {r.topic}]")
+        return jsonify(payload)
 
-    # LLM / tools
+    # LLM / tools (con memoria: riassunto + ultimi turni)
     try:
-        response = agent.invoke({"input": query, "chat_history": []})
+        response = agent.invoke({"input": query, "chat_history": get_chat_history(client_id)})
         if _is_concept_map(response):
+            record_turn(client_id, query, "[mappa concettuale generata]")
             return jsonify({"concept_map": response.model_dump(by_alias=True)})
 
         if isinstance(response, dict):
             out = response.get("output")
-            if _is_concept_map(out):
-                return jsonify({"concept_map": out.model_dump(by_alias=True)})
-            if isinstance(out, dict) and {"nodeDataArray", "linkDataArray"} <= out.keys():
-                return jsonify({"concept_map": out})
+            if _is_concept_map(out) or (isinstance(out, dict) and {"nodeDataArray", "linkDataArray"} <= out.keys()):
+                record_turn(client_id, query, "[mappa concettuale generata]")
+                return jsonify({"concept_map": out.model_dump(by_alias=True) if _is_concept_map(out) else out})
             if out is not None:
+                record_turn(client_id, query, str(out))
                 return jsonify({"answer": out})
             if {"nodeDataArray", "linkDataArray"} <= response.keys():
+                record_turn(client_id, query, "[mappa concettuale generata]")
                 return jsonify({"concept_map": response})
+        record_turn(client_id, query, str(response))
         return jsonify({"answer": response})
     except Exception:
         logging.exception("Agent error")
         return jsonify({"error": "Internal server error."}), 500
 
+@app.post("/reset_conversation")
+def reset_conversation_ep():
+    client_id = _client_id(request.get_json(silent=True))
+    if not client_id:
+        return jsonify({"error": "client_id mancante"}), 400
+    try:
+        clear_conversation(client_id)
+        return jsonify({"ok": True})
+    except Exception:
+        logging.exception("Reset conversation failed")
+        return jsonify({"error": "reset failed"}), 500
+
+@app.get("/router_stats")
+def router_stats_ep():
+    return jsonify(router_stats())
+
+@app.get("/agent_stats")
+def agent_stats_ep():
+    return jsonify(agent.stats())
+
+@app.get("/singleflight_stats")
+def singleflight_stats_ep():
+    return jsonify(flights.stats())
+
+@app.get("/llm_stats")
+def llm_stats_ep():
+    return jsonify(gateway_stats())
+
+@app.get("/admission_stats")
+def admission_stats_ep():
+    return jsonify(admission.stats())
+
+@app.get("/structured_stats")
+def structured_stats_ep():
+    return jsonify(structured_stats())
+
+@app.get("/artifact_cache_stats")
+def artifact_cache_stats_ep():
+    return jsonify(artifact_cache_stats())
+
+@app.get("/slide_image_stats")
+def slide_image_stats_ep():
+    return jsonify(slide_image_stats())
+
+@app.get("/brave_stats")
+def brave_stats_ep():
+    return jsonify(brave_stats())
+
+@app.get("/email_outbox_stats")
+def email_outbox_stats_ep():
+    return jsonify(email_outbox_stats())
+
 # -------------- quiz endpoints -----------------------------
 
 @app.post("/generate_exam")
@@ -98,7 +290,7 @@ def generate_exam_ep():
     n = int(req.get("n", 5))
     level = req.get("level", "medium")
     try:
-        exam = generate_exam(f"{subject}: {topic}", n, level)
+        exam = generate_exam(topic, n, level, subject=subject)
         return jsonify(exam.model_dump())
     except Exception:
         logging.exception("Exam generation failed")
@@ -112,50 +304,94 @@ def grade_exam_ep():
     result = grade_exam(exam, answers)
     return jsonify(result)
 
+@app.post("/grade_exam_bulk")
+def grade_exam_bulk_ep():
+    """
+    Body: {"exam": {...}, "submissions": {"<student_id>": {<qid>: <risposta>, ...}, ...}}
+    oppure "submissions": [{"student_id": "...", "answers": {...}}, ...]
+    """
+    data = request.get_json() or {}
+    if not isinstance(data.get("exam"), dict):
+        return jsonify({"error": "exam mancante"}), 400
+    try:
+        exam = Exam(**data["exam"])
+        subs = parse_submissions(data.get("submissions") or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not subs:
+        return jsonify({"error": "Nessuna consegna."}), 400
+    try:
+        return jsonify(grade_exam_bulk(exam, subs))
+    except Exception:
+        logging.exception("Bulk grading failed")
+        return jsonify({"error": "grading failed"}), 500
+
 # -------------- lesson-plan endpoint -----------------------
 
+def _sse_response(events, done=lambda obj: obj.model_dump(by_alias=True)):
+    """
+    Eventi (tipo, oggetto) di una generazione in streaming → text/event-stream.
+    stream_with_context tiene aperto il contesto (e il ticket di ammissione) fino all'ultimo evento.
+    """
+    def gen():
+        try:
+            for kind, obj in events:
+                payload = done(obj) if kind == "done" else obj.model_dump(by_alias=True)
+                yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        except Exception:
+            logging.exception("Streaming generation failed")
+            yield f"event: error\ndata: {json.dumps({'error': 'generation failed'})}\n\n"
+    return Response(stream_with_context(gen()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/generate_plan")
 def generate_plan():
     data = request.get_json() or {}
-    plan = generate_custom_lesson_plan(
+    params = dict(
         subject        = data.get("subject", "Storia"),
         topic          = data.get("topic",   "Argomento"),
         grade          = data.get("grade",   "Scuola Elementare"),
         lesson_minutes = int(data.get("lesson_minutes", 45)),
         global_goals   = data.get("global_goals", ""),
     )
+    if data.get("stream"):
+        # lezioni una alla volta mentre il modello genera (niente coalescenza: ogni stream è suo)
+        return _sse_response(stream_custom_lesson_plan(**params))
+    plan = flights.do(make_key("plan", **params), lambda: generate_custom_lesson_plan(**params))
     return jsonify(plan.model_dump())
 
 # -------------- PDF exporter -------------------------------
 
+def _send_artifact(art: Artifact, filename: str):
+    # ETag = hash del modello: un GET condizionale su /artifacts/<id> torna 304 da solo
+    resp = send_file(os.path.abspath(art.path), mimetype=art.mimetype, as_attachment=True,
+                     download_name=filename, etag=art.digest, conditional=True)
+    resp.headers["X-Artifact-Id"] = art.digest
+    return resp
+
+def _not_modified(digest: str):
+    return Response(status=304, headers={"ETag": etag_for(digest), "X-Artifact-Id": digest})
+
 @app.post("/plan_pdf")
 def plan_pdf():
     data = request.get_json() or {}
     plan = LessonPlan(**data["plan"])
 
-    rows = [["#", "Titolo", "Obiettivi", "Attività", "Materiali"]]
-    for i, l in enumerate(plan.lessons, start=1):
-        rows.append([
-            str(i),
-            l.title,
-            "\n".join(l.objectives),
-            "\n".join(l.activities),
-            "\n".join(l.materials or []),
-        ])
-
-    buf = BytesIO()
-    pdf = SimpleDocTemplate(buf, pagesize=A4)
-    tbl = Table(rows, repeatRows=1)
-    tbl.setStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E0E0E0")),
-        ("GRID", (0,0), (-1,-1), 0.25, colors.grey),
-        ("VALIGN", (0,0), (-1,-1), "TOP"),
-    ])
-    pdf.build([tbl])
-    buf.seek(0)
-
-    fname = f"piano_{plan.subject}_{plan.topic}.pdf"
-    return send_file(buf, download_name=fname, as_attachment=True)
+    # stesso piano → stesso hash: niente rendering (né lettura del file) se il client ce l'ha già
+    digest = model_digest("plan_pdf", plan)
+    if etag_matches(request.headers.get("If-None-Match"), digest):
+        return _not_modified(digest)
+    art = plan_pdf_artifact(plan, digest)
+    return _send_artifact(art, f"piano_{plan.subject}_{plan.topic}.pdf")
+
+@app.get("/artifacts/<digest>")
+def artifact_download(digest: str):
+    if etag_matches(request.headers.get("If-None-Match"), digest):
+        return _not_modified(digest)
+    art = artifacts.get(digest)
+    if art is None:
+        return jsonify({"error": "artefatto non trovato (rimosso dalla cache?)"}), 404
+    return _send_artifact(art, os.path.basename(request.args.get("name") or "") or os.path.basename(art.path))
 
 
 # -------------- concept-map endpoint -----------------------
@@ -167,18 +403,69 @@ def generate_concept_map_ep():
     topic   = (data.get("topic") or subject or "Argomento").strip()
     max_nodes = int(data.get("max_nodes", 20))
     top_k     = int(data.get("top_k", 8))
+    lazy      = bool(data.get("lazy"))
+    engine    = (data.get("engine") or "llm").strip().lower()   # "llm" | "fast" (senza LLM, dai chunk RAG)
 
     if not topic:
         return jsonify({"error": "topic mancante"}), 400
 
     try:
-        cm: ConceptMap = generate_concept_map(topic=topic, max_nodes=max_nodes, top_k=top_k)
+        if engine == "fast":
+            cm = flights.do(
+                make_key("concept_map_fast", topic=topic, max_nodes=max_nodes, top_k=top_k),
+                lambda: fast_concept_map(topic=topic, max_nodes=max_nodes, top_k=top_k),
+            )
+            return jsonify(cm.model_dump(by_alias=True))
+        if data.get("stream"):
+            return _sse_response(stream_concept_map(topic=topic, max_nodes=max_nodes, top_k=top_k))
+        if lazy:
+            # solo root + categorie: i sotto-nodi arrivano da /expand_concept_node quando servono
+            max_categories = int(data.get("max_categories", 8))
+            cm = flights.do(
+                make_key("concept_outline", topic=topic, max_categories=max_categories, top_k=top_k),
+                lambda: generate_concept_outline(topic=topic, max_categories=max_categories, top_k=top_k),
+            )
+            return jsonify(cm.model_dump(by_alias=True))
+        # richieste identiche concorrenti (stessa classe, stesso argomento) → un solo calcolo
+        cm: ConceptMap = flights.do(
+            make_key("concept_map", topic=topic, max_nodes=max_nodes, top_k=top_k),
+            lambda: generate_concept_map(topic=topic, max_nodes=max_nodes, top_k=top_k),
+        )
         # by_alias=True per avere "from" nei link
         return jsonify(cm.model_dump(by_alias=True))
     except Exception:
         logging.exception("Concept map generation failed")
         return jsonify({"error": "generation failed"}), 500
 
+@app.post("/expand_concept_node")
+def expand_concept_node_ep():
+    """
+    JSON: {"topic", "key", "text", "path": [testi degli antenati], "exclude": [etichette già nella mappa],
+           "max_children", "top_k"} → solo i nodi/link nuovi sotto `key`.
+    """
+    data = request.get_json() or {}
+    topic = (data.get("topic") or "").strip()
+    key   = (data.get("key") or "").strip()
+    text  = (data.get("text") or "").strip()
+    if not topic or not key or not text:
+        return jsonify({"error": "topic, key e text sono obbligatori"}), 400
+    path    = [str(p) for p in data.get("path") or []]
+    exclude = [str(x) for x in data.get("exclude") or []]
+    max_children = min(10, int(data.get("max_children", 6)))
+    top_k        = int(data.get("top_k", 4))
+
+    try:
+        cm: ConceptMap = flights.do(
+            make_key("concept_expand", topic=topic, key=key, text=text, path=path, exclude=exclude,
+                     max_children=max_children, top_k=top_k),
+            lambda: expand_concept_node(topic, key, text, path=path, exclude=exclude,
+                                        max_children=max_children, top_k=top_k),
+        )
+        return jsonify(cm.model_dump(by_alias=True))
+    except Exception:
+        logging.exception("Concept node expansion failed")
+        return jsonify({"error": "expansion failed"}), 500
+
 # -------------- slide-deck endpoint ------------------------
 @app.post("/generate_slides")
 def generate_slides_ep():
@@ -186,21 +473,44 @@ def generate_slides_ep():
     subject  = (data.get("subject") or "Materia").strip()
     topic    = (data.get("topic")   or "Argomento").strip()
     n_slides = int(data.get("n_slides", 10))
+    images   = bool(data.get("images", False))       # un'immagine web per slide
+    fname = f"slides_{subject}_{topic}.pptx".replace(" ", "_")
+    if data.get("stream"):
+        # outline slide per slide, poi il link al PPTX nella cache degli artefatti
+        return _sse_response(
+            stream_slides_artifact(subject, topic, n_slides, images),
+            done=lambda art: {"artifact_id": art.digest, "filename": fname,
+                              "url": f"/artifacts/{art.digest}?name={quote(fname)}"},
+        )
     try:
-        buf = generate_slides_pptx(subject, topic, n_slides)
-        fname = f"slides_{subject}_{topic}.pptx".replace(" ", "_")
-        return send_file(
-            buf,
-            as_attachment=True,
-            download_name=fname,
-            mimetype="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        # le richieste coalescenti condividono lo stesso file in cache (riscaricabile da /artifacts/<id>)
+        art = flights.do(
+            make_key("slides", subject=subject, topic=topic, n_slides=n_slides, images=images),
+            lambda: generate_slides_artifact(subject, topic, n_slides, images),
         )
+        return _send_artifact(art, fname)
     except Exception:
         logging.exception("Slide generation failed")
         return jsonify({"error": "generation failed"}), 500
 
 
+# -------------- email outbox ------------------------------
+@app.get("/email_outbox/<message_id>")
+def email_outbox_status(message_id: str):
+    m = get_outbox().get(message_id)
+    if not m:
+        return jsonify({"error": "messaggio non trovato"}), 404
+    return jsonify(m.to_dict())
+
 # -------------- summarize endpoint -------------------------
+def _upload_digest(upfile) -> str | None:
+    """Hash del contenuto caricato (chiave di coalescenza); riavvolge lo stream."""
+    if not upfile:
+        return None
+    digest = hashlib.sha256(upfile.stream.read()).hexdigest()
+    upfile.stream.seek(0)
+    return digest
+
 @app.post("/summarize")
 def summarize_ep():
     # Supporta sia JSON (senza file) che multipart/form-data (con file)
@@ -211,7 +521,9 @@ def summarize_ep():
         if not topic and not upfile:
             return jsonify({"error": "Specifica un argomento o allega un file."}), 400
         try:
-            payload = summarize_topic_and_optional_file(topic=topic, length=length, file_storage=upfile)
+            key = make_key("summarize", topic=topic, length=length, file=_upload_digest(upfile))
+            payload = flights.do(key, lambda: summarize_topic_and_optional_file(
+                topic=topic, length=length, file_storage=upfile))
             return jsonify(payload.model_dump())
         except Exception:
             logging.exception("Summarization failed (multipart)")
@@ -224,13 +536,123 @@ def summarize_ep():
         if not topic and not text:
             return jsonify({"error": "Specifica un argomento o del testo."}), 400
         try:
-            payload = summarize_topic_and_optional_file(topic=topic, length=length, file_storage=None, plain_text=text)
+            payload = flights.do(
+                make_key("summarize", topic=topic, length=length, text=text),
+                lambda: summarize_topic_and_optional_file(topic=topic, length=length, file_storage=None, plain_text=text),
+            )
             return jsonify(payload.model_dump())
         except Exception:
             logging.exception("Summarization failed (json)")
             return jsonify({"error": "summarization failed"}), 500
 
 
+
+# -------------- background jobs ----------------------------
+
+@app.post("/jobs")
+def submit_job():
+    """
+    JSON: {"kind": "slides|plan|summarize|exam", "params": {...}, "priority": 0-9 (opz.)}
+    multipart (solo summarize con file): campi kind, topic, length, priority + file.
+    """
+    if request.content_type and request.content_type.startswith("multipart/form-data"):
+        src = request.form
+        kind = (src.get("kind") or "summarize").strip()
+        params_src, priority = src, src.get("priority")
+    else:
+        data = request.get_json() or {}
+        kind = (data.get("kind") or "").strip()
+        params_src, priority = data.get("params") or {}, data.get("priority")
+        src = data
+    try:
+        params = job_params(kind, params_src)
+        priority = parse_priority(priority)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    client_id = _client_id(src)
+    if not client_id:
+        return jsonify({"error": "client_id mancante"}), 400
+
+    upfile = request.files.get("file") if kind == "summarize" else None
+    if upfile:
+        os.makedirs(os.path.join(JOBS_DIR, "uploads"), exist_ok=True)
+        suffix = os.path.splitext(upfile.filename or "")[1] or ".pdf"
+        path = os.path.join(JOBS_DIR, "uploads", f"{uuid.uuid4().hex}{suffix}")
+        upfile.save(path)
+        params["upload_path"] = path
+    if kind == "summarize" and not (params["topic"] or params["text"] or upfile):
+        return jsonify({"error": "Specifica un argomento, del testo o un file."}), 400
+
+    try:
+        job = get_job_manager().submit(
+            kind, params, client_id=client_id, priority=priority,
+        )
+    except QueueFull as e:
+        if params.get("upload_path"):
+            os.unlink(params["upload_path"])     # il job non partirà: nessuno lo cancellerebbe
+        return jsonify({"error": str(e)}), 503
+    return jsonify(job.to_dict()), 202
+
+def _own_job(job_id: str):
+    """Job del client che fa la richiesta (X-Client-Id / ?client_id=); None altrimenti."""
+    client_id = _client_id()
+    job = get_job_manager().get(job_id)
+    if not client_id or job is None or job.client_id != client_id:
+        return None
+    return job
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id: str):
+    job = _own_job(job_id)
+    if not job:
+        return jsonify({"error": "job non trovato"}), 404
+    return jsonify(job.to_dict())
+
+@app.get("/jobs/<job_id>/events")
+def job_events(job_id: str):
+    if not _own_job(job_id):
+        return jsonify({"error": "job non trovato"}), 404
+    return Response(sse_stream(job_id), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/<job_id>/result")
+def job_result(job_id: str):
+    job = _own_job(job_id)
+    if not job:
+        return jsonify({"error": "job non trovato (scaduto? usa /events/<event_id>)"}), 404
+    if job.status == "failed":
+        return jsonify({"error": job.error or "job fallito"}), 500
+    if job.status != "done":
+        return jsonify(job.to_dict()), 202
+    if job.file_path:
+        return send_file(job.file_path, as_attachment=True,
+                         download_name=job_file_name(job.kind, job.result or {}, job.file_path))
+    return jsonify(job.result)
+
+# -------------- storico eventi (riscarica senza rigenerare) --
+
+@app.get("/events")
+def events_list():
+    client_id = _client_id()
+    if not client_id:
+        return jsonify({"error": "client_id mancante"}), 400
+    return jsonify(list_events(client_id, limit=int(request.args.get("limit", 100))))
+
+@app.get("/events/<int:event_id>")
+def event_detail(event_id: int):
+    client_id = _client_id()
+    if not client_id:
+        return jsonify({"error": "client_id mancante"}), 400
+    ev = get_event(event_id, client_id)
+    if not ev:
+        return jsonify({"error": "evento non trovato"}), 404
+    if ev.get("file_path") and os.path.exists(ev["file_path"]):
+        return send_file(ev["file_path"], as_attachment=True,
+                         download_name=job_file_name(ev["kind"], ev.get("data") or {}, ev["file_path"]))
+    ev["created_at"] = ev["created_at"].isoformat() if ev.get("created_at") else None
+    return jsonify(ev)
+
 # ────────────────────────────────────────────────────────────
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,687 @@
+"""
+asgi.py – modalità di serving ASGI (FastAPI + uvicorn)
+------------------------------------------------------
+Stessi endpoint di app.py, ma asincroni: le chiamate LLM usano ainvoke,
+il RAG e la memoria conversazione usano un pool asyncpg, Brave usa httpx.
+Un solo processo può così tenere in volo centinaia di generazioni lente.
+
+Avvio:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+"""
+from __future__ import annotations
+from dotenv import load_dotenv
+load_dotenv()
+import asyncio, hashlib, json, logging, os, uuid
+from urllib.parse import quote
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match
+from pydantic import BaseModel
+
+from agent import create_agent
+from clients.async_db import close_pool
+from clients.exam_tool import Exam, agenerate_exam, grade_exam, grade_exam_bulk, parse_submissions
+from clients.concept_map_tool import aexpand_concept_node, agenerate_concept_map, agenerate_concept_outline, astream_concept_map
+from clients.fast_concept_map import afast_concept_map
+from clients.lesson_plan_tool import (
+    LessonPlan,
+    agenerate_custom_lesson_plan,
+    astream_custom_lesson_plan,
+    plan_pdf_artifact,
+)
+from clients.slide_tool import agenerate_slides_artifact, astream_slides_artifact
+from clients.summarize_tool import asummarize_topic_and_optional_file
+from clients.question_bank import ensure_bank_schema
+from clients.intent_router import Route, route as route_intent, router_stats
+from clients.history_store import ensure_conversation_schema, ensure_history_schema, get_event, list_events
+from clients.jobs import JOBS_DIR, QueueFull, get_job_manager, job_file_name, job_params, parse_priority, sse_stream
+from clients.conversation_memory import aget_chat_history, arecord_turn, clear_conversation
+from clients.singleflight import flights, make_key
+from clients.llm_gateway import gateway_stats
+from clients.admission import Rejected, admission
+from clients.structured import structured_stats
+from clients.slide_images import slide_image_stats
+from clients.email_outbox import email_outbox_stats, get_outbox
+from clients.web_search_tool import aclose_brave_client, brave_stats
+from clients.artifact_cache import Artifact, artifact_cache_stats, artifacts, etag_for, etag_matches, model_digest
+from clients.telemetry import begin_request, end_request, metrics_payload
+from clients import profiler
+
+# ───────────────────────── Config ──────────────────────────
+logging.basicConfig(level=logging.INFO)
+
+app = FastAPI(title="llm-MCP")
+app.mount("/static", StaticFiles(directory="static"), name="static")
+agent = create_agent()
+
+
+@app.on_event("startup")
+async def _startup() -> None:
+    # executor di default: campiona i thread di to_thread per le richieste profilate
+    asyncio.get_running_loop().set_default_executor(profiler.ProfilingExecutor(thread_name_prefix="asyncio"))
+    try:
+        await asyncio.to_thread(ensure_bank_schema)
+        await asyncio.to_thread(ensure_conversation_schema)
+        await asyncio.to_thread(ensure_history_schema)
+    except Exception:
+        logging.warning("Schema DB non inizializzato (DB non raggiungibile?)")
+
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    await close_pool()
+    await aclose_brave_client()
+
+
+# il più interno: profila solo le richieste ammesse
+@app.middleware("http")
+async def _profile(request: Request, call_next):
+    if not profiler.should_profile(request.url.path, request.headers.get("X-Profile"),
+                                   request.headers.get("X-Profile-Token")):
+        return await call_next(request)
+    prof = profiler.start(request.url.path)
+    token = profiler.activate(prof)      # la ereditano i task della richiesta e to_thread
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await asyncio.to_thread(prof.finish)
+        raise
+    finally:
+        profiler.deactivate(token)
+    response.headers["X-Profile-Id"] = prof.id
+    body = response.body_iterator
+
+    async def _body_then_finish():   # il profilo copre anche il corpo (SSE, streaming)
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            await asyncio.to_thread(prof.finish)
+    response.body_iterator = _body_then_finish()
+    return response
+
+
+@app.middleware("http")
+async def _admission(request: Request, call_next):
+    # qui il body non è ancora letto: il client_id (sotto-quota) arriva solo da header/query
+    if request.method != "POST":
+        return await call_next(request)
+    ip = request.client.host if request.client else ""
+    client_id = request.headers.get("X-Client-Id") or request.query_params.get("client_id")
+    try:
+        ticket = admission.admit(request.url.path, ip, client_id)
+    except Rejected as e:
+        return JSONResponse(
+            {"error": "Server occupato, riprova tra poco.", "reason": e.reason},
+            status_code=429, headers={"Retry-After": str(e.retry_after)},
+        )
+    if ticket is None:
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        admission.release(ticket)
+        raise
+    # la capacità si libera a body inviato: per gli stream SSE è la fine della generazione
+    body = response.body_iterator
+
+    async def _release_after_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            admission.release(ticket)
+
+    response.body_iterator = _release_after_body()
+    return response
+
+
+# registrato dopo l'ammissione: i middleware aggiunti dopo sono i più esterni,
+# così anche le risposte 429 finiscono nelle metriche
+@app.middleware("http")
+async def _telemetry(request: Request, call_next):
+    route = next((r.path for r in app.router.routes
+                  if r.matches(request.scope)[0] == Match.FULL), "unmatched")
+    state = begin_request(route)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["Server-Timing"] = end_request(state, request.method, status)
+        state = None
+        return response
+    finally:
+        if state is not None:
+            end_request(state, request.method, status)
+
+
+@app.get("/metrics")
+async def metrics_ep():
+    body, content_type = metrics_payload()
+    return Response(body, media_type=content_type)
+
+
+@app.get("/profiling")
+@app.post("/profiling")
+async def profiling_settings_ep(request: Request):
+    if not profiler.authorized(request.headers.get("X-Profile-Token")):
+        return _error("forbidden", 403)
+    if request.method == "POST":
+        data = await _json(request)
+        return profiler.configure(data.get("sample_rate", 0), data.get("endpoints"))
+    return profiler.settings()
+
+@app.get("/profiles")
+async def profiles_ep(request: Request):
+    if not profiler.authorized(request.headers.get("X-Profile-Token")):
+        return _error("forbidden", 403)
+    return profiler.list_profiles()
+
+@app.get("/profiles/{profile_id}")
+async def profile_download_ep(profile_id: str, request: Request):
+    if not profiler.authorized(request.headers.get("X-Profile-Token")):
+        return _error("forbidden", 403)
+    path = profiler.profile_path(profile_id)
+    if path is None or not os.path.exists(path):
+        return _error("profilo non trovato", 404)
+    return FileResponse(path, media_type="text/plain", filename=f"profile_{profile_id}.folded")
+
+
+def _error(msg: str, status: int) -> JSONResponse:
+    return JSONResponse({"error": msg}, status_code=status)
+
+def _client_id(request: Request, data: Optional[dict] = None) -> str:
+    return ((data or {}).get("client_id") or request.headers.get("X-Client-Id")
+            or request.query_params.get("client_id") or "").strip()
+
+def _is_concept_map(obj) -> bool:
+    return (
+        isinstance(obj, BaseModel)
+        and hasattr(obj, "nodeDataArray")
+        and hasattr(obj, "linkDataArray")
+    )
+
+async def _json(request: Request) -> dict:
+    try:
+        return await request.json() or {}
+    except Exception:
+        return {}
+
+async def _dispatch_route(r: Route) -> dict:
+    if r.intent == "exam":
+        exam = await agenerate_exam(r.topic.title(), r.n or 5, "medium", subject=r.subject)
+        return {"exam": exam.model_dump()}
+    if r.intent == "concept_map":
+        cm = await flights.ado(make_key("concept_map", topic=r.topic, max_nodes=20, top_k=8),
+                               lambda: agenerate_concept_map(topic=r.topic))
+        return {"concept_map": cm.model_dump(by_alias=True)}
+    if r.intent == "lesson_plan":
+        plan = await agenerate_custom_lesson_plan(
+            subject=r.topic, topic=r.topic, grade="Scuola Elementare", lesson_minutes=45,
+        )
+        return {"plan": plan.model_dump()}
+    if r.intent == "summary":
+        payload = await asummarize_topic_and_optional_file(topic=r.topic)
+        return {"summary": payload.model_dump()}
+    raise ValueError(f"intent non gestito: {r.intent}")
+
+# ───────────────────────── Routes ──────────────────────────
+
+@app.get("/")
+async def index():
+    return FileResponse("templates/index.html")
+
+# -------------- /ask (chat + quick-quiz) -------------------
+@app.post("/ask")
+async def ask(request: Request):
+    data = await _json(request)
+    query = (data.get("question") or "").strip()
+    if not query:
+        return _error("No question provided.", 400)
+
+    client_id = _client_id(request, data)
+
+    r = route_intent(query)
+    if r:
+        try:
+            payload = await _dispatch_route(r)
+        except Exception:
+            logging.exception("Routed %s failed", r.intent)
+            return _error("generation failed", 500)
+        await arecord_turn(client_id, query, f"[{r.intent} generato su: {r.topic}]")
+        return payload
+
+    try:
+        history = await aget_chat_history(client_id)
+        response = await agent.ainvoke({"input": query, "chat_history": history})
+        if _is_concept_map(response):
+            await arecord_turn(client_id, query, "[mappa concettuale generata]")
+            return {"concept_map": response.model_dump(by_alias=True)}
+
+        if isinstance(response, dict):
+            out = response.get("output")
+            if _is_concept_map(out) or (isinstance(out, dict) and {"nodeDataArray", "linkDataArray"} <= out.keys()):
+                await arecord_turn(client_id, query, "[mappa concettuale generata]")
+                return {"concept_map": out.model_dump(by_alias=True) if _is_concept_map(out) else out}
+            if out is not None:
+                await arecord_turn(client_id, query, str(out))
+                return {"answer": out}
+            if {"nodeDataArray", "linkDataArray"} <= response.keys():
+                await arecord_turn(client_id, query, "[mappa concettuale generata]")
+                return {"concept_map": response}
+        await arecord_turn(client_id, query, str(response))
+        return {"answer": response}
+    except Exception:
+        logging.exception("Agent error")
+        return _error("Internal server error.", 500)
+
+@app.post("/reset_conversation")
+async def reset_conversation_ep(request: Request):
+    client_id = _client_id(request, await _json(request))
+    if not client_id:
+        return _error("client_id mancante", 400)
+    try:
+        await asyncio.to_thread(clear_conversation, client_id)
+        return {"ok": True}
+    except Exception:
+        logging.exception("Reset conversation failed")
+        return _error("reset failed", 500)
+
+@app.get("/router_stats")
+async def router_stats_ep():
+    return router_stats()
+
+@app.get("/agent_stats")
+async def agent_stats_ep():
+    return agent.stats()
+
+@app.get("/singleflight_stats")
+async def singleflight_stats_ep():
+    return flights.stats()
+
+@app.get("/llm_stats")
+async def llm_stats_ep():
+    return gateway_stats()
+
+@app.get("/admission_stats")
+async def admission_stats_ep():
+    return admission.stats()
+
+@app.get("/structured_stats")
+async def structured_stats_ep():
+    return structured_stats()
+
+@app.get("/artifact_cache_stats")
+async def artifact_cache_stats_ep():
+    return artifact_cache_stats()
+
+@app.get("/slide_image_stats")
+async def slide_image_stats_ep():
+    return slide_image_stats()
+
+@app.get("/brave_stats")
+async def brave_stats_ep():
+    return brave_stats()
+
+@app.get("/email_outbox_stats")
+async def email_outbox_stats_ep():
+    return email_outbox_stats()
+
+# -------------- quiz endpoints -----------------------------
+
+@app.post("/generate_exam")
+async def generate_exam_ep(request: Request):
+    req = await _json(request)
+    subject = req.get("subject", "Storia")
+    topic = req.get("topic", subject)
+    n = int(req.get("n", 5))
+    level = req.get("level", "medium")
+    try:
+        exam = await agenerate_exam(topic, n, level, subject=subject)
+        return exam.model_dump()
+    except Exception:
+        logging.exception("Exam generation failed")
+        return _error("generation failed", 500)
+
+@app.post("/grade_exam")
+async def grade_exam_ep(request: Request):
+    data = await _json(request)
+    exam = Exam(**data["exam"])
+    answers = data.get("answers", {})
+    # il grading parallelizza già internamente (thread): qui basta non bloccare il loop
+    return await asyncio.to_thread(grade_exam, exam, answers)
+
+@app.post("/grade_exam_bulk")
+async def grade_exam_bulk_ep(request: Request):
+    data = await _json(request)
+    if not isinstance(data.get("exam"), dict):
+        return _error("exam mancante", 400)
+    try:
+        exam = Exam(**data["exam"])
+        subs = parse_submissions(data.get("submissions") or {})
+    except ValueError as e:
+        return _error(str(e), 400)
+    if not subs:
+        return _error("Nessuna consegna.", 400)
+    try:
+        return await asyncio.to_thread(grade_exam_bulk, exam, subs)
+    except Exception:
+        logging.exception("Bulk grading failed")
+        return _error("grading failed", 500)
+
+# -------------- lesson-plan endpoint -----------------------
+
+def _sse_response(events, done=lambda obj: obj.model_dump(by_alias=True)) -> StreamingResponse:
+    """Eventi (tipo, oggetto) di una generazione in streaming → text/event-stream."""
+    async def gen():
+        try:
+            async for kind, obj in events:
+                payload = done(obj) if kind == "done" else obj.model_dump(by_alias=True)
+                yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        except Exception:
+            logging.exception("Streaming generation failed")
+            yield f"event: error\ndata: {json.dumps({'error': 'generation failed'})}\n\n"
+    return StreamingResponse(gen(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/generate_plan")
+async def generate_plan(request: Request):
+    data = await _json(request)
+    params = dict(
+        subject        = data.get("subject", "Storia"),
+        topic          = data.get("topic",   "Argomento"),
+        grade          = data.get("grade",   "Scuola Elementare"),
+        lesson_minutes = int(data.get("lesson_minutes", 45)),
+        global_goals   = data.get("global_goals", ""),
+    )
+    if data.get("stream"):
+        # lezioni una alla volta mentre il modello genera (niente coalescenza: ogni stream è suo)
+        return _sse_response(astream_custom_lesson_plan(**params))
+    plan = await flights.ado(make_key("plan", **params), lambda: agenerate_custom_lesson_plan(**params))
+    return plan.model_dump()
+
+# -------------- PDF exporter -------------------------------
+
+def _send_artifact(art: Artifact, filename: str) -> FileResponse:
+    return FileResponse(art.path, media_type=art.mimetype, filename=filename,
+                        headers={"ETag": art.etag, "X-Artifact-Id": art.digest})
+
+def _not_modified(digest: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag_for(digest), "X-Artifact-Id": digest})
+
+@app.post("/plan_pdf")
+async def plan_pdf(request: Request):
+    data = await _json(request)
+    plan = LessonPlan(**data["plan"])
+    # stesso piano → stesso hash: niente rendering (né lettura del file) se il client ce l'ha già
+    digest = model_digest("plan_pdf", plan)
+    if etag_matches(request.headers.get("if-none-match"), digest):
+        return _not_modified(digest)
+    art = await asyncio.to_thread(plan_pdf_artifact, plan, digest)
+    return _send_artifact(art, f"piano_{plan.subject}_{plan.topic}.pdf")
+
+@app.get("/artifacts/{digest}")
+async def artifact_download(digest: str, request: Request):
+    if etag_matches(request.headers.get("if-none-match"), digest):
+        return _not_modified(digest)
+    art = await asyncio.to_thread(artifacts.get, digest)
+    if art is None:
+        return _error("artefatto non trovato (rimosso dalla cache?)", 404)
+    return _send_artifact(art, os.path.basename(request.query_params.get("name") or "") or os.path.basename(art.path))
+
+# -------------- concept-map endpoint -----------------------
+
+@app.post("/generate_concept_map")
+async def generate_concept_map_ep(request: Request):
+    data = await _json(request)
+    subject = (data.get("subject") or "").strip()
+    topic   = (data.get("topic") or subject or "Argomento").strip()
+    max_nodes = int(data.get("max_nodes", 20))
+    top_k     = int(data.get("top_k", 8))
+    lazy      = bool(data.get("lazy"))
+    engine    = (data.get("engine") or "llm").strip().lower()   # "llm" | "fast" (senza LLM, dai chunk RAG)
+
+    if not topic:
+        return _error("topic mancante", 400)
+
+    try:
+        if engine == "fast":
+            cm = await flights.ado(
+                make_key("concept_map_fast", topic=topic, max_nodes=max_nodes, top_k=top_k),
+                lambda: afast_concept_map(topic=topic, max_nodes=max_nodes, top_k=top_k),
+            )
+            return cm.model_dump(by_alias=True)
+        if data.get("stream"):
+            return _sse_response(astream_concept_map(topic=topic, max_nodes=max_nodes, top_k=top_k))
+        if lazy:
+            # solo root + categorie: i sotto-nodi arrivano da /expand_concept_node quando servono
+            max_categories = int(data.get("max_categories", 8))
+            cm = await flights.ado(
+                make_key("concept_outline", topic=topic, max_categories=max_categories, top_k=top_k),
+                lambda: agenerate_concept_outline(topic=topic, max_categories=max_categories, top_k=top_k),
+            )
+            return cm.model_dump(by_alias=True)
+        cm = await flights.ado(
+            make_key("concept_map", topic=topic, max_nodes=max_nodes, top_k=top_k),
+            lambda: agenerate_concept_map(topic=topic, max_nodes=max_nodes, top_k=top_k),
+        )
+        return cm.model_dump(by_alias=True)
+    except Exception:
+        logging.exception("Concept map generation failed")
+        return _error("generation failed", 500)
+
+@app.post("/expand_concept_node")
+async def expand_concept_node_ep(request: Request):
+    data = await _json(request)
+    topic = (data.get("topic") or "").strip()
+    key   = (data.get("key") or "").strip()
+    text  = (data.get("text") or "").strip()
+    if not topic or not key or not text:
+        return _error("topic, key e text sono obbligatori", 400)
+    path    = [str(p) for p in data.get("path") or []]
+    exclude = [str(x) for x in data.get("exclude") or []]
+    max_children = min(10, int(data.get("max_children", 6)))
+    top_k        = int(data.get("top_k", 4))
+
+    try:
+        cm = await flights.ado(
+            make_key("concept_expand", topic=topic, key=key, text=text, path=path, exclude=exclude,
+                     max_children=max_children, top_k=top_k),
+            lambda: aexpand_concept_node(topic, key, text, path=path, exclude=exclude,
+                                         max_children=max_children, top_k=top_k),
+        )
+        return cm.model_dump(by_alias=True)
+    except Exception:
+        logging.exception("Concept node expansion failed")
+        return _error("expansion failed", 500)
+
+# -------------- slide-deck endpoint ------------------------
+
+@app.post("/generate_slides")
+async def generate_slides_ep(request: Request):
+    data = await _json(request)
+    subject  = (data.get("subject") or "Materia").strip()
+    topic    = (data.get("topic")   or "Argomento").strip()
+    n_slides = int(data.get("n_slides", 10))
+    images   = bool(data.get("images", False))       # un'immagine web per slide
+    fname = f"slides_{subject}_{topic}.pptx".replace(" ", "_")
+    if data.get("stream"):
+        # outline slide per slide, poi il link al PPTX nella cache degli artefatti
+        return _sse_response(
+            astream_slides_artifact(subject, topic, n_slides, images),
+            done=lambda art: {"artifact_id": art.digest, "filename": fname,
+                              "url": f"/artifacts/{art.digest}?name={quote(fname)}"},
+        )
+    try:
+        # le richieste coalescenti condividono lo stesso file in cache (riscaricabile da /artifacts/<id>)
+        art = await flights.ado(
+            make_key("slides", subject=subject, topic=topic, n_slides=n_slides, images=images),
+            lambda: agenerate_slides_artifact(subject, topic, n_slides, images),
+        )
+        return _send_artifact(art, fname)
+    except Exception:
+        logging.exception("Slide generation failed")
+        return _error("generation failed", 500)
+
+# -------------- email outbox ------------------------------
+
+@app.get("/email_outbox/{message_id}")
+async def email_outbox_status(message_id: str):
+    m = get_outbox().get(message_id)
+    if not m:
+        return _error("messaggio non trovato", 404)
+    return m.to_dict()
+
+# -------------- summarize endpoint -------------------------
+
+@app.post("/summarize")
+async def summarize_ep(request: Request):
+    # Supporta sia JSON (senza file) che multipart/form-data (con file)
+    if (request.headers.get("content-type") or "").startswith("multipart/form-data"):
+        form = await request.form()
+        topic  = (form.get("topic") or "").strip()
+        length = (form.get("length") or "medium").strip().lower()
+        upfile = form.get("file")  # opzionale (UploadFile)
+        if not topic and not upfile:
+            return _error("Specifica un argomento o allega un file.", 400)
+        try:
+            file_bytes = await upfile.read() if upfile else None
+            digest = hashlib.sha256(file_bytes).hexdigest() if file_bytes else None
+            payload = await flights.ado(
+                make_key("summarize", topic=topic, length=length, file=digest),
+                lambda: asummarize_topic_and_optional_file(
+                    topic=topic, length=length, file_bytes=file_bytes,
+                    filename=getattr(upfile, "filename", None),
+                ),
+            )
+            return payload.model_dump()
+        except Exception:
+            logging.exception("Summarization failed (multipart)")
+            return _error("summarization failed", 500)
+    else:
+        data   = await _json(request)
+        topic  = (data.get("topic") or "").strip()
+        length = (data.get("length") or "medium").strip().lower()
+        text   = (data.get("text") or "").strip() or None
+        if not topic and not text:
+            return _error("Specifica un argomento o del testo.", 400)
+        try:
+            payload = await flights.ado(
+                make_key("summarize", topic=topic, length=length, text=text),
+                lambda: asummarize_topic_and_optional_file(topic=topic, length=length, plain_text=text),
+            )
+            return payload.model_dump()
+        except Exception:
+            logging.exception("Summarization failed (json)")
+            return _error("summarization failed", 500)
+
+
+# -------------- background jobs ----------------------------
+# I job girano sui thread del JobManager (come in app.py): qui solo accodamento e stato.
+
+@app.post("/jobs")
+async def submit_job(request: Request):
+    """Stesso formato di app.py: JSON {"kind", "params", "priority"} o multipart (summarize con file)."""
+    upfile = None
+    if (request.headers.get("content-type") or "").startswith("multipart/form-data"):
+        src = await request.form()
+        kind = (src.get("kind") or "summarize").strip()
+        params_src, priority = src, src.get("priority")
+        upfile = src.get("file") if kind == "summarize" else None
+        if not getattr(upfile, "filename", None):
+            upfile = None
+    else:
+        src = await _json(request)
+        kind = (src.get("kind") or "").strip()
+        params_src, priority = src.get("params") or {}, src.get("priority")
+    try:
+        params = job_params(kind, params_src)
+        priority = parse_priority(priority)
+    except (ValueError, TypeError) as e:
+        return _error(str(e), 400)
+
+    client_id = _client_id(request, src)
+    if not client_id:
+        return _error("client_id mancante", 400)
+    if kind == "summarize" and not (params["topic"] or params["text"] or upfile):
+        return _error("Specifica un argomento, del testo o un file.", 400)
+
+    if upfile:
+        suffix = os.path.splitext(upfile.filename or "")[1] or ".pdf"
+        path = os.path.join(JOBS_DIR, "uploads", f"{uuid.uuid4().hex}{suffix}")
+        await asyncio.to_thread(_save_upload, path, await upfile.read())
+        params["upload_path"] = path
+    try:
+        job = get_job_manager().submit(kind, params, client_id=client_id, priority=priority)
+    except QueueFull as e:
+        if params.get("upload_path"):
+            os.unlink(params["upload_path"])     # il job non partirà: nessuno lo cancellerebbe
+        return _error(str(e), 503)
+    return JSONResponse(job.to_dict(), status_code=202)
+
+def _save_upload(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(data)
+
+def _own_job(request: Request, job_id: str):
+    """Job del client che fa la richiesta (X-Client-Id / ?client_id=); None altrimenti."""
+    client_id = _client_id(request)
+    job = get_job_manager().get(job_id)
+    if not client_id or job is None or job.client_id != client_id:
+        return None
+    return job
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, request: Request):
+    job = _own_job(request, job_id)
+    if not job:
+        return _error("job non trovato", 404)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    if not _own_job(request, job_id):
+        return _error("job non trovato", 404)
+    # generatore sincrono (attese sul Condition del manager): Starlette lo itera in un thread
+    return StreamingResponse(sse_stream(job_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str, request: Request):
+    job = _own_job(request, job_id)
+    if not job:
+        return _error("job non trovato (scaduto? usa /events/<event_id>)", 404)
+    if job.status == "failed":
+        return _error(job.error or "job fallito", 500)
+    if job.status != "done":
+        return JSONResponse(job.to_dict(), status_code=202)
+    if job.file_path:
+        return FileResponse(job.file_path, filename=job_file_name(job.kind, job.result or {}, job.file_path))
+    return job.result
+
+# -------------- storico eventi (riscarica senza rigenerare) --
+
+@app.get("/events")
+async def events_list(request: Request):
+    client_id = _client_id(request)
+    if not client_id:
+        return _error("client_id mancante", 400)
+    return await asyncio.to_thread(list_events, client_id, int(request.query_params.get("limit", 100)))
+
+@app.get("/events/{event_id}")
+async def event_detail(event_id: int, request: Request):
+    client_id = _client_id(request)
+    if not client_id:
+        return _error("client_id mancante", 400)
+    ev = await asyncio.to_thread(get_event, event_id, client_id)
+    if not ev:
+        return _error("evento non trovato", 404)
+    if ev.get("file_path") and os.path.exists(ev["file_path"]):
+        return FileResponse(ev["file_path"],
+                            filename=job_file_name(ev["kind"], ev.get("data") or {}, ev["file_path"]))
+    ev["created_at"] = ev["created_at"].isoformat() if ev.get("created_at") else None
+    return ev
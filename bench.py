@@ -0,0 +1,262 @@
+"""
+bench.py – microbenchmark dei percorsi CPU-bound
+------------------------------------------------
+Misura le parti puramente Python eseguite a ogni richiesta e le confronta con
+una baseline (bench_baseline.json, o BENCH_BASELINE): se la mediana di un benchmark
+peggiora oltre la soglia (--threshold, default 20%) il comando esce con codice 1.
+
+Le dipendenze esterne non servono: LLM ed embedding girano in modalità stand-in
+e nessun benchmark tocca rete o DB.
+
+La baseline dipende dalla macchina e non è versionata (.gitignore): la genera la CI.
+In modalità CI (--ci, o variabile CI impostata) se manca viene creata dalla prima
+esecuzione completa, da conservare nella cache/artefatti del job (BENCH_BASELINE
+punta al file conservato); le esecuzioni successive confrontano con quella. La
+baseline registra macchina, versione di Python e soglia tollerata: il confronto usa
+quella soglia (salvo --threshold) e avvisa se la macchina è diversa. Fuori dalla CI
+una baseline mancante è un errore (codice 2), non un successo silenzioso; anche un
+benchmark saltato per dipendenze mancanti fa fallire la CI (codice 2).
+
+Uso:
+    python bench.py                       # confronto con la baseline
+    python bench.py --ci                  # come sopra; senza baseline la crea
+    python bench.py --save-baseline       # (ri)scrive la baseline su questa macchina
+    python bench.py -k pptx -k pdf        # solo i benchmark il cui nome contiene "pptx" o "pdf"
+"""
+from __future__ import annotations
+import os
+os.environ.setdefault("LLM_STANDIN", "1")        # niente client OpenAI reali all'import
+import argparse, glob, json, platform, random, statistics, sys, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BASELINE_PATH = os.getenv("BENCH_BASELINE") or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             "bench_baseline.json")
+DEFAULT_THRESHOLD = 0.20
+
+Setup = Callable[[], Callable[[], Any]]
+BENCHMARKS: Dict[str, Setup] = {}
+
+def bench(name: str):
+    def deco(setup: Setup) -> Setup:
+        BENCHMARKS[name] = setup
+        return setup
+    return deco
+
+
+# ───────────────────────── dati sintetici ─────────────────────────
+
+_rng = random.Random(42)
+_WORDS = "storia impero guerra riforma società economia cultura arte scienza legge popolo crisi".split()
+
+def _words(n: int) -> str:
+    return " ".join(_rng.choice(_WORDS) for _ in range(n))
+
+def _exam_dict(n: int, mcq_only: bool = False) -> dict:
+    qs = []
+    for i in range(n):
+        if mcq_only or i % 3:
+            correct = i % 4
+            qs.append({"id": f"q{i}", "qtype": "mcq", "text": _words(12), "explanation": _words(20),
+                       "options": [{"id": "ABCD"[j], "text": _words(5), "is_correct": j == correct} for j in range(4)]})
+        else:
+            qs.append({"id": f"q{i}", "qtype": "open", "text": _words(12), "explanation": _words(20),
+                       "ideal_answer": _words(40)})
+    return {"title": "Esame di prova", "questions": qs}
+
+def _long_text(chars: int) -> str:
+    pdfs = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "*.pdf")))
+    if pdfs:
+        try:
+            from clients.summarize_tool import _extract_text
+            text = _extract_text(min(pdfs, key=os.path.getsize))
+            if text.strip():
+                return (text * (chars // max(1, len(text)) + 1))[:chars]
+        except Exception:
+            pass
+    return ". ".join(_words(15) for _ in range(chars // 90))[:chars]
+
+
+# ───────────────────────── benchmark ─────────────────────────
+
+@bench("parse_json_large_clean")
+def _b_parse_clean():
+    from clients.structured import parse_json
+    raw = "Ecco l'esame richiesto:\n```json\n" + json.dumps(_exam_dict(60), ensure_ascii=False) + "\n```"
+    return lambda: parse_json(raw)
+
+@bench("parse_json_large_repair")
+def _b_parse_repair():
+    from clients.structured import parse_json
+    body = json.dumps(_exam_dict(60), ensure_ascii=False).replace("}]", "},]")   # virgole finali
+    raw = body[: int(len(body) * 0.9)]                                            # risposta troncata
+    return lambda: parse_json(raw)
+
+@bench("apply_max_nodes_400")
+def _b_apply_max_nodes():
+    from clients.concept_map_tool import ConceptMap, _apply_max_nodes
+    nodes = [{"key": "root", "text": "Argomento"}]
+    links = []
+    for c in range(1, 41):
+        nodes.append({"key": f"c{c}", "text": _words(2)})
+        links.append({"from": "root", "to": f"c{c}"})
+        for s in range(1, 10):
+            nodes.append({"key": f"s{c}_{s}", "text": _words(3)})
+            links.append({"from": f"c{c}", "to": f"s{c}_{s}"})
+    cm = ConceptMap(nodeDataArray=nodes, linkDataArray=links)
+    return lambda: _apply_max_nodes(cm, 200)
+
+@bench("fast_concept_map_8_chunks")
+def _b_fast_cmap():
+    from clients.fast_concept_map import build_concept_map
+    text = _long_text(16_000)
+    chunks = [text[i:i + 2000] for i in range(0, len(text), 2000)]
+    return lambda: build_concept_map("Seconda guerra mondiale", chunks, max_nodes=24)
+
+@bench("shrink_200k")
+def _b_shrink():
+    from clients.summarize_tool import _shrink
+    text = _long_text(200_000)
+    return lambda: _shrink(text, target_chars=22_000)
+
+@bench("build_pptx_30")
+def _b_pptx():
+    from clients.slide_tool import Slide, SlideDeck, _build_pptx
+    deck = SlideDeck(subject="Storia", topic="Impero romano",
+                     slides=[Slide(title=_words(4), bullets=[_words(10) for _ in range(5)]) for _ in range(30)])
+    return lambda: _build_pptx(deck)
+
+@bench("render_plan_pdf_12")
+def _b_pdf():
+    from clients.lesson_plan_tool import Lesson, LessonPlan, render_plan_pdf
+    plan = LessonPlan(subject="Storia", topic="Impero romano", grade="Scuola Media", lesson_minutes=50,
+                      lessons=[Lesson(lesson_number=i, title=_words(5), objectives=[_words(10)] * 3,
+                                      activities=[_words(10)] * 3, materials=[_words(3)] * 2,
+                                      assessment=_words(8)) for i in range(1, 13)])
+    return lambda: render_plan_pdf(plan)
+
+@bench("grade_exam_mcq_50")
+def _b_grade():
+    from clients.exam_tool import Exam, grade_exam
+    exam = Exam(**_exam_dict(50, mcq_only=True))
+    answers = {q.id: "ABCD"[i % 4] for i, q in enumerate(exam.questions)}
+    return lambda: grade_exam(exam, answers)
+
+@bench("grade_exam_bulk_mcq_30x40")
+def _b_grade_bulk():
+    from clients.exam_tool import Exam, grade_exam_bulk
+    exam = Exam(**_exam_dict(40, mcq_only=True))
+    subs = {f"s{k}": {q.id: _rng.choice("ABCD") for q in exam.questions} for k in range(30)}
+    return lambda: grade_exam_bulk(exam, subs)
+
+
+# ───────────────────────── esecuzione ─────────────────────────
+
+def measure(fn: Callable[[], Any], min_time: float = 0.2, rounds: int = 7) -> Dict[str, float]:
+    """Calibra il numero di iterazioni per round (≥ min_time s), poi mediana e minimo per chiamata."""
+    fn()  # warm-up (import pigri, cache)
+    n = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn()
+        if time.perf_counter() - t0 >= min_time or n >= 1 << 20:
+            break
+        n *= 2
+    per_call = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn()
+        per_call.append((time.perf_counter() - t0) / n)
+    return {
+        "median_us": round(statistics.median(per_call) * 1e6, 2),
+        "min_us": round(min(per_call) * 1e6, 2),
+        "iterations": n,
+    }
+
+def run(selected: List[str]) -> Tuple[Dict[str, Dict[str, float]], Dict[str, str]]:
+    results, skipped = {}, {}
+    for name in selected:
+        try:
+            fn = BENCHMARKS[name]()
+        except ImportError as e:
+            skipped[name] = f"dipendenza mancante: {e}"
+            continue
+        results[name] = measure(fn)
+        print(f"  {name:<30} {results[name]['median_us']:>12.1f} µs", file=sys.stderr)
+    return results, skipped
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    base = baseline.get("benchmarks", {})
+    print(f"{'benchmark':<30}{'baseline µs':>14}{'attuale µs':>14}{'delta':>10}")
+    for name, r in results.items():
+        b = base.get(name)
+        if b is None:
+            print(f"{name:<30}{'-':>14}{r['median_us']:>14.1f}{'nuovo':>10}")
+            continue
+        delta = r["median_us"] / b["median_us"] - 1
+        flag = "  REGRESSIONE" if delta > threshold else ""
+        print(f"{name:<30}{b['median_us']:>14.1f}{r['median_us']:>14.1f}{delta:>+10.1%}{flag}")
+        if delta > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def _machine() -> str:
+    return f"{platform.system()} {platform.machine()} {platform.processor() or ''}".strip()
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]], threshold: Optional[float]) -> None:
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": _machine(),
+            "cpu_count": os.cpu_count(),
+            "threshold": threshold if threshold is not None else DEFAULT_THRESHOLD,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "benchmarks": results,
+        }, fh, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark dei percorsi CPU-bound")
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="filtra per sottostringa del nome")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help=f"regressione tollerata (default: quella della baseline, altrimenti {DEFAULT_THRESHOLD:.2f})")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="scrive i risultati come nuova baseline")
+    parser.add_argument("--ci", action="store_true", default=bool(os.getenv("CI")),
+                        help="crea la baseline se manca; benchmark saltati = errore (default se CI è impostata)")
+    args = parser.parse_args()
+
+    names = [n for n in BENCHMARKS if not args.filters or any(f in n for f in args.filters)]
+    results, skipped = run(names)
+    for name, why in skipped.items():
+        print(f"  {name:<30} saltato ({why})", file=sys.stderr)
+
+    if args.save_baseline or (args.ci and not os.path.exists(args.baseline)):
+        if skipped:
+            print(f"Baseline non salvata: {len(skipped)} benchmark saltati (installare le dipendenze).")
+            sys.exit(2)
+        save_baseline(args.baseline, results, args.threshold)
+        print(f"Baseline salvata in {args.baseline}"
+              + ("" if args.save_baseline else ": conservarla (cache/artefatti CI) per le prossime esecuzioni."))
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"Nessuna baseline ({args.baseline}): eseguire con --save-baseline sulla macchina di riferimento.")
+        sys.exit(2)
+    with open(args.baseline, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+    threshold = args.threshold if args.threshold is not None else baseline.get("threshold", DEFAULT_THRESHOLD)
+    if baseline.get("machine") != _machine() or baseline.get("python") != platform.python_version():
+        print(f"Attenzione: baseline registrata su {baseline.get('machine')} / Python {baseline.get('python')}, "
+              f"qui {_machine()} / Python {platform.python_version()}: i tempi non sono confrontabili alla lettera.")
+    regressions = compare(results, baseline, threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regressioni oltre {threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    if args.ci and skipped:
+        print(f"\n{len(skipped)} benchmark saltati: in CI devono girare tutti.")
+        sys.exit(2)
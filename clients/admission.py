@@ -0,0 +1,185 @@
+# clients/admission.py
+"""
+Controllo di ammissione in ingresso (load shedding).
+
+Ogni richiesta POST costosa ha un peso (ENDPOINT_COST, in "unità"): le slide pesano
+più di una correzione. Prima di eseguire l'endpoint si verifica, nell'ordine:
+- quota dell'indirizzo IP: unità in volo (ADMIT_IP_UNITS) e ritmo (secchiello
+  ADMIT_IP_RATE unità/minuto, burst ADMIT_IP_BURST), dimensionata per un'intera
+  scuola dietro un solo NAT;
+- quota del client_id dentro quell'IP (ADMIT_CLIENT_UNITS / _RATE / _BURST): il
+  client_id è dichiarato dal client, quindi serve solo a ripartire la quota dell'IP
+  in modo equo e non a concederne di nuova (cambiare id non aggira il limite dell'IP);
+- limite di concorrenza dell'endpoint (ENDPOINT_MAX_INFLIGHT);
+- capacità globale (ADMIT_GLOBAL_UNITS), di cui ADMIT_INTERACTIVE_RESERVE unità
+  sono riservate agli endpoint interattivi (/ask, /grade_exam, /expand_concept_node).
+
+Se un controllo fallisce la richiesta è rifiutata subito (429 + Retry-After)
+invece di accodarsi, così la latenza degli endpoint interattivi resta stabile.
+"""
+from __future__ import annotations
+import math, os, threading, time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+ADMISSION_ENABLED = os.getenv("ADMISSION", "1") != "0"
+ADMIT_GLOBAL_UNITS = int(os.getenv("ADMIT_GLOBAL_UNITS", 48))
+ADMIT_INTERACTIVE_RESERVE = int(os.getenv("ADMIT_INTERACTIVE_RESERVE", 12))
+ADMIT_IP_UNITS = int(os.getenv("ADMIT_IP_UNITS", 40))
+ADMIT_IP_RATE = float(os.getenv("ADMIT_IP_RATE", 1200))           # unità/minuto
+ADMIT_IP_BURST = float(os.getenv("ADMIT_IP_BURST", 300))
+ADMIT_CLIENT_UNITS = int(os.getenv("ADMIT_CLIENT_UNITS", 10))     # sotto-quota per client_id
+ADMIT_CLIENT_RATE = float(os.getenv("ADMIT_CLIENT_RATE", 120))
+ADMIT_CLIENT_BURST = float(os.getenv("ADMIT_CLIENT_BURST", 30))
+ADMIT_MAX_CLIENTS = int(os.getenv("ADMIT_MAX_CLIENTS", 10000))     # oltre, si potano i bucket inattivi
+
+# peso di ogni endpoint; quelli non elencati non passano dall'ammissione
+ENDPOINT_COST: Dict[str, int] = {
+    "/ask": 1,
+    "/grade_exam": 1,
+    "/plan_pdf": 1,
+    "/expand_concept_node": 1,
+    "/jobs": 1,                  # accoda soltanto: il lavoro vero lo limita il JobManager
+    "/generate_exam": 2,
+    "/generate_concept_map": 2,
+    "/generate_plan": 2,
+    "/summarize": 3,
+    "/grade_exam_bulk": 4,
+    "/generate_slides": 5,
+}
+INTERACTIVE_ENDPOINTS = {"/ask", "/grade_exam", "/expand_concept_node"}
+ENDPOINT_MAX_INFLIGHT: Dict[str, int] = {
+    "/generate_slides": int(os.getenv("ADMIT_MAX_SLIDES", 4)),
+    "/grade_exam_bulk": int(os.getenv("ADMIT_MAX_BULK_GRADING", 2)),
+    "/summarize": int(os.getenv("ADMIT_MAX_SUMMARIZE", 6)),
+}
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+@dataclass
+class Ticket:
+    endpoint: str
+    keys: Tuple[str, ...]       # bucket addebitati: IP ed eventuale sotto-bucket del client_id
+    cost: int
+    started: float
+
+
+class _ClientState:
+    __slots__ = ("inflight", "tokens", "ts", "units", "rate", "burst")
+
+    def __init__(self, units: int, rate: float, burst: float):
+        self.inflight = 0
+        self.units, self.rate, self.burst = units, rate, burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate / 60.0)
+        self.ts = now
+
+    def idle(self, now: float) -> bool:
+        return self.inflight == 0 and self.tokens + (now - self.ts) * self.rate / 60.0 >= self.burst
+
+
+class AdmissionController:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[str, _ClientState] = {}
+        self._inflight: Dict[str, int] = {}
+        self._units = 0
+        self._latency: Dict[str, float] = {}   # EWMA della durata per endpoint (Retry-After)
+        self._stats = {"admitted": 0, "rejected": {}}
+
+    def admit(self, endpoint: str, ip: str, client_id: Optional[str] = None) -> Optional[Ticket]:
+        """
+        Ticket da rilasciare a fine richiesta, None se l'endpoint non è soggetto ad ammissione.
+        `ip` è l'indirizzo della connessione; `client_id` (dichiarato) è solo un sotto-bucket.
+        """
+        cost = ENDPOINT_COST.get(endpoint)
+        if not ADMISSION_ENABLED or cost is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            buckets = [("ip", f"ip:{ip}", self._bucket(f"ip:{ip}", now, ADMIT_IP_UNITS, ADMIT_IP_RATE, ADMIT_IP_BURST))]
+            if client_id:
+                key = f"ip:{ip}|{client_id}"
+                buckets.append(("client", key,
+                                self._bucket(key, now, ADMIT_CLIENT_UNITS, ADMIT_CLIENT_RATE, ADMIT_CLIENT_BURST)))
+
+            for scope, _, st in buckets:
+                if st.inflight + cost > st.units:
+                    raise self._reject(f"{scope}_concurrency", self._eta(endpoint))
+                if st.tokens < cost:
+                    raise self._reject(f"{scope}_rate", (cost - st.tokens) * 60.0 / st.rate)
+            limit = ENDPOINT_MAX_INFLIGHT.get(endpoint)
+            if limit is not None and self._inflight.get(endpoint, 0) >= limit:
+                raise self._reject("endpoint_concurrency", self._eta(endpoint))
+            capacity = ADMIT_GLOBAL_UNITS if endpoint in INTERACTIVE_ENDPOINTS \
+                else ADMIT_GLOBAL_UNITS - ADMIT_INTERACTIVE_RESERVE
+            if self._units + cost > capacity:
+                raise self._reject("global_capacity", self._eta(endpoint))
+
+            for _, _, st in buckets:
+                st.tokens -= cost
+                st.inflight += cost
+            self._inflight[endpoint] = self._inflight.get(endpoint, 0) + 1
+            self._units += cost
+            self._stats["admitted"] += 1
+        return Ticket(endpoint, tuple(key for _, key, _ in buckets), cost, now)
+
+    def release(self, ticket: Ticket) -> None:
+        elapsed = time.monotonic() - ticket.started
+        with self._lock:
+            for key in ticket.keys:
+                st = self._clients.get(key)
+                if st is not None:
+                    st.inflight -= ticket.cost
+            self._inflight[ticket.endpoint] -= 1
+            self._units -= ticket.cost
+            prev = self._latency.get(ticket.endpoint)
+            self._latency[ticket.endpoint] = elapsed if prev is None else 0.8 * prev + 0.2 * elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": ADMISSION_ENABLED,
+                "units_in_use": self._units,
+                "units_capacity": ADMIT_GLOBAL_UNITS,
+                "inflight_by_endpoint": {k: v for k, v in self._inflight.items() if v},
+                "clients_tracked": len(self._clients),
+                "admitted": self._stats["admitted"],
+                "rejected": dict(self._stats["rejected"]),
+                "avg_latency_s": {k: round(v, 3) for k, v in self._latency.items()},
+            }
+
+    # ----- interni (chiamare con il lock) -----
+
+    def _reject(self, reason: str, retry_after: float) -> Rejected:
+        self._stats["rejected"][reason] = self._stats["rejected"].get(reason, 0) + 1
+        return Rejected(reason, retry_after)
+
+    def _eta(self, endpoint: str) -> float:
+        # stima grezza di quando si libera un posto: metà della durata media dell'endpoint
+        return min(60.0, self._latency.get(endpoint, 2.0) / 2)
+
+    def _bucket(self, key: str, now: float, units: int, rate: float, burst: float) -> _ClientState:
+        st = self._clients.get(key)
+        if st is None:
+            if len(self._clients) >= ADMIT_MAX_CLIENTS:
+                self._prune(now)
+            st = self._clients[key] = _ClientState(units, rate, burst)
+        st.refill(now)
+        return st
+
+    def _prune(self, now: float) -> None:
+        for key in [k for k, s in self._clients.items() if s.idle(now)]:
+            del self._clients[key]
+
+
+admission = AdmissionController()
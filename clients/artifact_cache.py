@@ -0,0 +1,183 @@
+# clients/artifact_cache.py
+"""
+Cache su disco degli artefatti renderizzati (PDF dei piani, PPTX delle slide).
+
+La chiave è lo SHA-256 del modello di input (LessonPlan / SlideDeck in forma canonica)
+insieme al tipo e alla versione del renderer: lo stesso piano produce sempre lo stesso
+file, che viene riletto invece di rifare il rendering. Lo stesso hash fa da ETag, quindi
+con un If-None-Match corrispondente si risponde 304 senza nemmeno aprire il file.
+
+Oltre ARTIFACT_CACHE_MAX_MB si eliminano i file usati meno di recente (a ogni hit si
+aggiorna l'mtime, così l'ordine sopravvive ai riavvii). I render concorrenti dello
+stesso artefatto sono coalescenti.
+"""
+from __future__ import annotations
+import collections, hashlib, json, logging, os, threading, uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from pydantic import BaseModel
+
+from clients.singleflight import SingleFlight
+
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "artifact_cache")
+ARTIFACT_CACHE_MAX_MB = float(os.getenv("ARTIFACT_CACHE_MAX_MB", 512))
+ARTIFACT_RENDER_VERSION = os.getenv("ARTIFACT_RENDER_VERSION", "1")   # da incrementare se cambia un renderer
+
+PPTX_MIME = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+KINDS = {                     # tipo → (estensione, mimetype)
+    "plan_pdf": (".pdf", "application/pdf"),
+    "pptx": (".pptx", PPTX_MIME),
+}
+
+
+@dataclass(frozen=True)
+class Artifact:
+    kind: str
+    digest: str
+    path: str
+    size: int
+
+    @property
+    def etag(self) -> str:
+        return etag_for(self.digest)
+
+    @property
+    def mimetype(self) -> str:
+        return KINDS[self.kind][1]
+
+
+def model_digest(kind: str, model: BaseModel) -> str:
+    blob = json.dumps(model.model_dump(mode="json", by_alias=True), sort_keys=True,
+                      ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{kind}:{ARTIFACT_RENDER_VERSION}:{blob}".encode()).hexdigest()
+
+def etag_for(digest: str) -> str:
+    return f'"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], digest: str) -> bool:
+    """True se l'header If-None-Match del client contiene l'ETag dell'artefatto."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"') == digest:
+            return True
+    return False
+
+
+class ArtifactCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: "collections.OrderedDict[str, Artifact]" = collections.OrderedDict()   # LRU: digest → artefatto
+        self._bytes = 0
+        self._loaded = False
+        self._flights = SingleFlight()
+        self._hits = self._misses = self._evictions = 0
+
+    def _load(self) -> None:
+        """Indicizza i file già presenti (ordine LRU dall'mtime). Da chiamare col lock."""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.root, exist_ok=True)
+        by_ext = {ext: kind for kind, (ext, _) in KINDS.items()}
+        found = []
+        for name in os.listdir(self.root):
+            digest, ext = os.path.splitext(name)
+            if ext not in by_ext:
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found.append((st.st_mtime, Artifact(by_ext[ext], digest, path, st.st_size)))
+        for _, art in sorted(found, key=lambda x: x[0]):
+            self._index[art.digest] = art
+            self._bytes += art.size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            _, old = self._index.popitem(last=False)
+            self._bytes -= old.size
+            self._evictions += 1
+            try:
+                os.unlink(old.path)
+            except OSError:
+                pass
+
+    def get(self, digest: str) -> Optional[Artifact]:
+        """Artefatto già in cache (conta come hit), None se assente o rimosso."""
+        with self._lock:
+            self._load()
+            art = self._index.get(digest)
+            if art is None:
+                return None
+            if not os.path.exists(art.path):
+                del self._index[digest]
+                self._bytes -= art.size
+                return None
+            self._index.move_to_end(digest)
+            self._hits += 1
+        try:
+            os.utime(art.path)
+        except OSError:
+            pass
+        return art
+
+    def get_or_render(self, kind: str, model: BaseModel, render: Callable[[], bytes],
+                      digest: Optional[str] = None) -> Artifact:
+        digest = digest or model_digest(kind, model)
+        art = self.get(digest)
+        if art is not None:
+            return art
+        return self._flights.do(f"{kind}:{digest}", lambda: self._render(kind, digest, render))
+
+    def _render(self, kind: str, digest: str, render: Callable[[], bytes]) -> Artifact:
+        data = render()
+        path = os.path.join(self.root, f"{digest}{KINDS[kind][0]}")
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        os.makedirs(self.root, exist_ok=True)
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)        # atomico: un lettore non vede mai un file a metà
+        art = Artifact(kind, digest, path, len(data))
+        with self._lock:
+            self._load()
+            self._misses += 1
+            prev = self._index.pop(digest, None)
+            if prev is not None:
+                self._bytes -= prev.size
+            self._index[digest] = art
+            self._bytes += art.size
+            self._evict()
+        logging.debug("[artifact] %s %s renderizzato (%d byte)", kind, digest[:12], art.size)
+        return art
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._load()
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+artifacts = ArtifactCache(ARTIFACT_CACHE_DIR, int(ARTIFACT_CACHE_MAX_MB * 1024 * 1024))
+
+def artifact_cache_stats() -> Dict[str, Any]:
+    return artifacts.stats()
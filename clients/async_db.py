@@ -0,0 +1,35 @@
+# clients/async_db.py
+"""
+Pool asyncpg condiviso per la modalità ASGI (asgi.py).
+Stesse variabili d'ambiente DB_* usate da psycopg2 nel resto del progetto.
+"""
+from __future__ import annotations
+import asyncio, os
+from typing import Optional
+
+import asyncpg
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
+async def get_pool() -> asyncpg.Pool:
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    host=os.getenv("DB_HOST"),
+                    port=int(os.getenv("DB_PORT") or 5432),
+                    database=os.getenv("DB_NAME"),
+                    user=os.getenv("DB_USER"),
+                    password=os.getenv("DB_PASSWORD"),
+                    min_size=int(os.getenv("DB_POOL_MIN", 1)),
+                    max_size=int(os.getenv("DB_POOL_MAX", 20)),
+                )
+    return _pool
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
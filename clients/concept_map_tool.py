@@ -1,15 +1,14 @@
 from __future__ import annotations
 
-import json
-import re
-from typing import List, Optional, Set
+from typing import Any, AsyncIterator, Iterator, List, Optional, Set, Tuple
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain.tools import StructuredTool
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import BaseModel, Field
 
-from clients.query_rag_tool import query_rag
+from clients.query_rag_tool import query_rag, aquery_rag
+from clients.llm_gateway import chat_model
+from clients.structured import agenerate_structured, astream_structured, generate_structured, stream_structured
 
 
 # ───────────── Pydantic schemas ─────────────
@@ -26,10 +25,13 @@ class ConceptMap(BaseModel):
     nodeDataArray: List[Node]
     linkDataArray: List[Link]
 
+class NodeExpansion(BaseModel):
+    children: List[str]
+
 
 # ───────────── LLM ─────────────
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0.2)
+llm = chat_model("gpt-4o", temperature=0.2, priority="interactive")
 
 SYSTEM_PROMPT = (
     "Sei un generatore di mappe concettuali GERARCHICHE.\n"
@@ -47,17 +49,27 @@ SYSTEM_PROMPT = (
     "}\n"
 )
 
-_JSON_RE = re.compile(r"\{[\s\S]+\}")
+# Modalità progressiva: prima solo root + categorie, poi un nodo alla volta su richiesta
+OUTLINE_PROMPT = (
+    "Sei un generatore di mappe concettuali GERARCHICHE.\n"
+    "Produci SOLO il primo livello della mappa: un nodo ROOT (key='root', text=Titolo) "
+    "e le categorie principali (key c1, c2, ...) collegate da ROOT → Cx.\n"
+    "NON inserire sotto-nodi: verranno generati in seguito, categoria per categoria.\n"
+    "Etichette brevi e pulite (massimo 5 parole per nodo). Solo JSON nel formato:\n"
+    '{"nodeDataArray": [{"key":"root","text":"<TITOLO>"}, {"key":"c1","text":"Categoria"}, ...], '
+    '"linkDataArray": [{"from":"root","to":"c1"}, ...]}\n'
+)
+
+EXPAND_PROMPT = (
+    "Sei un generatore di mappe concettuali. Devi espandere UN SOLO nodo di una mappa esistente.\n"
+    "Restituisci SOLO un JSON {\"children\": [\"...\", ...]} con le etichette dei sotto-concetti "
+    "del nodo indicato: brevi (massimo 5 parole), specifici per quel nodo, senza ripetere "
+    "concetti già presenti nella mappa.\n"
+)
 
 
 # ───────────── Helper ─────────────
 
-def _extract_json(text: str) -> dict:
-    m = _JSON_RE.search(text or "")
-    if not m:
-        raise ValueError("Nessun JSON trovato nella risposta del modello.")
-    return json.loads(m.group(0))
-
 def _apply_max_nodes(cm: ConceptMap, max_nodes: int) -> ConceptMap:
     """
     Limita il numero totale di nodi (incluso root) a max_nodes,
@@ -92,51 +104,197 @@ def _apply_max_nodes(cm: ConceptMap, max_nodes: int) -> ConceptMap:
 
     return ConceptMap(nodeDataArray=limited_nodes, linkDataArray=limited_links)
 
+def _outline_only(cm: ConceptMap, topic: str, max_categories: int) -> ConceptMap:
+    """Tiene root e le sole categorie collegate a root (al massimo max_categories)."""
+    root = next((n for n in cm.nodeDataArray if n.key == "root"), None) or Node(key="root", text=topic)
+    cat_keys = {l.to for l in cm.linkDataArray if l.from_ == "root"}
+    cats = [n for n in cm.nodeDataArray if n.key in cat_keys][:max(1, max_categories)]
+    return ConceptMap(
+        nodeDataArray=[root, *cats],
+        linkDataArray=[Link(**{"from": "root", "to": n.key}) for n in cats],
+    )
+
+def _norm_label(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def _expansion_to_map(node_key: str, exp: NodeExpansion, exclude: List[str], max_children: int) -> ConceptMap:
+    """Etichette → nodi figli con chiavi stabili <node_key>_<i>, senza doppioni della mappa esistente."""
+    seen = {_norm_label(t) for t in exclude}
+    nodes: List[Node] = []
+    for label in exp.children:
+        label = label.strip()
+        if not label or _norm_label(label) in seen:
+            continue
+        seen.add(_norm_label(label))
+        nodes.append(Node(key=f"{node_key}_{len(nodes) + 1}", text=label))
+        if len(nodes) >= max_children:
+            break
+    return ConceptMap(
+        nodeDataArray=nodes,
+        linkDataArray=[Link(**{"from": node_key, "to": n.key}) for n in nodes],
+    )
+
 
 # ───────────── Core function ─────────────
 
+def _build_messages(topic: str, rag: str) -> list:
+    context = "" if rag.startswith("Nessun risultato") else rag
+    return [
+        SystemMessage(content=SYSTEM_PROMPT),
+        HumanMessage(content=(
+            f"ARGOMENTO: {topic}\n\n"
+            f"CONTESTO DI SUPPORTO (opzionale, usa solo se utile):\n{context}\n\n"
+            "Produci ORA il JSON richiesto. Nessun commento aggiuntivo."
+        ))
+    ]
+
 def generate_concept_map(topic: str, max_nodes: int = 20, top_k: int = 8) -> ConceptMap:
     """
     Genera una concept map GERARCHICA (root → categorie → sotto-nodi).
     max_nodes limita il totale dei nodi restituiti (incluso root).
     """
     rag = query_rag(topic, top_k=top_k)
-    context = "" if rag.startswith("Nessun risultato") else rag
+    cm = generate_structured(llm, _build_messages(topic, rag), ConceptMap, name="concept_map")
+    return _apply_max_nodes(cm, max_nodes)
 
-    messages = [
-        SystemMessage(content=SYSTEM_PROMPT),
+async def agenerate_concept_map(topic: str, max_nodes: int = 20, top_k: int = 8) -> ConceptMap:
+    """Versione async (modalità ASGI): RAG e LLM senza bloccare l'event loop."""
+    rag = await aquery_rag(topic, top_k=top_k)
+    cm = await agenerate_structured(llm, _build_messages(topic, rag), ConceptMap, name="concept_map")
+    return _apply_max_nodes(cm, max_nodes)
+
+
+# ───────────── Streaming ─────────────
+
+_STREAM_ITEMS = {"nodeDataArray[]": Node, "linkDataArray[]": Link}
+
+class _MapProgress:
+    """
+    Filtra gli elementi in arrivo dallo stream: al massimo max_nodes nodi, e ogni link
+    solo quando entrambi gli estremi sono già stati emessi (gli altri restano in attesa).
+    """
+    def __init__(self, max_nodes: int):
+        self.max_nodes = max_nodes if max_nodes and max_nodes > 0 else None
+        self.shown: Set[str] = set()
+        self.pending: List[Link] = []
+
+    def add(self, path: str, obj: Any) -> List[Tuple[str, Any]]:
+        out: List[Tuple[str, Any]] = []
+        if path == "nodeDataArray[]":
+            if obj.key in self.shown or (self.max_nodes and len(self.shown) >= self.max_nodes):
+                return out
+            self.shown.add(obj.key)
+            out.append(("node", obj))
+            ready = [l for l in self.pending if l.from_ in self.shown and l.to in self.shown]
+            self.pending = [l for l in self.pending if l not in ready]
+            out.extend(("link", l) for l in ready)
+        elif obj.from_ in self.shown and obj.to in self.shown:
+            out.append(("link", obj))
+        else:
+            self.pending.append(obj)
+        return out
+
+def stream_concept_map(topic: str, max_nodes: int = 20, top_k: int = 8) -> Iterator[Tuple[str, Any]]:
+    """
+    Eventi ("node", Node) e ("link", Link) man mano che l'LLM genera la mappa, poi
+    ("done", ConceptMap) con la mappa finale (validata e tagliata da _apply_max_nodes).
+    """
+    rag = query_rag(topic, top_k=top_k)
+    progress = _MapProgress(max_nodes)
+    for path, obj in stream_structured(llm, _build_messages(topic, rag), ConceptMap,
+                                       name="concept_map", items=_STREAM_ITEMS):
+        if path:
+            yield from progress.add(path, obj)
+        else:
+            yield "done", _apply_max_nodes(obj, max_nodes)
+
+async def astream_concept_map(topic: str, max_nodes: int = 20, top_k: int = 8) -> AsyncIterator[Tuple[str, Any]]:
+    rag = await aquery_rag(topic, top_k=top_k)
+    progress = _MapProgress(max_nodes)
+    async for path, obj in astream_structured(llm, _build_messages(topic, rag), ConceptMap,
+                                              name="concept_map", items=_STREAM_ITEMS):
+        if path:
+            for event in progress.add(path, obj):
+                yield event
+        else:
+            yield "done", _apply_max_nodes(obj, max_nodes)
+
+
+# ───────────── Modalità progressiva ─────────────
+
+def _outline_messages(topic: str, rag: str, max_categories: int) -> list:
+    context = "" if rag.startswith("Nessun risultato") else rag
+    return [
+        SystemMessage(content=OUTLINE_PROMPT),
         HumanMessage(content=(
-            f"ARGOMENTO: {topic}\n\n"
+            f"ARGOMENTO: {topic}\n"
+            f"NUMERO DI CATEGORIE: al massimo {max_categories}\n\n"
             f"CONTESTO DI SUPPORTO (opzionale, usa solo se utile):\n{context}\n\n"
             "Produci ORA il JSON richiesto. Nessun commento aggiuntivo."
-        ))
+        )),
     ]
 
-    raw = llm.invoke(messages).content
-    parsed = _extract_json(raw)
-
-    try:
-        cm = ConceptMap(**parsed)
-    except ValidationError as e:
-        # Proviamo una normalizzazione soft per errori comuni
-        if isinstance(parsed, dict):
-            nda = parsed.get("nodeDataArray") or []
-            lda = parsed.get("linkDataArray") or []
-            cm = ConceptMap(
-                nodeDataArray=[Node(**n) for n in nda],
-                linkDataArray=[Link(**l) for l in lda],
-            )
-        else:
-            raise
+def _expand_query(topic: str, node_text: str, path: List[str]) -> str:
+    """Query RAG mirata al nodo: argomento → antenati → nodo (senza ripetizioni)."""
+    return " – ".join(dict.fromkeys(p for p in [topic, *path, node_text] if p))
 
-    cm = _apply_max_nodes(cm, max_nodes)
-    return cm
+def _expand_messages(topic: str, node_text: str, path: List[str], exclude: List[str],
+                     max_children: int, rag: str) -> list:
+    context = "" if rag.startswith("Nessun risultato") else rag
+    present = ", ".join(exclude) or "-"
+    return [
+        SystemMessage(content=EXPAND_PROMPT),
+        HumanMessage(content=(
+            f"ARGOMENTO DELLA MAPPA: {topic}\n"
+            f"PERCORSO: {' → '.join([topic, *path, node_text])}\n"
+            f"NODO DA ESPANDERE: {node_text}\n"
+            f"NUMERO DI SOTTO-CONCETTI: da 3 a {max_children}\n"
+            f"CONCETTI GIÀ PRESENTI (da non ripetere): {present}\n\n"
+            f"CONTESTO DI SUPPORTO (opzionale, usa solo se utile):\n{context}\n\n"
+            "Produci ORA il JSON richiesto. Nessun commento aggiuntivo."
+        )),
+    ]
+
+def generate_concept_outline(topic: str, max_categories: int = 8, top_k: int = 4) -> ConceptMap:
+    """Primo livello della mappa (root → categorie); i sotto-nodi si chiedono con expand_concept_node."""
+    rag = query_rag(topic, top_k=top_k)
+    cm = generate_structured(llm, _outline_messages(topic, rag, max_categories), ConceptMap,
+                             name="concept_outline")
+    return _outline_only(cm, topic, max_categories)
+
+async def agenerate_concept_outline(topic: str, max_categories: int = 8, top_k: int = 4) -> ConceptMap:
+    rag = await aquery_rag(topic, top_k=top_k)
+    cm = await agenerate_structured(llm, _outline_messages(topic, rag, max_categories), ConceptMap,
+                                    name="concept_outline")
+    return _outline_only(cm, topic, max_categories)
+
+def expand_concept_node(topic: str, node_key: str, node_text: str, path: Optional[List[str]] = None,
+                        exclude: Optional[List[str]] = None, max_children: int = 6, top_k: int = 4) -> ConceptMap:
+    """
+    Figli di un singolo nodo, con un contesto RAG mirato a quel nodo.
+    Ritorna solo i nodi/link nuovi, da aggiungere alla mappa lato client.
+    """
+    path, exclude = path or [], exclude or []
+    rag = query_rag(_expand_query(topic, node_text, path), top_k=top_k)
+    exp = generate_structured(llm, _expand_messages(topic, node_text, path, exclude, max_children, rag),
+                              NodeExpansion, name="concept_expand")
+    return _expansion_to_map(node_key, exp, [*exclude, node_text], max_children)
+
+async def aexpand_concept_node(topic: str, node_key: str, node_text: str, path: Optional[List[str]] = None,
+                               exclude: Optional[List[str]] = None, max_children: int = 6,
+                               top_k: int = 4) -> ConceptMap:
+    path, exclude = path or [], exclude or []
+    rag = await aquery_rag(_expand_query(topic, node_text, path), top_k=top_k)
+    exp = await agenerate_structured(llm, _expand_messages(topic, node_text, path, exclude, max_children, rag),
+                                     NodeExpansion, name="concept_expand")
+    return _expansion_to_map(node_key, exp, [*exclude, node_text], max_children)
 
 
 # ───────────── LangChain Tool wrapper (se serve nell'agente) ─────────────
 
 concept_map_tool = StructuredTool.from_function(
     func=generate_concept_map,
+    coroutine=agenerate_concept_map,
     name="Concept_Map_with_RAG",
     description=(
         "Genera una mappa concettuale gerarchica (root → categorie → sotto-nodi) "
@@ -0,0 +1,142 @@
+# clients/conversation_memory.py
+"""
+Memoria conversazionale per client_id con costo per turno limitato:
+- finestra delle ultime MEMORY_WINDOW coppie domanda/risposta (testi troncati);
+- riassunto progressivo (rolling summary) dei turni usciti dalla finestra,
+  aggiornato in modo incrementale dall'LLM e limitato a MEMORY_SUMMARY_CHARS.
+Persistenza su Postgres via clients.history_store (tabella conversations).
+
+Il turno viene aggiunto subito (un solo INSERT ... ON CONFLICT), così la domanda
+successiva lo vede già; in background gira solo il fold dei turni in eccesso nel
+riassunto, che li toglie dalla tabella a riassunto salvato.
+"""
+from __future__ import annotations
+import asyncio, logging, os, threading
+from typing import Dict, List
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from clients.llm_gateway import chat_model
+from clients.history_store import (
+    aload_conversation, append_turn, fold_turns, load_conversation, save_conversation,
+)
+
+MEMORY_WINDOW = int(os.getenv("MEMORY_WINDOW", 4))              # coppie recenti tenute verbatim
+MEMORY_TURN_CHARS = int(os.getenv("MEMORY_TURN_CHARS", 1200))   # troncamento di ogni messaggio
+MEMORY_SUMMARY_CHARS = int(os.getenv("MEMORY_SUMMARY_CHARS", 1500))
+
+llm = chat_model("gpt-4o-mini", temperature=0, priority="batch")
+
+# client con un fold in corso → nuovi turni arrivati nel frattempo (al più un thread
+# per client; la voce sparisce a fold concluso)
+_folding: Dict[str, bool] = {}
+_folding_guard = threading.Lock()
+
+def _clip(text: str, limit: int) -> str:
+    text = (text or "").strip()
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+# ─────────────────────────── lettura ───────────────────────────
+
+def get_chat_history(client_id: str) -> List[BaseMessage]:
+    """Messaggi da passare come chat_history: riassunto (se c'è) + ultimi turni."""
+    if not client_id:
+        return []
+    try:
+        conv = load_conversation(client_id)
+    except Exception:
+        logging.warning("Memoria conversazione non disponibile", exc_info=True)
+        return []
+    return _to_messages(conv)
+
+async def aget_chat_history(client_id: str) -> List[BaseMessage]:
+    """Versione async (modalità ASGI)."""
+    if not client_id:
+        return []
+    try:
+        conv = await aload_conversation(client_id)
+    except Exception:
+        logging.warning("Memoria conversazione non disponibile", exc_info=True)
+        return []
+    return _to_messages(conv)
+
+def _to_messages(conv: Dict) -> List[BaseMessage]:
+    msgs: List[BaseMessage] = []
+    if conv["summary"]:
+        msgs.append(SystemMessage(content=f"Riassunto della conversazione precedente:\n{conv['summary']}"))
+    for t in conv["turns"][-MEMORY_WINDOW:]:
+        msgs.append(HumanMessage(content=t["user"]))
+        msgs.append(AIMessage(content=t["assistant"]))
+    return msgs
+
+# ─────────────────────────── scrittura ───────────────────────────
+
+def _fold_summary(summary: str, evicted: List[Dict[str, str]]) -> str:
+    """Aggiorna il riassunto con i turni usciti dalla finestra (una chiamata LLM piccola)."""
+    transcript = "\n".join(f"Utente: {t['user']}\nAssistente: {t['assistant']}" for t in evicted)
+    prompt = (
+        "Aggiorna il riassunto di una conversazione tra un docente e un assistente.\n"
+        f"Massimo {MEMORY_SUMMARY_CHARS // 6} parole; conserva argomenti, materie, livelli, "
+        "preferenze e richieste ancora aperte. Scrivi solo il riassunto.\n\n"
+        f"[RIASSUNTO ATTUALE]\n{summary or '(vuoto)'}\n\n"
+        f"[NUOVI SCAMBI]\n{transcript}"
+    )
+    try:
+        return _clip(llm.invoke(prompt).content, MEMORY_SUMMARY_CHARS)
+    except Exception:
+        logging.warning("Aggiornamento riassunto fallito", exc_info=True)
+        # fallback: accoda in forma compatta, sempre entro il limite
+        return _clip(f"{summary}\n{transcript}".strip(), MEMORY_SUMMARY_CHARS)
+
+def _fold_once(client_id: str) -> None:
+    while True:
+        conv = load_conversation(client_id)
+        if len(conv["turns"]) <= MEMORY_WINDOW:
+            return
+        evicted = conv["turns"][:-MEMORY_WINDOW]
+        summary = _fold_summary(conv["summary"], evicted)
+        if not fold_turns(client_id, summary, evicted):
+            return              # conversazione azzerata nel frattempo
+
+def _fold(client_id: str) -> None:
+    while True:
+        try:
+            _fold_once(client_id)
+        except Exception:
+            logging.warning("Aggiornamento memoria conversazione fallito", exc_info=True)
+        with _folding_guard:
+            if not _folding.pop(client_id, False):
+                return
+            _folding[client_id] = False     # turni arrivati durante il fold: un altro giro
+
+def _schedule_fold(client_id: str) -> None:
+    with _folding_guard:
+        if client_id in _folding:
+            _folding[client_id] = True
+            return
+        _folding[client_id] = False
+    threading.Thread(target=_fold, args=(client_id,), name="memory-fold", daemon=True).start()
+
+def record_turn(client_id: str, user: str, assistant: str) -> None:
+    """
+    Salva subito il turno; il riassunto incrementale (chiamata LLM) gira in background.
+    """
+    if not client_id:
+        return
+    try:
+        n = append_turn(client_id, {
+            "user": _clip(user, MEMORY_TURN_CHARS),
+            "assistant": _clip(assistant, MEMORY_TURN_CHARS),
+        })
+    except Exception:
+        logging.warning("Salvataggio turno conversazione fallito", exc_info=True)
+        return
+    if n > MEMORY_WINDOW:
+        _schedule_fold(client_id)
+
+async def arecord_turn(client_id: str, user: str, assistant: str) -> None:
+    """Versione async (modalità ASGI): l'INSERT gira in un thread."""
+    await asyncio.to_thread(record_turn, client_id, user, assistant)
+
+def clear_conversation(client_id: str) -> None:
+    save_conversation(client_id, "", [])
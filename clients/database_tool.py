@@ -1,43 +1,207 @@
-import os
+# clients/database_tool.py
+"""
+Tool SQL per l'agente, con risultati limitati in memoria e nel prompt.
+
+- Le letture (SELECT / WITH / VALUES / TABLE senza INSERT/UPDATE/DELETE/MERGE/INTO,
+  nemmeno dentro una CTE) girano su un cursore lato server (DECLARE ... CURSOR): si
+  scaricano al massimo SQL_TOOL_MAX_ROWS + 1 righe, a blocchi, qualunque sia la
+  dimensione della tabella. Il resto va sul percorso di scrittura, con commit.
+- Le colonne vettoriali (pgvector) e binarie sono tolte già nella query
+  (SELECT colonne FROM (query) AS _q), così gli embedding non lasciano nemmeno il
+  server; se la riscrittura non è possibile si scartano lato client.
+- statement_timeout = SQL_TOOL_TIMEOUT_MS per ogni statement.
+- Il risultato è una tabella compatta (celle accorciate a SQL_TOOL_CELL_CHARS) entro
+  SQL_TOOL_MAX_BYTES, con un avviso quando righe o colonne sono state omesse.
+"""
+import os, re, uuid
+from typing import Any, Dict, List, Sequence, Tuple
+
 import psycopg2
+from psycopg2.errors import QueryCanceled
 from langchain.tools import StructuredTool
 from dotenv import load_dotenv
 
 load_dotenv()
 
+SQL_TOOL_MAX_ROWS = int(os.getenv("SQL_TOOL_MAX_ROWS", 50))
+SQL_TOOL_MAX_BYTES = int(os.getenv("SQL_TOOL_MAX_BYTES", 8000))       # testo restituito all'agente
+SQL_TOOL_TIMEOUT_MS = int(os.getenv("SQL_TOOL_TIMEOUT_MS", 5000))
+SQL_TOOL_CELL_CHARS = int(os.getenv("SQL_TOOL_CELL_CHARS", 120))
+SQL_TOOL_FETCH = 100                   # righe per giro dal cursore lato server
+
+_READ = re.compile(r"^\s*(select|with|values|table)\b", re.IGNORECASE)
+# WITH d AS (DELETE …) SELECT …, SELECT … INTO nuova_tabella: iniziano come letture ma scrivono
+_WRITES = re.compile(r"\b(insert|update|delete|merge|into)\b", re.IGNORECASE)
+# letterali, identificatori quotati e commenti: le parole al loro interno non contano
+_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|\$(\w*)\$.*?\$\1\$", re.S)
+_DROP_TYPES = {"vector", "halfvec", "sparsevec", "bytea"}   # mai utili nel contesto dell'LLM
+_type_names: Dict[int, str] = {}       # oid → nome del tipo (cache per processo)
+
+
+def _connect():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        options=f"-c statement_timeout={SQL_TOOL_TIMEOUT_MS}",
+    )
+
+def _types(conn, oids: Sequence[int]) -> Dict[int, str]:
+    missing = [o for o in set(oids) if o not in _type_names]
+    if missing:
+        with conn.cursor() as cur:
+            cur.execute("SELECT oid, typname FROM pg_type WHERE oid = ANY(%s)", (missing,))
+            _type_names.update(cur.fetchall())
+    return {o: _type_names.get(o, "") for o in oids}
+
+def _dropped(conn, description) -> List[Tuple[str, str]]:
+    """(colonna, tipo) delle colonne da omettere."""
+    types = _types(conn, [d.type_code for d in description])
+    return [(d.name, types[d.type_code]) for d in description if types[d.type_code] in _DROP_TYPES]
+
+def _project(conn, description, rows: Sequence[tuple]) -> Tuple[List[str], List[tuple], List[Tuple[str, str]]]:
+    """Scarta lato client le colonne da omettere."""
+    dropped = _dropped(conn, description)
+    drop_names = {c for c, _ in dropped}
+    idx = [i for i, d in enumerate(description) if d.name not in drop_names]
+    return [description[i].name for i in idx], [tuple(r[i] for i in idx) for r in rows], dropped
+
+def _quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# ───────────────────────── esecuzione ─────────────────────────
+
+def _fetch_bounded(conn, sql: str) -> Tuple[List[str], List[tuple], bool]:
+    """Colonne, al più SQL_TOOL_MAX_ROWS righe e se ce n'erano altre, da un cursore lato server."""
+    with conn.cursor(name=f"sql_tool_{uuid.uuid4().hex[:12]}") as cur:
+        cur.itersize = SQL_TOOL_FETCH
+        cur.execute(sql)
+        rows: List[tuple] = []
+        while len(rows) <= SQL_TOOL_MAX_ROWS:
+            chunk = cur.fetchmany(min(SQL_TOOL_FETCH, SQL_TOOL_MAX_ROWS + 1 - len(rows)))
+            if not chunk:
+                break
+            rows.extend(chunk)
+        columns = [d.name for d in cur.description] if cur.description else []
+    return columns, rows[:SQL_TOOL_MAX_ROWS], len(rows) > SQL_TOOL_MAX_ROWS
+
+def _run_read(conn, query: str) -> Tuple[List[str], List[tuple], bool, List[Tuple[str, str]]]:
+    body = query.strip().rstrip(";")
+    # 1) solo la forma del risultato (0 righe) per scegliere le colonne
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT * FROM ({body}) AS _q LIMIT 0")
+        description = cur.description
+    dropped = _dropped(conn, description)
+    if not dropped:
+        columns, rows, truncated = _fetch_bounded(conn, body)
+        return columns, rows, truncated, []
+    names = [d.name for d in description]
+    keep = [n for n in names if n not in {c for c, _ in dropped}]
+    if len(set(names)) != len(names) or not keep:
+        raise ValueError("proiezione non applicabile")
+    projection = ", ".join(_quote_ident(n) for n in keep)
+    columns, rows, truncated = _fetch_bounded(conn, f"SELECT {projection} FROM ({body}) AS _q")
+    return columns, rows, truncated, dropped
+
+def _run_read_fallback(conn, query: str) -> Tuple[List[str], List[tuple], bool, List[Tuple[str, str]]]:
+    """Query non incapsulabile: cursore lato server sulla query originale, colonne scartate qui."""
+    with conn.cursor(name=f"sql_tool_{uuid.uuid4().hex[:12]}") as cur:
+        cur.itersize = SQL_TOOL_FETCH
+        cur.execute(query.strip().rstrip(";"))
+        rows = cur.fetchmany(SQL_TOOL_MAX_ROWS + 1)
+        description = cur.description or []
+    columns, kept, dropped = _project(conn, description, rows[:SQL_TOOL_MAX_ROWS])
+    return columns, kept, len(rows) > SQL_TOOL_MAX_ROWS, dropped
+
+
+# ───────────────────────── rendering ─────────────────────────
+
+def _cell(v: Any) -> str:
+    if v is None:
+        return "NULL"
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return f"<{len(bytes(v))} byte>"
+    s = " ".join(str(v).split()).replace("|", "\\|")
+    return s if len(s) <= SQL_TOOL_CELL_CHARS else s[:SQL_TOOL_CELL_CHARS - 1] + "…"
+
+def render_table(columns: Sequence[str], rows: Sequence[tuple], truncated: bool,
+                 dropped: Sequence[Tuple[str, str]] = ()) -> str:
+    """Tabella `a | b | c` entro SQL_TOOL_MAX_BYTES, con gli avvisi di troncamento in coda."""
+    lines = [" | ".join(columns)]
+    used = len(lines[0].encode()) + 1
+    shown = 0
+    for r in rows:
+        line = " | ".join(_cell(v) for v in r)
+        size = len(line.encode()) + 1
+        if used + size > SQL_TOOL_MAX_BYTES:
+            truncated = True
+            break
+        lines.append(line)
+        used += size
+        shown += 1
+    notes = []
+    if truncated:
+        notes.append(f"(risultato troncato: {shown} righe mostrate; restringi con WHERE/LIMIT o seleziona meno colonne)")
+    else:
+        notes.append(f"({shown} righe)")
+    if dropped:
+        notes.append("colonne omesse: " + ", ".join(f"{c} ({t})" for c, t in dropped))
+    return "\n".join(lines + notes)
+
+
+def _is_read(query: str) -> bool:
+    return bool(_READ.match(query)) and not _WRITES.search(_QUOTED.sub(" ", query))
+
+def _run_write(conn, query: str) -> str:
+    with conn.cursor() as cur:
+        cur.execute(query)
+        if cur.description:         # INSERT/UPDATE ... RETURNING
+            rows = cur.fetchmany(SQL_TOOL_MAX_ROWS + 1)
+            columns, kept, dropped = _project(conn, cur.description, rows[:SQL_TOOL_MAX_ROWS])
+            out = render_table(columns, kept, len(rows) > SQL_TOOL_MAX_ROWS, dropped)
+        else:
+            out = f"Query eseguita con successo ({cur.rowcount} righe interessate)."
+    conn.commit()
+    return out
+
+
 def execute_sql_query(query: str) -> str:
     """
     Esegue una query SQL sul database PostgreSQL locale.
     Supporta SELECT, INSERT, UPDATE, DELETE.
     """
+    conn = None
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
-        )
-        cursor = conn.cursor()
-        cursor.execute(query)
-
-        if query.strip().lower().startswith("select"):
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            result = [dict(zip(columns, row)) for row in rows]
-        else:
-            conn.commit()
-            result = f"Query eseguita con successo."
-
-        cursor.close()
-        conn.close()
-        return str(result)
-    
+        conn = _connect()
+        if _is_read(query):
+            try:
+                try:
+                    columns, rows, truncated, dropped = _run_read(conn, query)
+                except (psycopg2.ProgrammingError, ValueError):
+                    conn.rollback()
+                    columns, rows, truncated, dropped = _run_read_fallback(conn, query)
+            except psycopg2.NotSupportedError:
+                # non ammessa in un cursore (scrittura sfuggita a _WRITES): la esegue il percorso
+                # di scrittura, con commit, invece di scartarla con il rollback
+                conn.rollback()
+                return _run_write(conn, query)
+            conn.rollback()             # sola lettura: chiude la transazione del cursore
+            return render_table(columns, rows, truncated, dropped)
+        return _run_write(conn, query)
+    except QueryCanceled:
+        return f"Errore nella query: superato il tempo massimo di {SQL_TOOL_TIMEOUT_MS} ms."
     except Exception as e:
         return f"Errore nella query: {str(e)}"
+    finally:
+        if conn is not None:
+            conn.close()
 
 db_tool = StructuredTool.from_function(
     func=execute_sql_query,
     name="PostgreSQL_Query",
-    description="Usa questo strumento per eseguire query SQL su un database PostgreSQL locale. Accetta solo query SQL valide."
+    description="Usa questo strumento per eseguire query SQL su un database PostgreSQL locale. Accetta solo query SQL valide. "
+                f"Restituisce al massimo {SQL_TOOL_MAX_ROWS} righe; le colonne vettoriali (embedding) sono omesse."
 )
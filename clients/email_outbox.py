@@ -0,0 +1,317 @@
+# clients/email_outbox.py
+"""
+Outbox delle email: l'invio avviene in background, chi chiama riceve subito un id.
+
+- Un thread mittente (EMAIL_SENDERS) prende dalla coda i messaggi già "maturi" a
+  blocchi di EMAIL_BATCH_MAX e li spedisce tutti sulla stessa connessione SMTP già
+  autenticata (STARTTLS + login una volta sola); la connessione resta aperta per
+  EMAIL_IDLE_S dopo l'ultimo invio e viene verificata con NOOP prima di riusarla.
+- Errori transitori (4xx, connessione caduta, timeout) → nuovo tentativo con backoff
+  esponenziale fino a EMAIL_MAX_ATTEMPTS; errori permanenti (5xx, destinatario
+  rifiutato, autenticazione) → "failed" subito.
+- Stato per messaggio: queued | sending | retrying | sent | failed (get / stats);
+  i messaggi conclusi restano consultabili per EMAIL_STATUS_TTL_S.
+"""
+from __future__ import annotations
+import heapq, itertools, logging, os, smtplib, threading, time, uuid
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+EMAIL_SENDERS = int(os.getenv("EMAIL_SENDERS", 1))                 # connessioni SMTP parallele
+EMAIL_BATCH_MAX = int(os.getenv("EMAIL_BATCH_MAX", 50))            # messaggi per giro sulla stessa connessione
+EMAIL_IDLE_S = float(os.getenv("EMAIL_IDLE_S", 30))                # connessione aperta senza invii
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 4))
+EMAIL_RETRY_BASE_S = float(os.getenv("EMAIL_RETRY_BASE_S", 5))     # 5s, 10s, 20s, ...
+EMAIL_OUTBOX_MAX = int(os.getenv("EMAIL_OUTBOX_MAX", 1000))        # messaggi in attesa
+EMAIL_MAX_RECIPIENTS = int(os.getenv("EMAIL_MAX_RECIPIENTS", 60))  # destinatari per singola richiesta del tool
+EMAIL_STATUS_TTL_S = int(os.getenv("EMAIL_STATUS_TTL_S", 24 * 3600))
+SMTP_TIMEOUT_S = float(os.getenv("SMTP_TIMEOUT_S", 20))
+
+
+class OutboxFull(Exception):
+    pass
+
+
+def smtp_config() -> Dict[str, Any]:
+    """Configurazione letta al momento dell'uso (come il resto del progetto, da env / .env)."""
+    return {
+        "sender": os.getenv("EMAIL_SENDER"),
+        "password": os.getenv("EMAIL_PASSWORD"),
+        "server": os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+        "port": int(os.getenv("SMTP_PORT", 587)),
+        "starttls": os.getenv("SMTP_STARTTLS", "1") != "0",     # 0 per uno stand-in SMTP locale in chiaro
+    }
+
+
+@dataclass
+class OutboundEmail:
+    id: str
+    recipient: str
+    subject: str
+    body: str
+    client_id: Optional[str] = None
+    status: str = "queued"            # queued | sending | retrying | sent | failed
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+    next_attempt_at: float = 0.0
+    sent_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "recipient": self.recipient,
+            "subject": self.subject,
+            "status": self.status,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "sent_at": self.sent_at,
+            "error": self.error,
+        }
+
+
+class _Connection:
+    """Connessione SMTP autenticata riusabile tra un messaggio e l'altro."""
+
+    def __init__(self):
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self.opened = 0
+
+    def get(self, cfg: Dict[str, Any]) -> smtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        smtp = smtplib.SMTP(cfg["server"], cfg["port"], timeout=SMTP_TIMEOUT_S)
+        try:
+            if cfg["starttls"]:
+                smtp.starttls()
+            if cfg["password"]:
+                smtp.login(cfg["sender"], cfg["password"])
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self.opened += 1
+        return smtp
+
+    def touch(self) -> None:
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self._smtp is not None and time.monotonic() - self._last_used > EMAIL_IDLE_S:
+            self.close()
+
+    def close(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+def _classify(e: BaseException) -> Tuple[bool, str]:
+    """(transitorio?, messaggio) per un errore di invio."""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in e.recipients.values()]
+        return all(400 <= c < 500 for c in codes), f"destinatario rifiutato: {e.recipients}"
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        return False, f"autenticazione SMTP fallita ({e.smtp_code})"
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500, f"SMTP {e.smtp_code}: {e.smtp_error!r}"
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)):
+        return True, f"connessione SMTP: {e}"
+    return False, str(e)
+
+
+def _broken(e: BaseException) -> bool:
+    """La connessione non è più utilizzabile (un rifiuto SMTP invece la lascia valida)."""
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPResponseException) \
+        and not isinstance(e, smtplib.SMTPRecipientsRefused)
+
+
+class EmailOutbox:
+    def __init__(self, senders: int = EMAIL_SENDERS, max_pending: int = EMAIL_OUTBOX_MAX):
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, str]] = []          # (pronto dal, seq, id)
+        self._seq = itertools.count()
+        self._messages: Dict[str, OutboundEmail] = {}
+        self._sent = self._failed = self._retries = self._batches = 0
+        self._conns = [_Connection() for _ in range(senders)]
+        self._threads = [
+            threading.Thread(target=self._sender, args=(conn,), name=f"email-sender-{i}", daemon=True)
+            for i, conn in enumerate(self._conns)
+        ]
+        for t in self._threads:
+            t.start()
+
+    # ----- API -----
+
+    def enqueue(self, recipient: str, subject: str, body: str, client_id: Optional[str] = None) -> OutboundEmail:
+        return self.enqueue_many([(recipient, subject, body)], client_id)[0]
+
+    def enqueue_many(self, messages: Sequence[Tuple[str, str, str]],
+                     client_id: Optional[str] = None) -> List[OutboundEmail]:
+        """Accoda tutti i messaggi o nessuno (OutboxFull se non c'è posto)."""
+        self._purge()
+        out = [OutboundEmail(id=uuid.uuid4().hex, recipient=r.strip(), subject=s, body=b, client_id=client_id)
+               for r, s, b in messages]
+        with self._cond:
+            if len(self._heap) + len(out) > self.max_pending:
+                raise OutboxFull("Coda email piena, riprova più tardi.")
+            for m in out:
+                self._messages[m.id] = m
+                heapq.heappush(self._heap, (0.0, next(self._seq), m.id))
+            self._cond.notify_all()
+        return out
+
+    def get(self, message_id: str) -> Optional[OutboundEmail]:
+        with self._cond:
+            return self._messages.get(message_id)
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Attende che non restino messaggi da inviare (True) o il timeout (False)."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: all(m.status in ("sent", "failed") for m in self._messages.values()), timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            by_status: Dict[str, int] = {}
+            for m in self._messages.values():
+                by_status[m.status] = by_status.get(m.status, 0) + 1
+            return {
+                "senders": len(self._threads),
+                "pending": len(self._heap),
+                "by_status": by_status,
+                "sent": self._sent,
+                "failed": self._failed,
+                "retries": self._retries,
+                "batches": self._batches,
+                "connections_opened": sum(c.opened for c in self._conns),
+            }
+
+    # ----- interni -----
+
+    def _purge(self) -> None:
+        cutoff = time.time() - EMAIL_STATUS_TTL_S
+        with self._cond:
+            for mid in [m.id for m in self._messages.values() if m.finished_at and m.finished_at < cutoff]:
+                del self._messages[mid]
+
+    def _take_batch(self, conn: _Connection) -> List[OutboundEmail]:
+        """Messaggi pronti (max EMAIL_BATCH_MAX); nel frattempo chiude la connessione inattiva."""
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    batch = []
+                    while self._heap and self._heap[0][0] <= now and len(batch) < EMAIL_BATCH_MAX:
+                        m = self._messages.get(heapq.heappop(self._heap)[2])
+                        if m is not None:
+                            m.status = "sending"
+                            batch.append(m)
+                    if batch:
+                        self._cond.notify_all()
+                        return batch
+                    continue
+                wait = self._heap[0][0] - now if self._heap else EMAIL_IDLE_S
+                self._cond.wait(timeout=min(wait, EMAIL_IDLE_S))
+                conn.close_if_idle()
+
+    def _finish(self, m: OutboundEmail, error: Optional[BaseException]) -> None:
+        with self._cond:
+            m.attempts += 1
+            now = time.time()
+            if error is None:
+                m.status, m.sent_at, m.finished_at, m.error = "sent", now, now, None
+                self._sent += 1
+            else:
+                transient, msg = _classify(error)
+                m.error = msg[:500]
+                if transient and m.attempts < EMAIL_MAX_ATTEMPTS:
+                    m.status = "retrying"
+                    m.next_attempt_at = now + EMAIL_RETRY_BASE_S * 2 ** (m.attempts - 1)
+                    heapq.heappush(self._heap, (m.next_attempt_at, next(self._seq), m.id))
+                    self._retries += 1
+                else:
+                    m.status, m.finished_at = "failed", now
+                    self._failed += 1
+                    logging.warning("[email] invio a %s fallito: %s", m.recipient, m.error)
+            self._cond.notify_all()
+
+    def _sender(self, conn: _Connection) -> None:
+        while True:
+            batch: List[OutboundEmail] = []
+            try:
+                batch = self._take_batch(conn)
+                self._send_batch(conn, batch)
+            except Exception as e:
+                # un errore imprevisto non deve fermare il thread (è l'unico mittente con
+                # EMAIL_SENDERS=1): i messaggi rimasti "sending" falliscono, la connessione si riapre
+                logging.exception("[email] errore imprevisto nel mittente")
+                conn.close()
+                time.sleep(1)
+                for m in batch:
+                    if m.status == "sending":
+                        self._finish(m, e)
+
+    def _send_batch(self, conn: _Connection, batch: List[OutboundEmail]) -> None:
+        with self._cond:
+            self._batches += 1
+        cfg = smtp_config()
+        for i, m in enumerate(batch):
+            if not cfg["sender"]:
+                self._finish(m, RuntimeError("EMAIL_SENDER non configurato"))
+                continue
+            try:
+                msg = _build_message(cfg["sender"], m)
+            except (ValueError, TypeError) as e:
+                self._finish(m, e)            # intestazioni non valide: errore permanente
+                continue
+            try:
+                conn.get(cfg).send_message(msg)
+                conn.touch()
+                self._finish(m, None)
+            except smtplib.SMTPAuthenticationError as e:
+                # credenziali sbagliate: inutile provare gli altri messaggi del blocco
+                conn.close()
+                for rest in batch[i:]:
+                    self._finish(rest, e)
+                break
+            except Exception as e:
+                if _broken(e):
+                    conn.close()          # la prossima volta se ne apre una nuova
+                self._finish(m, e)
+
+
+def _build_message(sender: str, m: OutboundEmail) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = m.subject
+    msg["From"] = sender
+    msg["To"] = m.recipient
+    msg.set_content(m.body)
+    return msg
+
+
+_outbox: Optional[EmailOutbox] = None
+_outbox_lock = threading.Lock()
+
+def get_outbox() -> EmailOutbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = EmailOutbox()
+        return _outbox
+
+def email_outbox_stats() -> Dict[str, Any]:
+    return get_outbox().stats()
@@ -1,46 +1,46 @@
-import os
-import smtplib
-from email.message import EmailMessage
-from langchain.tools import StructuredTool  
+import re
+from langchain.tools import StructuredTool
 from dotenv import load_dotenv
 
+from clients.email_outbox import EMAIL_MAX_RECIPIENTS, OutboxFull, get_outbox, smtp_config
+
 load_dotenv()
 
 def send_email_func(recipient: str, subject: str, body: str) -> str:
     """
-    Invia un'email a un destinatario.
+    Mette in coda un'email (o la stessa email per più destinatari) per l'invio in background.
 
     Args:
-        recipient: L'indirizzo email del destinatario.
+        recipient: L'indirizzo email del destinatario; più indirizzi separati da virgola o punto e virgola.
         subject: L'oggetto dell'email.
         body: Il contenuto del messaggio.
     """
+    cfg = smtp_config()
+    if not cfg["sender"] or (cfg["starttls"] and not cfg["password"]):
+        return "Errore: EMAIL_SENDER o EMAIL_PASSWORD non configurate."
+
+    recipients = [r for r in (x.strip() for x in re.split(r"[,;]", recipient or "")) if r]
+    if not recipients:
+        return "Errore: nessun destinatario indicato."
+    if any("\r" in r or "\n" in r for r in recipients):
+        return "Errore: destinatario non valido (contiene un a capo)."
+    subject = " ".join((subject or "").split())     # le intestazioni non possono contenere a capo
+    if len(recipients) > EMAIL_MAX_RECIPIENTS:
+        return f"Errore: troppi destinatari ({len(recipients)}, massimo {EMAIL_MAX_RECIPIENTS})."
     try:
-        sender = os.getenv("EMAIL_SENDER")
-        password = os.getenv("EMAIL_PASSWORD")
-        smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-        smtp_port = int(os.getenv("SMTP_PORT", 587))
-
-        if not all([sender, password]):
-            return "Errore: EMAIL_SENDER o EMAIL_PASSWORD non configurate."
-
-        msg = EmailMessage()
-        msg["Subject"] = subject
-        msg["From"] = sender
-        msg["To"] = recipient
-        msg.set_content(body)
-
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender, password)
-            server.send_message(msg)
-
-        return f"Email inviata a {recipient} con oggetto: '{subject}'"
-    except Exception as e:
+        queued = get_outbox().enqueue_many([(r, subject, body) for r in recipients])
+    except OutboxFull as e:
         return f"Errore durante l'invio dell'email: {e}"
 
+    ids = ", ".join(m.id for m in queued)
+    if len(queued) == 1:
+        return f"Email per {recipients[0]} con oggetto '{subject}' messa in coda (id {ids}); l'invio avviene in background."
+    return (f"{len(queued)} email con oggetto '{subject}' messe in coda; l'invio avviene in background. "
+            f"Id: {ids}")
+
 send_email_tool = StructuredTool.from_function(
     func=send_email_func,
-    name="send_email",  
-    description="Invia un'email specificando recipient, subject e body."
+    name="send_email",
+    description="Invia un'email specificando recipient, subject e body. "
+                "Per una classe intera: più indirizzi in recipient, separati da virgola."
 )
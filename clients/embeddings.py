@@ -0,0 +1,58 @@
+# clients/embeddings.py
+from __future__ import annotations
+import math, os, threading
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Sequence
+
+from langchain_openai import OpenAIEmbeddings
+
+from clients.standin import STANDIN, FakeEmbeddings
+from clients.telemetry import span
+
+# ─────────────────────────────────────────────────────────────
+# Istanza condivisa + cache LRU in memoria (testo → vettore)
+# I vettori sono array('f') (4 byte per componente invece di un oggetto float da 24 +
+# 8 di puntatore): 1024 vettori da 1536 dimensioni ≈ 6 MB.
+# ─────────────────────────────────────────────────────────────
+_CACHE_MAX = int(os.getenv("EMBED_CACHE_MAX", 1024))
+_cache: "OrderedDict[str, array]" = OrderedDict()
+_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> OpenAIEmbeddings:
+    return FakeEmbeddings() if STANDIN else OpenAIEmbeddings()
+
+def embed_texts(texts: Sequence[str]) -> List[Sequence[float]]:
+    """
+    Embedding di più testi con UNA sola chiamata per i testi non ancora in cache.
+    """
+    with _lock:
+        missing = []
+        for t in dict.fromkeys(texts):
+            if t in _cache:
+                _cache.move_to_end(t)
+            else:
+                missing.append(t)
+    if missing:
+        with span("embed", "documents"):
+            vectors = get_embeddings().embed_documents(missing)
+        with _lock:
+            for t, v in zip(missing, vectors):
+                _cache[t] = array("f", v)
+                _cache.move_to_end(t)
+            while len(_cache) > _CACHE_MAX:
+                _cache.popitem(last=False)
+    with _lock:
+        out = [_cache.get(t) for t in texts]
+    # espulsi nel frattempo (cache piena): ricalcola singolarmente
+    return [v if v is not None else get_embeddings().embed_query(t) for t, v in zip(texts, out)]
+
+def cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    if not na or not nb:
+        return 0.0
+    return dot / (na * nb)
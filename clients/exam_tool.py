@@ -1,10 +1,14 @@
 from __future__ import annotations
-import json, re, uuid
-from typing import List, Literal, Dict, Optional
+import asyncio, logging, os, re, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal, Dict, Optional, Tuple
 
 from pydantic import BaseModel
 from langchain.tools import StructuredTool
-from langchain_openai import ChatOpenAI
+from clients.llm_gateway import chat_model
+from clients.structured import agenerate_structured, generate_structured, loads_json
+
+from clients.embeddings import embed_texts, cosine, get_embeddings
 
 # ─────────────────────────────────────────────────────────────
 # Pydantic schema
@@ -31,7 +35,9 @@ class Exam(BaseModel):
 # ─────────────────────────────────────────────────────────────
 # LLM settings
 # ─────────────────────────────────────────────────────────────
-llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
+llm = chat_model("gpt-4o", temperature=0.3, priority="interactive")
+# correzione: classe batch, cede il passo alla chat quando il gateway è saturo
+judge_llm = chat_model("gpt-4o", temperature=0.3, priority="batch")
 
 _SYSTEM = """
 Sei un autore di test. Restituisci SOLO un JSON Exam:
@@ -78,14 +84,6 @@ Regole:
 - Non scrivere nulla prima o dopo il JSON.
 """
 
-_JSON_RE = re.compile(r"\{[\s\S]+\}")
-
-def _parse_json(raw: str) -> dict:
-    m = _JSON_RE.search(raw)
-    if not m:
-        raise ValueError("No JSON found")
-    return json.loads(m.group(0))
-
 # ─────────────────────────────────────────────────────────────
 # RAG: recupero criteri da "valutazione-versioni.pdf"
 # ─────────────────────────────────────────────────────────────
@@ -97,7 +95,7 @@ def _rag_guidelines_for_latino() -> str:
     try:
         try:
             from clients.query_rag_tool import query_rag  
-            txt = query_rag("criteri valutazione versioni latino file:valutazione-versioni.pdf", k=4)
+            txt = query_rag("criteri valutazione versioni latino file:valutazione-versioni.pdf", top_k=4)
             return (txt or "")[:2000]
         except Exception:
             pass
@@ -105,15 +103,13 @@ def _rag_guidelines_for_latino() -> str:
         import os
         from sqlalchemy import create_engine
         from langchain_postgres.vectorstores import PGVector
-        from langchain_openai import OpenAIEmbeddings
 
         DATABASE_URL = os.getenv("PGVECTOR_CONNECTION_STRING")
         if not DATABASE_URL:
             return ""
         engine = create_engine(DATABASE_URL)
-        embeddings = OpenAIEmbeddings()
         vs = PGVector(
-            embedding_function=embeddings,
+            embedding_function=get_embeddings(),
             collection_name="documents",
             connection=engine,
         )
@@ -129,14 +125,43 @@ def _rag_guidelines_for_latino() -> str:
 # ─────────────────────────────────────────────────────────────
 # Generazione esame
 # ─────────────────────────────────────────────────────────────
+def _norm_label(s: str) -> str:
+    return " ".join((s or "").lower().split())
+
+BANK_ENABLED = os.getenv("EXAM_BANK", "1") != "0"
+
 def generate_exam(topic: str, n: int = 5, level: str = "medium", subject: Optional[str] = None) -> Exam:
     """
     - Se subject == 'latino': genera una versione + 5 domande di comprensione,
       includendo 'version_latin' e 'solution_translation', con supporto RAG.
     - Altrimenti: usa lo schema generico con n domande.
+    Prima prova a comporre l'esame dalla banca domande (clients.question_bank);
+    se il pool non basta genera con l'LLM e salva le domande nel pool.
     """
-    if (subject or "").lower() == "latino":
-        guidelines = _rag_guidelines_for_latino()
+    if not BANK_ENABLED:
+        return _generate_exam_llm(topic, n, level, subject)
+
+    from clients import question_bank
+    try:
+        exam = question_bank.sample_exam(subject, topic, level, n)
+        if exam is not None:
+            return exam
+    except Exception:
+        logging.warning("Question bank non disponibile, generazione diretta", exc_info=True)
+        return _generate_exam_llm(topic, n, level, subject)
+
+    exam = _generate_exam_llm(topic, n, level, subject)
+    try:
+        question_bank.store_exam(exam, subject, topic, level)
+    except Exception:
+        logging.warning("Salvataggio nella question bank fallito", exc_info=True)
+    return exam
+
+def _is_latino(subject: Optional[str]) -> bool:
+    return (subject or "").lower() == "latino"
+
+def _exam_messages(topic: str, n: int, level: str, subject: Optional[str], guidelines: str = "") -> list:
+    if _is_latino(subject):
         user_prompt = (
             f"MATERIA: LATINO\n"
             f"ARGOMENTO: {topic}\n"
@@ -144,24 +169,20 @@ def generate_exam(topic: str, n: int = 5, level: str = "medium", subject: Option
             f"ISTRUZIONI RAG (criteri valutazione versioni):\n{guidelines}\n\n"
             "Genera una versione (80-150 parole) e 5 domande di comprensione riferite al testo."
         )
-        raw = llm.invoke([
+        return [
             {"role": "system", "content": _SYSTEM_LATINO},
             {"role": "user", "content": user_prompt}
-        ]).content
-        parsed = _parse_json(raw)
-
-        if "questions" in parsed:
-            parsed["questions"] = (parsed["questions"] or [])[:5]
+        ]
+    label = f"{subject}: {topic}" if subject and not _norm_label(topic).startswith(_norm_label(subject)) else topic
+    prompt = f"ARGOMENTO: {label}\nNUM_DOMANDE: {n}\nDIFFICOLTÀ: {level.upper()}"
+    return [
+        {"role": "system", "content": _SYSTEM},
+        {"role": "user", "content": prompt}
+    ]
 
-    else:
-        prompt = f"ARGOMENTO: {topic}\nNUM_DOMANDE: {n}\nDIFFICOLTÀ: {level.upper()}"
-        raw = llm.invoke([
-            {"role": "system", "content": _SYSTEM},
-            {"role": "user", "content": prompt}
-        ]).content
-        parsed = _parse_json(raw)
-        if "questions" in parsed:
-            parsed["questions"] = (parsed["questions"] or [])[:n]
+def _prepare_exam(parsed: dict, n: int, subject: Optional[str]) -> dict:
+    if "questions" in parsed:
+        parsed["questions"] = (parsed["questions"] or [])[:5 if _is_latino(subject) else n]
 
     # IDs robusti
     for q in parsed.get("questions", []):
@@ -170,7 +191,40 @@ def generate_exam(topic: str, n: int = 5, level: str = "medium", subject: Option
             for o in q["options"]:
                 o.setdefault("id", str(uuid.uuid4())[:4])
 
-    return Exam(**parsed)
+    return parsed
+
+def _generate_exam_llm(topic: str, n: int = 5, level: str = "medium", subject: Optional[str] = None) -> Exam:
+    """Generazione diretta con l'LLM (nessuna banca)."""
+    guidelines = _rag_guidelines_for_latino() if _is_latino(subject) else ""
+    return generate_structured(llm, _exam_messages(topic, n, level, subject, guidelines), Exam,
+                               name="exam", prepare=lambda d: _prepare_exam(d, n, subject))
+
+async def _agenerate_exam_llm(topic: str, n: int = 5, level: str = "medium", subject: Optional[str] = None) -> Exam:
+    guidelines = await asyncio.to_thread(_rag_guidelines_for_latino) if _is_latino(subject) else ""
+    return await agenerate_structured(llm, _exam_messages(topic, n, level, subject, guidelines), Exam,
+                                      name="exam", prepare=lambda d: _prepare_exam(d, n, subject))
+
+async def agenerate_exam(topic: str, n: int = 5, level: str = "medium",
+                         subject: Optional[str] = None) -> Exam:
+    """Versione async di generate_exam (modalità ASGI): banca domande in un thread, LLM con ainvoke."""
+    if not BANK_ENABLED:
+        return await _agenerate_exam_llm(topic, n, level, subject)
+
+    from clients import question_bank
+    try:
+        exam = await asyncio.to_thread(question_bank.sample_exam, subject, topic, level, n)
+        if exam is not None:
+            return exam
+    except Exception:
+        logging.warning("Question bank non disponibile, generazione diretta", exc_info=True)
+        return await _agenerate_exam_llm(topic, n, level, subject)
+
+    exam = await _agenerate_exam_llm(topic, n, level, subject)
+    try:
+        await asyncio.to_thread(question_bank.store_exam, exam, subject, topic, level)
+    except Exception:
+        logging.warning("Salvataggio nella question bank fallito", exc_info=True)
+    return exam
 
 # ─────────────────────────────────────────────────────────────
 # AI-grading per domande aperte
@@ -189,23 +243,188 @@ def _judge_open_ai(question: Question, student_answer: str) -> bool:
         "Rispondi solo YES se la risposta dello studente è sostanzialmente corretta, altrimenti NO."
     )
     try:
-        resp = llm.invoke(prompt).content.strip().upper()
+        resp = judge_llm.invoke(prompt).content.strip().upper()
         return resp.startswith("Y")
     except Exception:
         return False  # prudenziale
 
+# ─────────────────────────────────────────────────────────────
+# Grading aperte in blocco: un solo prompt strutturato oppure
+# chiamate per-domanda in parallelo (fallback).
+# Gli item sono coppie (domanda, risposta); i verdetti sono indicizzati
+# per posizione, così la stessa domanda può comparire più volte (bulk).
+# ─────────────────────────────────────────────────────────────
+# "batch" = prompt unici con verdetti per item; "parallel" = una chiamata per item, concorrenti
+GRADING_MODE = os.getenv("EXAM_GRADING_MODE", "batch").lower()
+GRADING_WORKERS = int(os.getenv("EXAM_GRADING_WORKERS", 8))
+BATCH_SIZE = int(os.getenv("EXAM_GRADING_BATCH_SIZE", 15))
+
+OpenItem = Tuple[Question, str]
+
+def _judge_open_batch_ai(items: List[OpenItem]) -> Optional[List[bool]]:
+    """
+    Valuta tutte le risposte aperte con UN solo prompt.
+    Ritorna i verdetti nello stesso ordine degli item oppure None se l'output
+    non è interpretabile (il chiamante ricade sulle chiamate per-domanda).
+    """
+    blocks = "\n\n".join(
+        f"[{i}]\nDomanda: {q.text}\nRisposta ideale: {q.ideal_answer}\nRisposta studente: {ans}"
+        for i, (q, ans) in enumerate(items, start=1)
+    )
+    prompt = (
+        "Sei un insegnante. Per OGNI elemento valuta se la risposta dello studente "
+        "è sostanzialmente corretta rispetto alla risposta ideale.\n\n"
+        f"{blocks}\n\n"
+        'Output: SOLO JSON {"verdicts": [{"n": 1, "correct": true/false}]} '
+        "con un elemento per ciascun numero. Nessun altro testo."
+    )
+    try:
+        raw = judge_llm.invoke(prompt).content
+        verdicts = loads_json(raw).get("verdicts") or []
+        out = {int(v["n"]): bool(v["correct"]) for v in verdicts}
+    except Exception:
+        return None
+    # tutti gli elementi devono avere un verdetto, altrimenti fallback
+    if any(i not in out for i in range(1, len(items) + 1)):
+        return None
+    return [out[i] for i in range(1, len(items) + 1)]
+
+def _judge_open_parallel(items: List[OpenItem]) -> List[bool]:
+    """Una chiamata _judge_open_ai per item, eseguite in parallelo."""
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(GRADING_WORKERS, len(items))) as pool:
+        return list(pool.map(lambda it: _judge_open_ai(*it), items))
+
+def _judge_open_chunk(items: List[OpenItem]) -> Tuple[List[bool], bool]:
+    """Prompt unico per un blocco; (verdetti, True se è servito il fallback)."""
+    if len(items) == 1:
+        return [_judge_open_ai(*items[0])], False
+    verdicts = _judge_open_batch_ai(items)
+    if verdicts is not None:
+        return verdicts, False
+    return _judge_open_parallel(items), True
+
+def _judge_open_many(items: List[OpenItem]) -> Tuple[List[bool], str]:
+    """
+    Valuta le risposte aperte (già non vuote). Ritorna (verdetti, modalità usata).
+    In modalità batch gli item sono divisi in blocchi da BATCH_SIZE valutati in parallelo.
+    """
+    if not items:
+        return [], "none"
+    if GRADING_MODE != "batch":
+        return _judge_open_parallel(items), "parallel"
+
+    chunks = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(GRADING_WORKERS, len(chunks))) as pool:
+        results = list(pool.map(_judge_open_chunk, chunks))
+    verdicts = [v for chunk_verdicts, _ in results for v in chunk_verdicts]
+    fallback = any(fb for _, fb in results)
+    return verdicts, "batch_fallback" if fallback else "batch"
+
+# ─────────────────────────────────────────────────────────────
+# Pre-giudizio locale per similarità di embedding
+# (solo la fascia ambigua va all'LLM)
+# ─────────────────────────────────────────────────────────────
+# Le soglie vanno ricavate con calibrate_thresholds su risposte già valutate, con lo stesso
+# modello di embedding usato in produzione:
+#     python -m clients.exam_tool --calibrate valutate.jsonl
+# (righe {"ideal_answer": ..., "answer": ..., "correct": true|false}); l'output va in
+# EXAM_SIM_ACCEPT / EXAM_SIM_REJECT. Con gli embedding OpenAI due testi italiani sullo
+# stesso argomento stanno quasi sempre sopra 0.6 anche se la risposta è sbagliata, quindi
+# senza calibrazione il rifiuto locale è disattivato (-1) e si accetta solo la quasi-parafrasi.
+PREJUDGE_ENABLED = os.getenv("EXAM_PREJUDGE", "1") != "0"
+SIM_ACCEPT = float(os.getenv("EXAM_SIM_ACCEPT", 0.95))   # >= : corretta senza LLM
+SIM_REJECT = float(os.getenv("EXAM_SIM_REJECT", -1.0))   # <= : errata senza LLM (-1 = mai)
+CALIBRATION_MIN_SAMPLES = 200
+
+def calibrate_thresholds(samples: List[Tuple[float, bool]], precision: float = 0.98) -> Tuple[float, float]:
+    """
+    Calcola (SIM_REJECT, SIM_ACCEPT) da coppie (similarità, verdetto del docente/LLM):
+    - accept: la soglia più bassa sopra cui almeno `precision` delle risposte è corretta;
+    - reject: la soglia più alta sotto cui almeno `precision` delle risposte è errata.
+    Da usare offline su esami già valutati; i valori vanno poi in EXAM_SIM_ACCEPT/REJECT.
+    """
+    ordered = sorted(samples, key=lambda s: s[0])
+    accept, reject = 1.01, -1.01
+    for i in range(len(ordered)):
+        tail = ordered[i:]
+        if sum(ok for _, ok in tail) / len(tail) >= precision:
+            accept = ordered[i][0]
+            break
+    for i in range(len(ordered), 0, -1):
+        head = ordered[:i]
+        if sum(not ok for _, ok in head) / len(head) >= precision:
+            reject = ordered[i - 1][0]
+            break
+    return min(reject, accept), accept
+
+def _prejudge_open(items: List[OpenItem]) -> List[Optional[bool]]:
+    """
+    Confronta risposta studente e ideal_answer via embedding.
+    Ritorna per ogni item True/False se il caso è chiaro, None se ambiguo (→ LLM).
+    Se gli embedding non sono disponibili tutto resta ambiguo.
+    """
+    decided: List[Optional[bool]] = [None] * len(items)
+    candidates = [i for i, (q, _) in enumerate(items) if q.ideal_answer]
+    if not PREJUDGE_ENABLED or not candidates:
+        return decided
+    try:
+        texts = [t for i in candidates for t in (items[i][0].ideal_answer, items[i][1])]
+        vecs = embed_texts(texts)
+    except Exception:
+        return decided
+
+    for j, i in enumerate(candidates):
+        sim = cosine(vecs[2 * j], vecs[2 * j + 1])
+        if sim >= SIM_ACCEPT:
+            decided[i] = True
+        elif sim <= SIM_REJECT:
+            decided[i] = False
+    return decided
+
+def _grade_open_items(items: List[OpenItem]) -> Tuple[List[bool], Dict[str, object]]:
+    """
+    Pipeline completa per le aperte: pre-giudizio locale, LLM sui soli ambigui.
+    Ritorna (verdetti nell'ordine degli item, statistiche/tempi).
+    """
+    t0 = time.perf_counter()
+    local = _prejudge_open(items)
+    prejudge_ms = _ms(t0)
+
+    ambiguous_idx = [i for i, v in enumerate(local) if v is None]
+    t0 = time.perf_counter()
+    llm_verdicts, mode = _judge_open_many([items[i] for i in ambiguous_idx])
+    verdicts = [bool(v) for v in local]
+    for i, v in zip(ambiguous_idx, llm_verdicts):
+        verdicts[i] = v
+
+    accepted = sum(1 for v in local if v is True)
+    stats = {
+        "prejudge_ms": prejudge_ms,
+        "open_ms": _ms(t0),
+        "open_mode": mode,
+        "accepted": accepted,
+        "rejected": sum(1 for v in local if v is False),
+        "ambiguous": len(ambiguous_idx),
+    }
+    return verdicts, stats
+
 # ─────────────────────────────────────────────────────────────
 # Feedback traduzione (Latino) basato su RAG
 # ─────────────────────────────────────────────────────────────
-def _judge_translation_ai(latin_text: str, student_translation: str, ref_translation: str) -> Dict[str, str]:
+def _judge_translation_ai(latin_text: str, student_translation: str, ref_translation: str,
+                          guidelines: Optional[str] = None) -> Dict[str, str]:
     """
     Fornisce un feedback sintetico sulla traduzione dello studente rispetto alla
-    traduzione di riferimento, basandosi anche su criteri recuperati via RAG.
+    traduzione di riferimento, basandosi anche su criteri recuperati via RAG
+    (`guidelines` già recuperate: una sola query RAG per esame, non per consegna).
     """
     if not student_translation or not student_translation.strip():
         return {"ok": "NO", "feedback": "Traduzione assente."}
 
-    guidelines = _rag_guidelines_for_latino()
+    if guidelines is None:
+        guidelines = _rag_guidelines_for_latino()
     prompt = (
         "Sei un docente di latino. Fornisci un giudizio sintetico (3-5 righe) "
         "sulla traduzione dello studente rispetto alla traduzione di riferimento, "
@@ -218,80 +437,277 @@ def _judge_translation_ai(latin_text: str, student_translation: str, ref_transla
         "Non aggiungere altro testo."
     )
     try:
-        resp = llm.invoke(prompt).content
-        m = re.search(r"\{[\s\S]+\}", resp)
-        if m:
-            return json.loads(m.group(0))
-        return {"ok": "PARZIALE", "feedback": resp[:500]}
+        resp = judge_llm.invoke(prompt).content
     except Exception:
         return {"ok": "PARZIALE", "feedback": "Feedback non disponibile."}
+    try:
+        return loads_json(resp)
+    except ValueError:
+        return {"ok": "PARZIALE", "feedback": resp[:500]}
 
 # ─────────────────────────────────────────────────────────────
 # Valutazione / grading
 # ─────────────────────────────────────────────────────────────
+def _ms(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000, 1)
+
+_TRAILING_PUNCT_RE = re.compile(r"[\s.,;:!?…]+$", re.U)
+
+def _normalize_answer(text: str) -> str:
+    """
+    Chiave di deduplica: minuscolo, spazi compattati, senza punteggiatura finale.
+    La punteggiatura interna resta: "-5" ≠ "5", "1/2" ≠ "12", "0,5" ≠ "05".
+    """
+    return _TRAILING_PUNCT_RE.sub("", " ".join((text or "").lower().split()))
+
+def _mcq_detail(q: Question, user_ans: str) -> dict:
+    correct_opt = next((o for o in (q.options or []) if o.is_correct), None)
+    if correct_opt is None:
+        return {
+            "qid": q.id,
+            "correct": False,
+            "correct_text": "(opzione corretta mancante)",
+            "explanation": q.explanation
+        }
+    return {
+        "qid": q.id,
+        "correct": user_ans == correct_opt.id,
+        "correct_text": correct_opt.text,
+        "explanation": q.explanation
+    }
+
+def _open_detail(q: Question, correct: bool) -> dict:
+    return {
+        "qid": q.id,
+        "correct": correct,
+        "correct_text": q.ideal_answer or "(risposta attesa)",
+        "explanation": q.explanation
+    }
+
+def _grade_submissions(exam: Exam, answer_sets: List[Dict[str, str | None]]) -> Tuple[List[dict], Dict[str, object]]:
+    """
+    Valuta più consegne dello stesso esame.
+    Le risposte aperte (e le traduzioni) identiche dopo normalizzazione sono
+    valutate una sola volta, quindi il costo dipende dal numero di risposte
+    DISTINTE e non dal numero di studenti.
+    """
+    t_start = time.perf_counter()
+    has_version = bool(exam.version_latin and exam.solution_translation)
+
+    # 1) raccolta risposte aperte e traduzioni uniche
+    t0 = time.perf_counter()
+    unique_open: Dict[Tuple[str, str], int] = {}
+    open_items: List[OpenItem] = []
+    unique_tr: Dict[str, str] = {}
+    total_open = 0
+    qmap = {q.id: q for q in exam.questions}
+    for answers in answer_sets:
+        for q in exam.questions:
+            if q.qtype == "mcq":
+                continue
+            ans = answers.get(q.id, "") or ""
+            if not ans.strip():
+                continue
+            total_open += 1
+            key = (q.id, _normalize_answer(ans))
+            if key not in unique_open:
+                unique_open[key] = len(open_items)
+                open_items.append((qmap[q.id], ans))
+        tr = (answers.get("translation", "") or "").strip()
+        if has_version and tr:
+            unique_tr.setdefault(_normalize_answer(tr), tr)
+    timing: Dict[str, object] = {"collect_ms": _ms(t0)}
+
+    # 2) traduzioni in background, mentre si valutano le aperte
+    def _timed_translations() -> Tuple[Dict[str, dict], float]:
+        t = time.perf_counter()
+        if not unique_tr:
+            return {}, 0.0
+        keys = list(unique_tr)
+        guidelines = _rag_guidelines_for_latino()
+        with ThreadPoolExecutor(max_workers=min(GRADING_WORKERS, len(keys))) as tpool:
+            fbs = tpool.map(
+                lambda k: _judge_translation_ai(exam.version_latin, unique_tr[k], exam.solution_translation,
+                                                guidelines),
+                keys,
+            )
+            return dict(zip(keys, fbs)), _ms(t)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        tr_future = pool.submit(_timed_translations)
+        verdicts, open_stats = _grade_open_items(open_items)
+        feedbacks, translation_ms = tr_future.result()
+    timing.update(
+        prejudge_ms=open_stats["prejudge_ms"],
+        open_ms=open_stats["open_ms"],
+        open_mode=open_stats["open_mode"],
+        open_count=total_open,
+        open_unique=len(open_items),
+    )
+    if unique_tr:
+        timing["translation_ms"] = translation_ms
+
+    # 3) composizione risultati per consegna
+    results: List[dict] = []
+    for answers in answer_sets:
+        details, score = [], 0
+        for q in exam.questions:
+            ans = answers.get(q.id, "") or ""
+            if q.qtype == "mcq":
+                d = _mcq_detail(q, ans)
+            else:
+                idx = unique_open.get((q.id, _normalize_answer(ans))) if ans.strip() else None
+                d = _open_detail(q, verdicts[idx] if idx is not None else False)
+            details.append(d)
+            score += int(d["correct"])
+
+        result = {"score": score, "max": len(exam.questions), "details": details}
+        if has_version:
+            translation_block: Dict[str, object] = {
+                "solution_translation": exam.solution_translation
+            }
+            tr = (answers.get("translation", "") or "").strip()
+            if tr:
+                translation_block["student_feedback"] = feedbacks[_normalize_answer(tr)]
+            result["translation"] = translation_block
+        results.append(result)
+
+    stats = {
+        "prejudge": {
+            "accepted": open_stats["accepted"],
+            "rejected": open_stats["rejected"],
+            "ambiguous": open_stats["ambiguous"],
+            # giudizi LLM evitati grazie agli embedding (vuote e duplicate non contano)
+            "llm_calls_avoided": open_stats["accepted"] + open_stats["rejected"],
+        },
+        "timing": timing,
+    }
+    timing["total_ms"] = _ms(t_start)
+    return results, stats
+
 def grade_exam(exam: Exam, answers: Dict[str, str | None]) -> dict:
     """
-    - Valuta MCQ e OPEN.
+    - Valuta MCQ e OPEN: le aperte chiaramente giuste/sbagliate sono decise localmente
+      via embedding (_prejudge_open), le ambigue in un unico prompt o in parallelo.
     - Se l'esame contiene una versione (Latino), ritorna la traduzione di riferimento
-      e, se presente 'answers[\"translation\"]', un feedback sintetico.
+      e, se presente 'answers[\"translation\"]', un feedback sintetico
+      (calcolato in parallelo alle domande aperte).
+    - 'timing' riporta i tempi (ms) delle varie fasi.
     """
-    details = []
-    score = 0
-
-    for q in exam.questions:
-        user_ans = answers.get(q.id, "") or ""
-
-        if q.qtype == "mcq":
-            try:
-                correct_opt = next(o for o in (q.options or []) if o.is_correct)
-                correct = (user_ans == correct_opt.id)
-                details.append({
-                    "qid": q.id,
-                    "correct": correct,
-                    "correct_text": correct_opt.text,
-                    "explanation": q.explanation
-                })
-                score += int(correct)
-            except StopIteration:
-                details.append({
-                    "qid": q.id,
-                    "correct": False,
-                    "correct_text": "(opzione corretta mancante)",
-                    "explanation": q.explanation
-                })
-
-        else:  # open
-            correct = _judge_open_ai(q, user_ans)
-            details.append({
-                "qid": q.id,
-                "correct": correct,
-                "correct_text": q.ideal_answer or "(risposta attesa)",
-                "explanation": q.explanation
-            })
-            score += int(correct)
-
-    result = {"score": score, "max": len(exam.questions), "details": details}
-
-    if exam.version_latin and exam.solution_translation:
-        student_tr = (answers.get("translation", "") or "").strip()
-        translation_block: Dict[str, object] = {
-            "solution_translation": exam.solution_translation
-        }
-        if student_tr:
-            fb = _judge_translation_ai(exam.version_latin, student_tr, exam.solution_translation)
-            translation_block["student_feedback"] = fb
-        result["translation"] = translation_block
+    results, stats = _grade_submissions(exam, [answers])
+    return {**results[0], **stats}
 
-    return result
+def parse_submissions(raw: object) -> Dict[str, Dict[str, str | None]]:
+    """
+    Consegne del body di /grade_exam_bulk → {student_id: risposte}.
+    Accetta {"<student_id>": {<qid>: <risposta>}} oppure [{"student_id": ..., "answers": {...}}];
+    ValueError (→ 400) per voci non valide, student_id mancanti o ripetuti.
+    """
+    if isinstance(raw, dict):
+        entries = [(sid, answers) for sid, answers in raw.items()]
+    elif isinstance(raw, list):
+        entries = []
+        for i, s in enumerate(raw, start=1):
+            if not isinstance(s, dict):
+                raise ValueError(f"consegna {i}: attesa un oggetto con student_id e answers")
+            sid = s.get("student_id")
+            if isinstance(sid, (int, str)) and not isinstance(sid, bool):
+                sid = str(sid).strip()
+            if not sid:
+                raise ValueError(f"consegna {i}: student_id mancante o non valido")
+            entries.append((sid, s.get("answers")))
+    else:
+        raise ValueError("submissions deve essere un oggetto o una lista")
+
+    subs: Dict[str, Dict[str, str | None]] = {}
+    for sid, answers in entries:
+        if sid in subs:
+            raise ValueError(f"student_id ripetuto: {sid}")
+        answers = answers or {}
+        if not isinstance(answers, dict) or \
+                not all(isinstance(a, str) or a is None for a in answers.values()):
+            raise ValueError(f"risposte di {sid}: atteso un oggetto {{id_domanda: testo}}")
+        subs[sid] = answers
+    return subs
+
+def grade_exam_bulk(exam: Exam, submissions: Dict[str, Dict[str, str | None]]) -> dict:
+    """
+    Valuta in blocco le consegne di una classe per lo stesso esame.
+    submissions: {student_id: answers}. Ritorna risultati per studente
+    e statistiche aggregate di classe.
+    """
+    student_ids = list(submissions)
+    results, stats = _grade_submissions(exam, [submissions[s] or {} for s in student_ids])
+
+    scores = sorted(r["score"] for r in results)
+    n = len(scores)
+    per_question = []
+    for i, q in enumerate(exam.questions):
+        n_correct = sum(1 for r in results if r["details"][i]["correct"])
+        per_question.append({
+            "qid": q.id,
+            "qtype": q.qtype,
+            "correct": n_correct,
+            "rate": round(n_correct / n, 3) if n else 0.0,
+        })
+    distribution: Dict[int, int] = {}
+    for s in scores:
+        distribution[s] = distribution.get(s, 0) + 1
+
+    class_stats = {
+        "students": n,
+        "max": len(exam.questions),
+        "mean": round(sum(scores) / n, 2) if n else 0.0,
+        "median": (scores[n // 2] if n % 2 else (scores[n // 2 - 1] + scores[n // 2]) / 2) if n else 0.0,
+        "min_score": scores[0] if n else 0,
+        "max_score": scores[-1] if n else 0,
+        "distribution": distribution,
+        "per_question": per_question,
+    }
+    return {
+        "results": dict(zip(student_ids, results)),
+        "class": class_stats,
+        **stats,
+    }
 
 # ─────────────────────────────────────────────────────────────
 # LangChain tool
 # ─────────────────────────────────────────────────────────────
 generate_exam_tool = StructuredTool.from_function(
     func=generate_exam,
+    coroutine=agenerate_exam,
     name="Generate_Exam",
     description=("Genera un esame; per Latino produce una versione da tradurre + 5 domande di comprensione "
                  "e include solution_translation. Per altre materie genera MCQ/open con ideal_answer ed explanation."),
     return_direct=True,
     output_schema=Exam,
 )
+
+
+# ---------- CLI: calibrazione delle soglie del pre-giudizio ---------- #
+def _calibrate_file(path: str, precision: float) -> None:
+    import json
+    with open(path, encoding="utf-8") as fh:
+        rows = [json.loads(line) for line in fh if line.strip()]
+    rows = [r for r in rows if (r.get("ideal_answer") or "").strip() and (r.get("answer") or "").strip()]
+    if len(rows) < CALIBRATION_MIN_SAMPLES:
+        print(f"Attenzione: solo {len(rows)} risposte (consigliate almeno {CALIBRATION_MIN_SAMPLES}).")
+    samples = []
+    for i in range(0, len(rows), 100):
+        block = rows[i:i + 100]
+        vecs = embed_texts([t for r in block for t in (r["ideal_answer"], r["answer"])])
+        samples += [(cosine(vecs[2 * j], vecs[2 * j + 1]), bool(r["correct"])) for j, r in enumerate(block)]
+    reject, accept = calibrate_thresholds(samples, precision)
+    decided = sum(1 for sim, _ in samples if sim >= accept or sim <= reject)
+    print(f"EXAM_SIM_ACCEPT={accept:.4f}")
+    print(f"EXAM_SIM_REJECT={reject:.4f}")
+    print(f"# {decided}/{len(samples)} risposte decise senza LLM con precisione >= {precision:.0%}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Calibra EXAM_SIM_ACCEPT / EXAM_SIM_REJECT")
+    parser.add_argument("--calibrate", required=True, help="JSONL con ideal_answer, answer, correct")
+    parser.add_argument("--precision", type=float, default=0.98)
+    args = parser.parse_args()
+    _calibrate_file(args.calibrate, args.precision)
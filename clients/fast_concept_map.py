@@ -0,0 +1,243 @@
+# clients/fast_concept_map.py
+"""
+Mappa concettuale "veloce", senza LLM, costruita dai chunk RAG.
+
+1. keyphrase: sequenze di 1–3 parole piene tra stopword e punteggiatura, pesate per
+   frequenza, numero di chunk in cui compaiono e lunghezza;
+2. co-occorrenza: quante frasi del testo contengono entrambe le keyphrase;
+3. clustering gerarchico (average linkage, similarità coseno) degli embedding delle
+   keyphrase, fermato al numero di categorie voluto; senza embedding si usa il profilo
+   di co-occorrenza di ciascuna keyphrase.
+
+Per ogni cluster l'etichetta della categoria è la keyphrase più rappresentativa
+(peso × similarità media con gli altri membri); i sotto-nodi sono gli altri membri,
+ordinati per co-occorrenza con l'etichetta. Il formato è lo stesso della modalità LLM
+(root → cX → cX_Y) e il costo è una query RAG più un embedding batch delle keyphrase.
+"""
+from __future__ import annotations
+import asyncio, logging, math, re
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+from clients.concept_map_tool import ConceptMap, Link, Node
+from clients.embeddings import embed_texts
+from clients.query_rag_tool import aquery_rag_chunks, query_rag_chunks
+
+MAX_PHRASES = 36          # keyphrase candidate messe nel clustering
+MAX_PHRASE_WORDS = 3
+
+_STOPWORDS = set("""
+a ad agli ai al alla alle allo anche ancora avere aveva avevano c che chi ci come con contro cui da dagli dai dal
+dall dalla dalle dallo degli dei del dell della delle dello di dopo dove e è ed era erano essere essa esse essi esso
+fra gli ha hanno i il in infatti inoltre invece io l la le lo loro lui ma mentre molto molti molte ne negli nei nel
+nell nella nelle nello no noi non nostro o ogni oltre per perché però più poco poi prima proprio può quale quali
+quando quanto quasi quella quelle quelli quello questa queste questi questo qui se secondo sembra senza si sia
+siano sono sotto sta stata state stati stato su sua sue sugli sui sul sull sulla sulle sullo suo suoi tale tali
+tanto tra tre tutta tutte tutti tutto un una uno vi viene vengono volta anni anno due fu furono così stesso
+stessa essendo fino già altri altre altro altra cosa modo parte pagina tipo dunque quindi circa the of and to
+""".split())
+_CLAUSE_SPLIT = re.compile(r"[.,;:!?()\[\]{}\"«»“”–—\n\r\t/]+| - ")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+_WORD = re.compile(r"[^\W\d_]+", re.UNICODE)
+# forme verbali finite frequenti nei testi storici: fanno da confine come le stopword, così
+# "Stalingrado segnò" resta "Stalingrado". Solo desinenze plurali (passato remoto, imperfetto),
+# che nessun nome comune ha; le singolari (-ava, -ò, -ù...) colpirebbero "offensiva",
+# "iniziativa", "virtù", "servitù", quindi si usa un elenco chiuso di verbi.
+_VERB_FORM = re.compile(r"(?:arono|erono|irono|avano|evano|ivano)$")
+_VERBS = frozenset("""
+ebbe venne divenne nacque morì fece diede disse pose vinse perse
+segnò portò iniziò cominciò terminò finì durò provocò causò scoppiò sancì decise conquistò
+fondò governò regnò guidò invase occupò sconfisse entrò rimase
+cadde prese mise scrisse chiese giunse raggiunse condusse produsse ridusse vide volle seppe tenne
+ottenne mantenne sostenne ruppe assunse impose depose propose elesse accolse scelse sciolse mosse
+spinse costrinse estese difese concesse successe apparve crebbe conobbe visse corse
+ebbero vennero divennero nacquero fecero diedero dissero posero vinsero persero caddero presero
+misero scrissero chiesero giunsero tennero ottennero ruppero assunsero elessero scelsero rimasero
+vissero crebbero
+proclamò firmò creò lasciò tornò trovò stabilì unì costruì abolì tentò riuscì partì ordinò
+""".split())
+# ai bordi di una frase di più parole, una parola in -ò/-è accentata è quasi sempre un passato
+# remoto fuori elenco ("Assemblea nazionale proclamò"): si toglie, la parola isolata resta
+_EDGE_VERB = re.compile(r"[òè]$")
+
+
+# ───────────────────────── keyphrase ─────────────────────────
+
+def _trim_edges(run: List[str]) -> List[str]:
+    while len(run) > 1 and _EDGE_VERB.search(run[-1].lower()):
+        run = run[:-1]
+    while len(run) > 1 and _EDGE_VERB.search(run[0].lower()):
+        run = run[1:]
+    return run
+
+def _phrases_in(clause: str) -> List[Tuple[str, ...]]:
+    """Sequenze massime di parole non-stopword, spezzate a MAX_PHRASE_WORDS."""
+    out: List[Tuple[str, ...]] = []
+    run: List[str] = []
+    for w in _WORD.findall(clause.replace("'", " ").replace("’", " ")) + [""]:
+        lw = w.lower()
+        if not w or lw in _STOPWORDS or len(w) < 3 or lw in _VERBS or _VERB_FORM.search(lw):
+            run = _trim_edges(run)
+            out.extend(tuple(run[i:i + MAX_PHRASE_WORDS]) for i in range(0, len(run), MAX_PHRASE_WORDS))
+            run = []
+        else:
+            run.append(w)
+    return out
+
+def extract_keyphrases(chunks: Sequence[str], topic: str, limit: int = MAX_PHRASES):
+    """
+    Ritorna (frasi, etichette, pesi, frasi per periodo): frasi in minuscolo ordinate per peso,
+    etichetta = forma superficiale più frequente, periodi = insiemi di frasi che co-occorrono.
+    """
+    topic_words = {w.lower() for w in _WORD.findall(topic)}
+    tf: Counter = Counter()
+    df: Counter = Counter()
+    surface: Dict[str, Counter] = defaultdict(Counter)
+    sentences: List[set] = []
+
+    for chunk in chunks:
+        seen_in_chunk = set()
+        for sentence in _SENTENCE_SPLIT.split(chunk):
+            in_sentence = set()
+            for clause in _CLAUSE_SPLIT.split(sentence):
+                for words in _phrases_in(clause):
+                    key = " ".join(words).lower()
+                    if set(key.split()) <= topic_words:      # l'argomento è già la radice
+                        continue
+                    tf[key] += 1
+                    surface[key][" ".join(words)] += 1
+                    in_sentence.add(key)
+            if in_sentence:
+                sentences.append(in_sentence)
+                seen_in_chunk |= in_sentence
+        df.update(seen_in_chunk)
+
+    n_chunks = max(1, len(chunks))
+    weight = {
+        k: tf[k] * (1 + 0.5 * (k.count(" "))) * (1 + df[k] / n_chunks)
+        for k in tf
+        if tf[k] > 1 or k.count(" ")                       # unigrammi isolati: rumore
+    }
+    phrases = sorted(weight, key=lambda k: (-weight[k], k))[:limit]
+    labels = {k: _label(surface[k].most_common(1)[0][0]) for k in phrases}
+    keep = set(phrases)
+    sentences = [s & keep for s in sentences if len(s & keep) > 0]
+    return phrases, labels, weight, sentences
+
+def _label(text: str) -> str:
+    return text[:1].upper() + text[1:]
+
+def cooccurrence(sentences: Sequence[set]) -> Dict[Tuple[str, str], int]:
+    counts: Dict[Tuple[str, str], int] = defaultdict(int)
+    for s in sentences:
+        items = sorted(s)
+        for i, a in enumerate(items):
+            for b in items[i + 1:]:
+                counts[(a, b)] += 1
+                counts[(b, a)] += 1
+    return counts
+
+
+# ───────────────────────── clustering ─────────────────────────
+
+def _normalize(v: Sequence[float]) -> List[float]:
+    n = math.sqrt(sum(x * x for x in v))
+    return [x / n for x in v] if n else list(v)
+
+def _similarity_matrix(vectors: Sequence[Sequence[float]]) -> List[List[float]]:
+    unit = [_normalize(v) for v in vectors]
+    n = len(unit)
+    sim = [[1.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            sim[i][j] = sim[j][i] = sum(a * b for a, b in zip(unit[i], unit[j]))
+    return sim
+
+def agglomerate(sim: List[List[float]], n_clusters: int) -> List[List[int]]:
+    """Clustering gerarchico agglomerativo (average linkage) fino a n_clusters gruppi."""
+    clusters: Dict[int, List[int]] = {i: [i] for i in range(len(sim))}
+    link = {(i, j): sim[i][j] for i in clusters for j in clusters if i < j}
+    next_id = len(sim)
+    while len(clusters) > max(1, n_clusters) and link:
+        (a, b), _ = max(link.items(), key=lambda kv: kv[1])
+        merged = clusters.pop(a) + clusters.pop(b)
+        new_link = {(x, y): s for (x, y), s in link.items() if not {x, y} & {a, b}}
+        for c, members in clusters.items():
+            total = sum(sim[i][j] for i in merged for j in members)
+            new_link[(min(c, next_id), max(c, next_id))] = total / (len(merged) * len(members))
+        link = new_link
+        clusters[next_id] = merged
+        next_id += 1
+    return list(clusters.values())
+
+
+# ───────────────────────── mappa ─────────────────────────
+
+def _n_categories(max_nodes: int, n_phrases: int) -> int:
+    return max(1, min(8, round((max_nodes - 1) / 3.5), n_phrases))
+
+def build_concept_map(topic: str, chunks: Sequence[str], max_nodes: int = 20) -> ConceptMap:
+    root = Node(key="root", text=_label(topic.strip() or "Argomento"))
+    phrases, labels, weight, sentences = extract_keyphrases(chunks, topic)
+    if not phrases:
+        return ConceptMap(nodeDataArray=[root], linkDataArray=[])
+
+    co = cooccurrence(sentences)
+    try:
+        vectors = embed_texts([labels[p] for p in phrases])
+    except Exception as e:
+        # senza embedding: profilo di co-occorrenza (frase × periodo) come vettore
+        logging.warning("[fast_cmap] embedding non disponibili (%s): uso la co-occorrenza", e)
+        vectors = [[1.0 if p in s else 0.0 for s in sentences] for p in phrases]
+    sim = _similarity_matrix(vectors)
+    groups = agglomerate(sim, _n_categories(max_nodes, len(phrases)))
+
+    categories = []
+    for members in groups:
+        def centrality(i: int) -> float:
+            others = [sim[i][j] for j in members if j != i]
+            return weight[phrases[i]] * (1 + (sum(others) / len(others) if others else 0.0))
+        head = max(members, key=centrality)
+        rest = sorted((j for j in members if j != head),
+                      key=lambda j: (-co.get((phrases[head], phrases[j]), 0), -weight[phrases[j]]))
+        categories.append((sum(weight[phrases[i]] for i in members), head, rest))
+    categories.sort(key=lambda c: -c[0])
+
+    # budget: prima tutte le categorie, poi i sotto-nodi a giro (round robin) fino a max_nodes
+    budget = max(0, max_nodes - 1 - len(categories))
+    children: List[List[int]] = [[] for _ in categories]
+    depth = 0
+    while budget > 0 and any(depth < len(c[2]) for c in categories):
+        for ci, (_, _, rest) in enumerate(categories):
+            if budget and depth < len(rest):
+                children[ci].append(rest[depth])
+                budget -= 1
+        depth += 1
+
+    nodes, links = [root], []
+    for ci, (_, head, _) in enumerate(categories[:max(1, max_nodes - 1)], start=1):
+        nodes.append(Node(key=f"c{ci}", text=labels[phrases[head]]))
+        links.append(Link(**{"from": "root", "to": f"c{ci}"}))
+        for si, j in enumerate(children[ci - 1], start=1):
+            nodes.append(Node(key=f"c{ci}_{si}", text=labels[phrases[j]]))
+            links.append(Link(**{"from": f"c{ci}", "to": f"c{ci}_{si}"}))
+    return ConceptMap(nodeDataArray=nodes, linkDataArray=links)
+
+
+def fast_concept_map(topic: str, max_nodes: int = 20, top_k: int = 8) -> ConceptMap:
+    """Mappa dai chunk RAG, senza LLM; se il retrieval fallisce ritorna solo la radice."""
+    try:
+        rows = query_rag_chunks(topic, top_k=top_k)
+    except Exception:
+        logging.exception("[fast_cmap] retrieval fallito")
+        rows = []
+    return build_concept_map(topic, [chunk for _, _, chunk in rows], max_nodes)
+
+async def afast_concept_map(topic: str, max_nodes: int = 20, top_k: int = 8) -> ConceptMap:
+    try:
+        rows = await aquery_rag_chunks(topic, top_k=top_k)
+    except Exception:
+        logging.exception("[fast_cmap] retrieval fallito")
+        rows = []
+    # l'embedding delle keyphrase è sincrono (cache condivisa): fuori dall'event loop
+    return await asyncio.to_thread(build_concept_map, topic, [chunk for _, _, chunk in rows], max_nodes)
@@ -1,9 +1,11 @@
 # clients/history_store.py
 from __future__ import annotations
-import os, psycopg2
+import json, os, psycopg2
 from typing import Optional, List, Dict, Any
 from psycopg2.extras import Json, RealDictCursor
 
+from clients.telemetry import span
+
 def _conn():
     return psycopg2.connect(
         host=os.getenv("DB_HOST"),
@@ -32,7 +34,7 @@ def ensure_history_schema() -> None:
 
 def save_event(kind: str, title: str, data: Optional[Dict[str, Any]] = None,
                file_path: Optional[str] = None, client_id: Optional[str] = None) -> Dict[str, Any]:
-    with _conn() as conn, conn.cursor() as cur:
+    with span("db", "save_event"), _conn() as conn, conn.cursor() as cur:
         cur.execute(
             "INSERT INTO events (client_id, kind, title, data, file_path) VALUES (%s,%s,%s,%s,%s) RETURNING id, created_at",
             (client_id, kind, title, Json(data or {}), file_path),
@@ -42,7 +44,7 @@ def save_event(kind: str, title: str, data: Optional[Dict[str, Any]] = None,
         return {"id": eid, "created_at": created.isoformat()}
 
 def list_events(client_id: str, limit: int = 100) -> List[Dict[str, Any]]:
-    with _conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with span("db", "list_events"), _conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
             SELECT id, kind, title, created_at,
                    (file_path IS NOT NULL) AS has_file
@@ -53,12 +55,98 @@ def list_events(client_id: str, limit: int = 100) -> List[Dict[str, Any]]:
         """, (client_id, limit))
         return [dict(r) for r in cur.fetchall()]
 
-def get_event(event_id: int, client_id: Optional[str]) -> Optional[Dict[str, Any]]:
-    with _conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+def get_event(event_id: int, client_id: str) -> Optional[Dict[str, Any]]:
+    """Evento del client indicato; None se non esiste o appartiene a un altro client."""
+    if not client_id:
+        return None
+    with span("db", "get_event"), _conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
             SELECT id, client_id, kind, title, data, file_path, created_at
             FROM events
-            WHERE id = %s AND (client_id = %s OR %s IS NULL)
-        """, (event_id, client_id, client_id))
+            WHERE id = %s AND client_id = %s
+        """, (event_id, client_id))
         row = cur.fetchone()
         return dict(row) if row else None
+
+# ───────────── Memoria conversazionale (finestra + riassunto) ─────────────
+
+def ensure_conversation_schema() -> None:
+    with _conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+          client_id  TEXT PRIMARY KEY,
+          summary    TEXT NOT NULL DEFAULT '',
+          turns      JSONB NOT NULL DEFAULT '[]'::jsonb,
+          updated_at TIMESTAMP DEFAULT NOW()
+        );
+        """)
+        conn.commit()
+
+def load_conversation(client_id: str) -> Dict[str, Any]:
+    with span("db", "load_conversation"), _conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT summary, turns FROM conversations WHERE client_id = %s", (client_id,))
+        row = cur.fetchone()
+        if not row:
+            return {"summary": "", "turns": []}
+        return {"summary": row["summary"] or "", "turns": row["turns"] or []}
+
+def save_conversation(client_id: str, summary: str, turns: List[Dict[str, str]]) -> None:
+    with span("db", "save_conversation"), _conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO conversations (client_id, summary, turns, updated_at)
+            VALUES (%s, %s, %s, NOW())
+            ON CONFLICT (client_id) DO UPDATE
+              SET summary = EXCLUDED.summary, turns = EXCLUDED.turns, updated_at = NOW()
+        """, (client_id, summary, Json(turns)))
+        conn.commit()
+
+def append_turn(client_id: str, turn: Dict[str, str]) -> int:
+    """Aggiunge un turno in coda con un solo statement; restituisce il numero di turni salvati."""
+    with span("db", "append_turn"), _conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO conversations (client_id, turns, updated_at)
+            VALUES (%s, jsonb_build_array(%s::jsonb), NOW())
+            ON CONFLICT (client_id) DO UPDATE
+              SET turns = conversations.turns || EXCLUDED.turns, updated_at = NOW()
+            RETURNING jsonb_array_length(turns)
+        """, (client_id, Json(turn)))
+        n = cur.fetchone()[0]
+        conn.commit()
+        return n
+
+def fold_turns(client_id: str, summary: str, evicted: List[Dict[str, str]]) -> bool:
+    """
+    Sostituisce il riassunto e toglie i primi len(evicted) turni, solo se sono ancora
+    quelli riassunti (nel frattempo la conversazione può essere stata azzerata).
+    """
+    with span("db", "fold_turns"), _conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE conversations
+               SET summary = %s,
+                   turns = COALESCE((SELECT jsonb_agg(t.e ORDER BY t.i)
+                                       FROM jsonb_array_elements(turns) WITH ORDINALITY AS t(e, i)
+                                      WHERE t.i > %s), '[]'::jsonb),
+                   updated_at = NOW()
+             WHERE client_id = %s
+               AND (SELECT jsonb_agg(t.e ORDER BY t.i)
+                      FROM jsonb_array_elements(turns) WITH ORDINALITY AS t(e, i)
+                     WHERE t.i <= %s) = %s::jsonb
+        """, (summary, len(evicted), client_id, len(evicted), Json(evicted)))
+        done = cur.rowcount == 1
+        conn.commit()
+        return done
+
+# versioni async (modalità ASGI, pool asyncpg)
+
+async def aload_conversation(client_id: str) -> Dict[str, Any]:
+    from clients.async_db import get_pool
+    with span("db", "load_conversation"):
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT summary, turns FROM conversations WHERE client_id = $1", client_id)
+    if not row:
+        return {"summary": "", "turns": []}
+    turns = row["turns"]
+    if isinstance(turns, str):  # asyncpg restituisce JSONB come testo senza codec dedicato
+        turns = json.loads(turns)
+    return {"summary": row["summary"] or "", "turns": turns or []}
@@ -0,0 +1,205 @@
+# clients/intent_router.py
+"""
+Router locale delle intenzioni per /ask.
+
+Le richieste riconoscibili con certezza ("mappa concettuale su…", "piano lezioni di…",
+"riassunto di…", "quiz su…") vengono mandate direttamente alla funzione giusta,
+senza il giro dell'AgentExecutor (che spende una chiamata LLM solo per scegliere il tool).
+Le richieste ambigue o composte tornano None → agente.
+
+Due stadi:
+1) regole (regex) con estrazione dell'argomento;
+2) opzionale (ROUTER_EMBEDDINGS=1): classificatore per similarità tra la domanda
+   e le descrizioni dei tool, con soglia e margine sul secondo classificato.
+"""
+from __future__ import annotations
+import os, re, threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from clients.embeddings import embed_texts, cosine
+
+_PREP = r"(?:su(?:lla|llo|lle|ll'|gli|l|i)?|delle|degli|dei|del(?:la|lo|l')?|di|per|in|riguardo(?:\s+a)?)"
+# preposizione come parola intera: seguita da spazio, o attaccata solo se elisa ("sull'Impero"),
+# così "quiz dinosauri" non diventa "di" + "nosauri"
+_PREP_SEP = rf"{_PREP}(?:(?<=')\s*|\s+)"
+_EXAM_PREP_SEP = r"(?:su(?:lla|llo|lle|ll'|gli|l|i)?|delle|degli|dei|del(?:la|lo|l')?|di|riguardo\s+a)(?:(?<=')\s*|\s+)"
+
+# inizio di una richiesta esplicita: "per favore", "puoi", "fammi un", ...
+_LEAD = (r"^\s*(?:per\s+favore\s*,?\s*)?(?:(?:puoi|potresti)\s+)?(?:mi\s+)?"
+         r"(?:(?:fammi|farmi|fai|crea(?:mi)?|genera(?:mi)?|prepara(?:mi)?|scrivi(?:mi)?|dammi|voglio)\s+)?"
+         r"(?:(?:un[ao]?|il|la|lo)\s+|l')?")
+
+# "esame di storia", "quiz sulla fotosintesi", "fammi un quiz di 10 domande sull'Impero romano",
+# "verifica di storia su Napoleone"; solo a inizio richiesta ("cosa è un test in statistica?" no)
+EXAM_RE = re.compile(
+    _LEAD + r"(?:esame|quiz|verifica|(?<=\s)test)"
+    r"(?:\s+(?:di|da|con)\s+(?P<n>\d{1,2})\s+domande)?"
+    rf"\s+{_EXAM_PREP_SEP}(?P<topic>[\w\sàèéìòù']+)", re.I)
+
+# "riassunto"/"sintesi" sono anche nomi comuni ("la sintesi proteica"): la regola vale solo a
+# inizio richiesta, come verbo imperativo o come oggetto di una richiesta esplicita seguito
+# da preposizione ("fammi un riassunto della…", "sintesi del…", "riassumi…")
+_SUMMARY_RE = re.compile(
+    _LEAD + r"(?:"
+    rf"(?:riassunto|sintesi)\s+{_PREP_SEP}"
+    rf"|(?:riassumi(?:mi)?|riassumere|sintetizza(?:mi|re)?)\s+(?:{_PREP_SEP})?"
+    r")(?P<topic>.+)", re.I)
+
+# materie riconosciute in "quiz di <materia> su <argomento>"
+_SUBJECTS = frozenset("""
+storia latino greco italiano letteratura geografia matematica fisica chimica biologia scienze
+filosofia arte inglese francese spagnolo tedesco informatica economia diritto musica religione
+""".split())
+_EXAM_MAX_N = 20
+_RULES: Dict[str, re.Pattern] = {
+    "exam": EXAM_RE,
+    "concept_map": re.compile(
+        rf"\b(?:mappa|mappe)\s+concettual[ei]\s+(?:{_PREP_SEP})?(?P<topic>.+)", re.I),
+    "lesson_plan": re.compile(
+        rf"\b(?:piano\s+(?:di\s+|delle\s+)?lezion[ei]|lesson\s+plan|programmazione\s+didattica)\s+"
+        rf"(?:{_PREP_SEP})?(?P<topic>.+)", re.I),
+    "summary": _SUMMARY_RE,
+}
+
+# segnali di richieste composte o che richiedono altri tool → meglio l'agente
+_COMPOSITE_RE = re.compile(
+    r"\b(?:e\s+poi|dopo(?:\s+di\s+che)?|inoltre|invia|manda|spedisci|e-?mail|cerca\s+(?:sul|in)\s+(?:web|internet)|"
+    r"sql|database|carica|ingest)\b", re.I)
+
+_MAX_TOPIC_WORDS = 12
+
+# argomenti che rimandano alla conversazione ("mappa concettuale su questo"): servono memoria e agente
+_DEICTIC_RE = re.compile(
+    r"^(?:questo|questa|quello|quella|ciò|cio|esso|essa|lo\s+stesso(?:\s+argomento)?|"
+    r"(?:l'|lo\s+|il\s+|la\s+)?(?:argomento|tema)\s+(?:precedente|di\s+prima))$", re.I)
+
+# descrizioni per il classificatore a embedding (stessa lingua delle domande)
+_INTENT_DESCRIPTIONS: Dict[str, str] = {
+    "exam": "Genera un quiz, un test o un esame con domande a scelta multipla e aperte su un argomento.",
+    "concept_map": "Crea una mappa concettuale gerarchica con categorie e sotto-concetti su un argomento.",
+    "lesson_plan": "Prepara un piano di lezioni, una programmazione didattica con obiettivi e attività.",
+    "summary": "Scrivi un riassunto didattico con punti chiave, glossario e domande di ripasso.",
+}
+_EMB_ENABLED = os.getenv("ROUTER_EMBEDDINGS", "0") == "1"
+_EMB_THRESHOLD = float(os.getenv("ROUTER_EMB_THRESHOLD", 0.80))
+_EMB_MARGIN = float(os.getenv("ROUTER_EMB_MARGIN", 0.05))
+_LEAD_RE = re.compile(
+    r"^(?:per\s+favore\s+|puoi\s+|potresti\s+|mi\s+)?(?:fammi|fai|crea|genera|prepara|scrivi|dammi|voglio)?\s*"
+    r"(?:un[ao]?\s+|il\s+|la\s+|lo\s+)?", re.I)
+
+
+@dataclass
+class Route:
+    intent: str
+    topic: str
+    source: str          # "rule" | "embedding"
+    confidence: float
+    n: Optional[int] = None          # esame: numero di domande richiesto
+    subject: Optional[str] = None    # esame: materia, se indicata
+
+
+@dataclass
+class _Stats:
+    total: int = 0
+    routed: Dict[str, int] = field(default_factory=dict)
+    by_source: Dict[str, int] = field(default_factory=dict)
+    fallback: int = 0
+
+
+_stats = _Stats()
+_stats_lock = threading.Lock()
+
+
+def _clean_topic(raw: str) -> str:
+    topic = re.split(r"[?.!\n]", raw, maxsplit=1)[0]
+    return topic.strip(" \t\"'«»:,;").strip()
+
+
+def _by_rules(query: str) -> Optional[Route]:
+    matches = [(intent, m) for intent, rx in _RULES.items() if (m := rx.search(query))]
+    exam = [(intent, m) for intent, m in matches if intent == "exam"]
+    if exam:                # "quiz sulla sintesi clorofilliana": l'esame ha la precedenza
+        matches = exam
+    if len(matches) != 1:  # nessuna o più intenzioni: ambiguo
+        return None
+    intent, m = matches[0]
+    topic = _clean_topic(m.group("topic"))
+    if not topic or len(topic.split()) > _MAX_TOPIC_WORDS or _DEICTIC_RE.match(topic):
+        return None
+    route_ = Route(intent=intent, topic=topic, source="rule", confidence=1.0)
+    if intent == "exam":
+        if m.group("n"):
+            route_.n = int(m.group("n"))
+            if not 1 <= route_.n <= _EXAM_MAX_N:
+                return None
+        route_.subject, route_.topic = _exam_subject(topic)
+        if not route_.topic or _DEICTIC_RE.match(route_.topic):
+            return None
+    return route_
+
+
+_SUBJECT_TOPIC_RE = re.compile(rf"^(\w+)\s+{_EXAM_PREP_SEP}(.+)$", re.I)
+
+def _exam_subject(topic: str) -> Tuple[Optional[str], str]:
+    """"storia su Napoleone" → ("storia", "Napoleone"); "latino" → ("latino", "latino")."""
+    m = _SUBJECT_TOPIC_RE.match(topic)
+    if m and m.group(1).lower() in _SUBJECTS:
+        return m.group(1).lower(), _clean_topic(m.group(2))
+    if topic.lower() in _SUBJECTS:
+        return topic.lower(), topic
+    return None, topic
+
+
+_desc_vectors: Optional[List[List[float]]] = None
+
+def _by_embeddings(query: str) -> Optional[Route]:
+    global _desc_vectors
+    try:
+        if _desc_vectors is None:
+            _desc_vectors = embed_texts(list(_INTENT_DESCRIPTIONS.values()))
+        qv = embed_texts([query])[0]
+    except Exception:
+        return None
+    scored = sorted(
+        ((cosine(qv, dv), intent) for intent, dv in zip(_INTENT_DESCRIPTIONS, _desc_vectors)),
+        reverse=True,
+    )
+    (best, intent), (second, _) = scored[0], scored[1]
+    if best < _EMB_THRESHOLD or best - second < _EMB_MARGIN:
+        return None
+    topic = _clean_topic(_LEAD_RE.sub("", query, count=1))
+    if not topic or len(topic.split()) > _MAX_TOPIC_WORDS or _DEICTIC_RE.match(topic):
+        return None
+    return Route(intent=intent, topic=topic, source="embedding", confidence=round(best, 3))
+
+
+def route(query: str) -> Optional[Route]:
+    """Ritorna la Route se la richiesta è riconosciuta con confidenza, altrimenti None (→ agente)."""
+    route_ = None
+    if not _COMPOSITE_RE.search(query):
+        route_ = _by_rules(query)
+        if route_ is None and _EMB_ENABLED:
+            route_ = _by_embeddings(query)
+
+    with _stats_lock:
+        _stats.total += 1
+        if route_ is None:
+            _stats.fallback += 1
+        else:
+            _stats.routed[route_.intent] = _stats.routed.get(route_.intent, 0) + 1
+            _stats.by_source[route_.source] = _stats.by_source.get(route_.source, 0) + 1
+    return route_
+
+
+def router_stats() -> Dict[str, object]:
+    with _stats_lock:
+        hits = _stats.total - _stats.fallback
+        return {
+            "total": _stats.total,
+            "routed": hits,
+            "fallback_to_agent": _stats.fallback,
+            "hit_rate": round(hits / _stats.total, 3) if _stats.total else 0.0,
+            "by_intent": dict(_stats.routed),
+            "by_source": dict(_stats.by_source),
+        }
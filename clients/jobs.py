@@ -0,0 +1,289 @@
+# clients/jobs.py
+"""
+Job in background per le generazioni lunghe (slide, piani, riassunti con file, esami di latino).
+
+- submit() → job_id; il client fa polling (get) o si iscrive agli aggiornamenti (wait_for_update).
+- Pool di worker limitato (JOB_WORKERS) con coda a priorità (numero basso = prima).
+- A fine job il risultato è salvato come riga `events` (history_store.save_event):
+  JSON in `data`, eventuale file (PPTX) in `file_path`, così si può riscaricare senza rigenerare.
+"""
+from __future__ import annotations
+import itertools, json, logging, os, queue, threading, time, uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from clients.history_store import save_event
+from clients.llm_gateway import llm_priority
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", 200))
+JOB_TTL_S = int(os.getenv("JOB_TTL_S", 3600))        # quanto restano in memoria i job finiti
+JOBS_DIR = os.getenv("JOBS_DIR", "job_artifacts")
+
+# priorità di default per tipo (il client può passarne una esplicita)
+DEFAULT_PRIORITY = {"exam": 1, "plan": 1, "summarize": 2, "slides": 3}
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: Dict[str, Any]
+    priority: int
+    client_id: Optional[str] = None
+    status: str = "queued"            # queued | running | done | failed
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    file_path: Optional[str] = None
+    event_id: Optional[int] = None
+    error: Optional[str] = None
+    version: int = 0                  # incrementato a ogni cambio di stato (per i subscriber)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "has_file": self.file_path is not None,
+            "event_id": self.event_id,
+            "error": self.error,
+        }
+
+
+# ───────────────────────── handler per tipo ─────────────────────────
+# Ogni handler ritorna (titolo, dati JSON, bytes del file opzionale, estensione file).
+
+def _run_slides(p: Dict[str, Any]):
+    from clients.slide_tool import generate_slides_pptx
+    buf = generate_slides_pptx(p["subject"], p["topic"], int(p.get("n_slides", 10)), images=bool(p.get("images")))
+    return f"Slide {p['subject']} – {p['topic']}", {"subject": p["subject"], "topic": p["topic"]}, buf.getvalue(), ".pptx"
+
+def _run_plan(p: Dict[str, Any]):
+    from clients.lesson_plan_tool import generate_custom_lesson_plan
+    plan = generate_custom_lesson_plan(
+        subject=p["subject"], topic=p["topic"], grade=p["grade"],
+        lesson_minutes=int(p["lesson_minutes"]), global_goals=p.get("global_goals", ""),
+    )
+    return f"Piano {plan.subject} – {plan.topic}", plan.model_dump(), None, None
+
+def _run_summarize(p: Dict[str, Any]):
+    from clients.summarize_tool import summarize_topic_and_optional_file
+    try:
+        payload = summarize_topic_and_optional_file(
+            topic=p.get("topic", ""), length=p.get("length", "medium"),
+            plain_text=p.get("text"), file_path=p.get("upload_path"),
+        )
+    finally:
+        if p.get("upload_path"):
+            try:
+                os.unlink(p["upload_path"])
+            except OSError:
+                pass
+    return f"Riassunto {payload.topic}", payload.model_dump(), None, None
+
+def _run_exam(p: Dict[str, Any]):
+    from clients.exam_tool import generate_exam
+    exam = generate_exam(p["topic"], int(p.get("n", 5)), p.get("level", "medium"), subject=p.get("subject"))
+    return exam.title, exam.model_dump(), None, None
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], tuple]] = {
+    "slides": _run_slides,
+    "plan": _run_plan,
+    "summarize": _run_summarize,
+    "exam": _run_exam,
+}
+
+
+# ───────────────────────── parametri (condivisi da app.py e asgi.py) ─────────────────────────
+
+def job_params(kind: str, src) -> dict:
+    """Parametri del job con gli stessi default degli endpoint sincroni."""
+    if kind == "slides":
+        return {
+            "subject": (src.get("subject") or "Materia").strip(),
+            "topic": (src.get("topic") or "Argomento").strip(),
+            "n_slides": int(src.get("n_slides", 10)),
+            "images": bool(src.get("images", False)),
+        }
+    if kind == "plan":
+        return {
+            "subject": src.get("subject", "Storia"),
+            "topic": src.get("topic", "Argomento"),
+            "grade": src.get("grade", "Scuola Elementare"),
+            "lesson_minutes": int(src.get("lesson_minutes", 45)),
+            "global_goals": src.get("global_goals", ""),
+        }
+    if kind == "summarize":
+        return {
+            "topic": (src.get("topic") or "").strip(),
+            "length": (src.get("length") or "medium").strip().lower(),
+            "text": (src.get("text") or "").strip() or None,
+        }
+    if kind == "exam":
+        subject = src.get("subject", "Storia")
+        return {
+            "subject": subject,
+            "topic": src.get("topic", subject),
+            "n": int(src.get("n", 5)),
+            "level": src.get("level", "medium"),
+        }
+    raise ValueError(f"Tipo di job sconosciuto: {kind}")
+
+def job_file_name(kind: str, data: dict, file_path: str) -> str:
+    """Nome di download del file prodotto da un job (o salvato in un evento)."""
+    ext = os.path.splitext(file_path)[1]
+    if kind == "slides":
+        return f"slides_{data.get('subject', '')}_{data.get('topic', '')}{ext}".replace(" ", "_")
+    return os.path.basename(file_path)
+
+def parse_priority(value: Any) -> Optional[int]:
+    """Priorità del client: None se assente, altrimenti intero limitato a 0–9."""
+    if value in (None, ""):
+        return None
+    return min(9, max(0, int(value)))
+
+
+# ───────────────────────── manager ─────────────────────────
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_MAX):
+        self._queue: "queue.PriorityQueue[tuple]" = queue.PriorityQueue(maxsize=max_queue)
+        self._jobs: Dict[str, Job] = {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()  # FIFO a parità di priorità
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._workers:
+            t.start()
+
+    # ----- API -----
+
+    def submit(self, kind: str, params: Dict[str, Any], client_id: Optional[str] = None,
+               priority: Optional[int] = None) -> Job:
+        if kind not in HANDLERS:
+            raise ValueError(f"Tipo di job sconosciuto: {kind}")
+        job = Job(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            params=params,
+            priority=DEFAULT_PRIORITY.get(kind, 5) if priority is None else min(9, max(0, int(priority))),
+            client_id=client_id,
+        )
+        self._purge()
+        with self._cond:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait((job.priority, next(self._seq), job.id))
+        except queue.Full:
+            with self._cond:
+                del self._jobs[job.id]
+            raise QueueFull("Coda job piena, riprova più tardi.")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def wait_for_update(self, job_id: str, seen_version: int, timeout: float = 15.0) -> Optional[Job]:
+        """Blocca finché il job non cambia stato (o timeout). Usato per gli aggiornamenti SSE."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: (j := self._jobs.get(job_id)) is None or j.version != seen_version,
+                timeout=timeout,
+            )
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            by_status: Dict[str, int] = {}
+            for j in self._jobs.values():
+                by_status[j.status] = by_status.get(j.status, 0) + 1
+        return {"workers": len(self._workers), "queued": self._queue.qsize(), "by_status": by_status}
+
+    # ----- interni -----
+
+    def _update(self, job: Job, **changes) -> None:
+        with self._cond:
+            for k, v in changes.items():
+                setattr(job, k, v)
+            job.version += 1
+            self._cond.notify_all()
+
+    def _purge(self) -> None:
+        cutoff = time.time() - JOB_TTL_S
+        with self._cond:
+            for jid in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+                del self._jobs[jid]
+
+    def _worker(self) -> None:
+        while True:
+            _, _, job_id = self._queue.get()
+            job = self.get(job_id)
+            if job is None:
+                self._queue.task_done()
+                continue
+            self._update(job, status="running", started_at=time.time())
+            try:
+                # i job non hanno un utente in attesa sulla risposta: passano dopo la chat
+                with llm_priority("batch"):
+                    title, data, file_bytes, ext = HANDLERS[job.kind](job.params)
+                file_path = None
+                if file_bytes is not None:
+                    os.makedirs(JOBS_DIR, exist_ok=True)
+                    file_path = os.path.join(JOBS_DIR, f"{job.id}{ext or ''}")
+                    with open(file_path, "wb") as fh:
+                        fh.write(file_bytes)
+                event_id = None
+                try:
+                    event_id = save_event(job.kind, title, data=data, file_path=file_path,
+                                          client_id=job.client_id)["id"]
+                except Exception:
+                    logging.warning("Job %s: salvataggio evento fallito", job.id, exc_info=True)
+                self._update(job, status="done", finished_at=time.time(), result=data,
+                             file_path=file_path, event_id=event_id)
+            except Exception as e:
+                logging.exception("Job %s (%s) failed", job.id, job.kind)
+                self._update(job, status="failed", finished_at=time.time(), error=str(e)[:500])
+            finally:
+                self._queue.task_done()
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+def get_job_manager() -> JobManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
+
+
+def sse_stream(job_id: str):
+    """Generatore di eventi SSE con lo stato del job finché non termina."""
+    mgr = get_job_manager()
+    version = -1
+    while True:
+        job = mgr.wait_for_update(job_id, version)
+        if job is None:
+            yield f"event: error\ndata: {json.dumps({'error': 'job non trovato'})}\n\n"
+            return
+        if job.version != version:
+            version = job.version
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.status in ("done", "failed"):
+                return
+        else:
+            yield ": keep-alive\n\n"
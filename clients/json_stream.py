@@ -0,0 +1,140 @@
+# clients/json_stream.py
+"""
+Parser JSON incrementale per l'output in streaming dei modelli.
+
+Riceve il testo a pezzi (feed) e, appena un valore in una posizione "osservata" è
+completo, lo restituisce già decodificato, mentre la generazione continua. Le posizioni
+sono percorsi semplici: "nodeDataArray[]" = ogni elemento dell'array nodeDataArray
+alla radice, "lessons[]" = ogni lezione, "subject" = il campo scalare in radice.
+
+Il testo prima della prima parentesi (```json, frasi di cortesia) e dopo la chiusura
+della radice viene ignorato. Un elemento che non si decodifica è saltato: la validazione
+completa a fine stream resta quella di clients.structured.
+"""
+from __future__ import annotations
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+_LITERAL_END = set(",}] \t\r\n")
+
+
+class _Frame:
+    __slots__ = ("kind", "path", "key", "expect_key")
+
+    def __init__(self, kind: str, path: str):
+        self.kind = kind                 # "obj" | "arr"
+        self.path = path
+        self.key: Optional[str] = None
+        self.expect_key = kind == "obj"
+
+
+class JsonStreamParser:
+    def __init__(self, paths: Iterable[str]):
+        self.paths = set(paths)
+        self.text = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._started = False
+        self._done = False
+        self._in_str = False
+        self._esc = False
+        self._str_start = 0
+        self._literal_start: Optional[int] = None        # numero / true / false / null in corso
+        self._literal_path: Optional[str] = None         # percorso se osservato
+        self._watch: Optional[Tuple[str, int, int]] = None      # (path, inizio, profondità)
+
+    def _child_path(self) -> str:
+        top = self._stack[-1]
+        if top.kind == "arr":
+            return f"{top.path}[]"
+        return f"{top.path}.{top.key}" if top.path else (top.key or "")
+
+    def _emit(self, path: str, start: int, end: int, out: List[Tuple[str, Any]]) -> None:
+        try:
+            out.append((path, json.loads(self.text[start:end])))
+        except ValueError:
+            pass
+
+    def _value_done(self) -> None:
+        if self._stack and self._stack[-1].kind == "obj":
+            self._stack[-1].expect_key = True
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Aggiunge testo e ritorna i valori osservati completati: [(percorso, valore), ...]."""
+        self.text += chunk
+        out: List[Tuple[str, Any]] = []
+        text = self.text
+        i = self._pos
+        n = len(text)
+        while i < n and not self._done:
+            ch = text[i]
+
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                    top = self._stack[-1]
+                    if top.kind == "obj" and top.expect_key:
+                        try:
+                            top.key = json.loads(text[self._str_start:i + 1])
+                        except ValueError:
+                            top.key = text[self._str_start + 1:i]
+                        top.expect_key = False
+                    else:
+                        path = self._child_path()
+                        if path in self.paths and self._watch is None:
+                            self._emit(path, self._str_start, i + 1, out)
+                        self._value_done()
+                i += 1
+                continue
+
+            if self._literal_start is not None:
+                if ch in _LITERAL_END:
+                    if self._literal_path is not None:
+                        self._emit(self._literal_path, self._literal_start, i, out)
+                    self._literal_start = self._literal_path = None
+                    self._value_done()
+                    continue                      # il delimitatore va ancora gestito
+                i += 1
+                continue
+
+            if not self._started:
+                if ch in "{[":
+                    self._started = True
+                    self._stack.append(_Frame("obj" if ch == "{" else "arr", ""))
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_str = True
+                self._str_start = i
+            elif ch in "{[":
+                path = self._child_path()
+                if path in self.paths and self._watch is None:
+                    self._watch = (path, i, len(self._stack))
+                self._stack.append(_Frame("obj" if ch == "{" else "arr", path))
+            elif ch in "}]":
+                self._stack.pop()
+                if self._watch is not None and len(self._stack) == self._watch[2]:
+                    path, start, _ = self._watch
+                    self._watch = None
+                    self._emit(path, start, i + 1, out)
+                if not self._stack:
+                    self._done = True
+                else:
+                    self._value_done()
+            elif ch in "-0123456789tfn":
+                path = self._child_path()
+                self._literal_start = i
+                self._literal_path = path if path in self.paths and self._watch is None else None
+            i += 1
+        self._pos = i
+        return out
+
+    @property
+    def done(self) -> bool:
+        """True quando la radice JSON è stata chiusa."""
+        return self._done
@@ -6,14 +6,21 @@ Schema ridotto per riflettere il mock-up: ogni lezione ha solo
 lesson_number, title, objectives, activities, materials, assessment.
 """
 
-import json, re, ast, logging
-from typing import List, Optional
+from io import BytesIO
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple
 
 from pydantic import BaseModel
-from langchain_openai import ChatOpenAI
 from langchain.tools import StructuredTool
 
-from clients.query_rag_tool import query_rag
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Table
+from reportlab.lib import colors
+
+from clients.artifact_cache import Artifact, artifacts
+from clients.query_rag_tool import query_rag, aquery_rag
+from clients.llm_gateway import chat_model
+from clients.structured import agenerate_structured, astream_structured, generate_structured, stream_structured
+from clients.telemetry import span
 
 # ──────────────────────────── Pydantic ─────────────────────────────
 class Lesson(BaseModel):
@@ -33,7 +40,7 @@ class LessonPlan(BaseModel):
     lessons: List[Lesson]
 
 # ─────────────────────────── LLM & prompt ──────────────────────────
-llm = ChatOpenAI(model="gpt-4o", temperature=0.2)
+llm = chat_model("gpt-4o", temperature=0.2)
 
 _SYSTEM = """
 Sei un docente di {grade} italiano.
@@ -65,52 +72,118 @@ Schema da seguire (NON modificare i nomi campi):
 }}
 """
 
-# ─────────────────── helper estrazione JSON ───────────────────────
-
-def _extract_json(raw: str) -> dict:
-    text = re.sub(r"```[a-zA-Z0-9]*|```", "", raw).strip()
-    m = re.search(r"\{.*\}", text, re.S)
-    if m:
-        text = m.group(0)
-    try:
-        return json.loads(text)
-    except Exception:
-        try:
-            return ast.literal_eval(text)
-        except Exception as e:
-            logging.error("JSON parse failed. Raw output:\n%s", raw)
-            raise ValueError("Impossibile estrarre JSON dal modello") from e
-
 # ───────────────────────── core generator ─────────────────────────
 
-def generate_custom_lesson_plan(
-    subject: str,
-    topic: str,
-    grade: str,
-    lesson_minutes: int,
-    global_goals: str = "",
-):
-    rag = query_rag(topic, top_k=10)
-    raw = llm.invoke([
+def _build_messages(subject: str, topic: str, grade: str, lesson_minutes: int,
+                    global_goals: str, rag: str) -> list:
+    return [
         {"role": "system", "content": _SYSTEM.format(
             grade=grade, lesson_minutes=lesson_minutes, subject=subject, topic=topic
         )},
         {"role": "user", "content": f"OBIETTIVI GLOBALI: {global_goals}\nCONTESTO:\n{rag}"}
-    ]).content
-
-    plan_dict = _extract_json(raw)
+    ]
 
+def _prepare_plan(plan_dict: dict, subject: str, topic: str, grade: str, lesson_minutes: int) -> dict:
     # assicurati dei campi base
     plan_dict.setdefault("subject", subject)
     plan_dict.setdefault("topic", topic)
     plan_dict.setdefault("grade", grade)
     plan_dict.setdefault("lesson_minutes", lesson_minutes)
+    return plan_dict
 
-    return LessonPlan(**plan_dict)
+def generate_custom_lesson_plan(
+    subject: str,
+    topic: str,
+    grade: str,
+    lesson_minutes: int,
+    global_goals: str = "",
+):
+    rag = query_rag(topic, top_k=10)
+    return generate_structured(
+        llm, _build_messages(subject, topic, grade, lesson_minutes, global_goals, rag), LessonPlan,
+        name="lesson_plan", prepare=lambda d: _prepare_plan(d, subject, topic, grade, lesson_minutes),
+    )
+
+async def agenerate_custom_lesson_plan(
+    subject: str,
+    topic: str,
+    grade: str,
+    lesson_minutes: int,
+    global_goals: str = "",
+):
+    """Versione async (modalità ASGI)."""
+    rag = await aquery_rag(topic, top_k=10)
+    return await agenerate_structured(
+        llm, _build_messages(subject, topic, grade, lesson_minutes, global_goals, rag), LessonPlan,
+        name="lesson_plan", prepare=lambda d: _prepare_plan(d, subject, topic, grade, lesson_minutes),
+    )
+
+def stream_custom_lesson_plan(
+    subject: str,
+    topic: str,
+    grade: str,
+    lesson_minutes: int,
+    global_goals: str = "",
+) -> Iterator[Tuple[str, Any]]:
+    """Eventi ("lesson", Lesson) durante la generazione, poi ("done", LessonPlan)."""
+    rag = query_rag(topic, top_k=10)
+    for path, obj in stream_structured(
+        llm, _build_messages(subject, topic, grade, lesson_minutes, global_goals, rag), LessonPlan,
+        name="lesson_plan", items={"lessons[]": Lesson},
+        prepare=lambda d: _prepare_plan(d, subject, topic, grade, lesson_minutes),
+    ):
+        yield ("lesson" if path else "done"), obj
+
+async def astream_custom_lesson_plan(
+    subject: str,
+    topic: str,
+    grade: str,
+    lesson_minutes: int,
+    global_goals: str = "",
+) -> AsyncIterator[Tuple[str, Any]]:
+    rag = await aquery_rag(topic, top_k=10)
+    async for path, obj in astream_structured(
+        llm, _build_messages(subject, topic, grade, lesson_minutes, global_goals, rag), LessonPlan,
+        name="lesson_plan", items={"lessons[]": Lesson},
+        prepare=lambda d: _prepare_plan(d, subject, topic, grade, lesson_minutes),
+    ):
+        yield ("lesson" if path else "done"), obj
+
+# ───────────────────────── export PDF ─────────────────────────
+
+@span("render", "plan_pdf")
+def render_plan_pdf(plan: LessonPlan) -> BytesIO:
+    """Tabella reportlab con una riga per lezione."""
+    rows = [["#", "Titolo", "Obiettivi", "Attività", "Materiali"]]
+    for i, l in enumerate(plan.lessons, start=1):
+        rows.append([
+            str(i),
+            l.title,
+            "\n".join(l.objectives),
+            "\n".join(l.activities),
+            "\n".join(l.materials or []),
+        ])
+
+    buf = BytesIO()
+    pdf = SimpleDocTemplate(buf, pagesize=A4)
+    tbl = Table(rows, repeatRows=1)
+    tbl.setStyle([
+        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E0E0E0")),
+        ("GRID", (0,0), (-1,-1), 0.25, colors.grey),
+        ("VALIGN", (0,0), (-1,-1), "TOP"),
+    ])
+    pdf.build([tbl])
+    buf.seek(0)
+    return buf
+
+def plan_pdf_artifact(plan: LessonPlan, digest: Optional[str] = None) -> Artifact:
+    """PDF del piano dalla cache degli artefatti: il rendering avviene solo al primo uso."""
+    return artifacts.get_or_render("plan_pdf", plan, lambda: render_plan_pdf(plan).getvalue(), digest)
 
 # ─────────────────────── LangChain tool ──────────────────────────
 lesson_plan_tool = StructuredTool.from_function(
     func=generate_custom_lesson_plan,
+    coroutine=agenerate_custom_lesson_plan,
     name="Generate_LessonPlan",
     description="Genera un piano lezioni (JSON) senza date/start/end.",
     return_direct=True,
@@ -0,0 +1,493 @@
+# clients/llm_gateway.py
+"""
+Gateway unico per le chiamate LLM in uscita.
+
+Tutti i moduli creano i modelli con chat_model(...): ottengono un ChatModel LangChain
+che inoltra al ChatOpenAI reale passando per il gateway di processo, che applica:
+- limite di concorrenza globale (LLM_MAX_CONCURRENCY) con code per priorità:
+  interactive (chat) > default > batch (grading, riassunti memoria, job);
+- budget token/minuto (LLM_TPM) a secchiello, con stima prima della chiamata
+  e conguaglio sull'uso reale;
+- retry con backoff esponenziale e jitter su rate limit / timeout / errori 5xx
+  (rispettando Retry-After se presente);
+- metriche: attesa in coda per priorità, chiamate, retry, errori, token;
+- gli stream (agente, output strutturato) passano per le stesse regole: retry se
+  l'errore arriva prima del primo chunk, conguaglio token a fine stream.
+
+La priorità di una chiamata è quella del modello, salvo override con
+`with llm_priority("batch"): ...` (contextvar: vale nel thread/task corrente).
+"""
+from __future__ import annotations
+import asyncio, contextlib, contextvars, heapq, itertools, logging, os, random, threading, time
+from typing import Any, Callable, Dict, Iterator, AsyncIterator, List, Optional
+
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from prometheus_client import Gauge
+
+from clients.standin import STANDIN, FakeChatModel
+from clients.telemetry import observe, record_tokens, span
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+LLM_TPM = int(os.getenv("LLM_TPM", 300000))                 # 0 = nessun budget
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 20))
+LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", 800))
+
+PRIORITIES = {"interactive": 0, "default": 1, "batch": 2}
+_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, float("inf"))
+
+_priority_override: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_priority", default=None)
+
+@contextlib.contextmanager
+def llm_priority(name: str):
+    """Forza la classe di priorità delle chiamate LLM nel contesto corrente."""
+    token = _priority_override.set(name)
+    try:
+        yield
+    finally:
+        _priority_override.reset(token)
+
+
+# ───────────────────────── limitatore a priorità ─────────────────────────
+
+class _Waiter:
+    __slots__ = ("granted", "cancelled", "_event", "_loop", "_fut")
+
+    def __init__(self, loop=None, fut=None):
+        self.granted = False
+        self.cancelled = False
+        self._event = threading.Event() if fut is None else None
+        self._loop, self._fut = loop, fut
+
+    def grant(self) -> None:
+        self.granted = True
+        if self._event is not None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(lambda: self._fut.done() or self._fut.set_result(None))
+
+
+class _PriorityLimiter:
+    """Semaforo condiviso fra thread e task asyncio; i posti liberi vanno al waiter più prioritario."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _grant_next(self) -> None:  # chiamare con il lock
+        while self._heap and self.active < self.limit:
+            _, _, w = heapq.heappop(self._heap)
+            if w.cancelled:
+                continue
+            self.active += 1
+            w.grant()
+
+    def _enqueue(self, prio: int, waiter: _Waiter) -> bool:
+        """True se il posto è concesso subito."""
+        with self._lock:
+            if self.active < self.limit and not self._heap:
+                self.active += 1
+                return True
+            heapq.heappush(self._heap, (prio, next(self._seq), waiter))
+            return False
+
+    def acquire(self, prio: int) -> None:
+        w = _Waiter()
+        if not self._enqueue(prio, w):
+            w._event.wait()
+
+    async def aacquire(self, prio: int) -> None:
+        loop = asyncio.get_running_loop()
+        w = _Waiter(loop, loop.create_future())
+        if self._enqueue(prio, w):
+            return
+        try:
+            await w._fut
+        except asyncio.CancelledError:
+            with self._lock:
+                if w.granted:
+                    self.active -= 1
+                    self._grant_next()
+                else:
+                    w.cancelled = True
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self._grant_next()
+
+    def queued(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, w in self._heap if not w.cancelled)
+
+
+# ───────────────────────── budget token/minuto ─────────────────────────
+
+class _TokenBucket:
+    """Secchiello a prenotazione: il saldo può andare in negativo, il chiamante attende il rientro."""
+
+    def __init__(self, tpm: int):
+        self.capacity = float(tpm)
+        self.tokens = float(tpm)
+        self.rate = tpm / 60.0
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def reserve(self, n: int) -> float:
+        """Prenota n token; ritorna i secondi da attendere prima di procedere."""
+        with self._lock:
+            self._refill()
+            self.tokens -= min(n, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, delta: int) -> None:
+        """Conguaglio dopo la chiamata (delta > 0 = consumati più token del previsto)."""
+        with self._lock:
+            self._refill()
+            self.tokens -= delta
+
+
+# ───────────────────────── gateway ─────────────────────────
+
+_RETRYABLE = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+def _estimate_tokens(messages: List[BaseMessage]) -> int:
+    chars = sum(len(m.content) if isinstance(m.content, str) else len(str(m.content)) for m in messages)
+    return chars // 4 + LLM_COMPLETION_ESTIMATE
+
+def _usage(result: ChatResult) -> Dict[str, int]:
+    return (result.llm_output or {}).get("token_usage") or {}
+
+def _retry_after(err: Exception) -> Optional[float]:
+    resp = getattr(err, "response", None)
+    try:
+        return float(resp.headers.get("retry-after")) if resp is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _backoff(attempt: int, err: Exception) -> float:
+    hinted = _retry_after(err)
+    if hinted is not None:
+        return min(LLM_BACKOFF_MAX, hinted) + random.uniform(0, LLM_BACKOFF_BASE)
+    # full jitter
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+
+class _StreamUsage:
+    """Token di uno stream: usage_metadata dell'ultimo chunk se presente, altrimenti stima."""
+
+    def __init__(self, estimate: int):
+        self.prompt_estimate = max(0, estimate - LLM_COMPLETION_ESTIMATE)
+        self.started = False
+        self.chars = 0
+        self.reported: Optional[Dict[str, int]] = None
+
+    def add(self, chunk: ChatGenerationChunk) -> None:
+        self.started = True
+        self.chars += len(chunk.text or "")
+        um = getattr(chunk.message, "usage_metadata", None)
+        if um:
+            self.reported = {"prompt_tokens": um.get("input_tokens", 0),
+                             "completion_tokens": um.get("output_tokens", 0),
+                             "total_tokens": um.get("total_tokens", 0)}
+
+    def usage(self) -> Dict[str, int]:
+        if self.reported:
+            return self.reported
+        completion = self.chars // 4
+        return {"prompt_tokens": self.prompt_estimate, "completion_tokens": completion,
+                "total_tokens": self.prompt_estimate + completion}
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, tpm: int = LLM_TPM):
+        self.limiter = _PriorityLimiter(max_concurrency)
+        self.bucket = _TokenBucket(tpm) if tpm > 0 else None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    # ----- metriche -----
+
+    def _prio_stats(self, prio_name: str) -> Dict[str, Any]:
+        s = self._stats.get(prio_name)
+        if s is None:
+            s = self._stats[prio_name] = {
+                "calls": 0, "errors": 0, "retries": 0, "tokens": 0,
+                "wait_sum_s": 0.0, "wait_max_s": 0.0,
+                "wait_buckets": {b: 0 for b in _WAIT_BUCKETS},
+            }
+        return s
+
+    def _record_wait(self, prio_name: str, waited: float) -> None:
+        observe("llm_queue", prio_name, waited)
+        with self._lock:
+            s = self._prio_stats(prio_name)
+            s["calls"] += 1
+            s["wait_sum_s"] += waited
+            s["wait_max_s"] = max(s["wait_max_s"], waited)
+            for b in _WAIT_BUCKETS:
+                if waited <= b:
+                    s["wait_buckets"][b] += 1
+                    break
+
+    def _record(self, prio_name: str, **inc) -> None:
+        with self._lock:
+            s = self._prio_stats(prio_name)
+            for k, v in inc.items():
+                s[k] += v
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            per = {}
+            for name, s in self._stats.items():
+                per[name] = {
+                    **{k: v for k, v in s.items() if k not in ("wait_buckets", "wait_sum_s", "wait_max_s")},
+                    "wait_sum_s": round(s["wait_sum_s"], 4),
+                    "wait_max_s": round(s["wait_max_s"], 4),
+                    "wait_avg_s": round(s["wait_sum_s"] / s["calls"], 4) if s["calls"] else 0.0,
+                    "wait_buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in s["wait_buckets"].items()},
+                }
+        return {
+            "max_concurrency": self.limiter.limit,
+            "in_flight": self.limiter.active,
+            "queued": self.limiter.queued(),
+            "tpm_budget": int(self.bucket.capacity) if self.bucket else None,
+            "tpm_available": int(self.bucket.tokens) if self.bucket else None,
+            "by_priority": per,
+        }
+
+    # ----- chiamate -----
+    # Il budget token si attende PRIMA di prendere il posto nel limitatore: chi aspetta
+    # il rientro del secchiello non occupa uno slot che altre chiamate potrebbero usare.
+
+    def _reserve(self, estimate: int) -> float:
+        return self.bucket.reserve(estimate) if self.bucket else 0.0
+
+    def _refund(self, estimate: int) -> None:
+        """Tentativo fallito prima della risposta: la prenotazione torna nel secchiello."""
+        if self.bucket:
+            self.bucket.adjust(-estimate)
+
+    def _retry_or_raise(self, prio_name: str, attempt: int, err: Exception) -> float:
+        if attempt == LLM_MAX_RETRIES:
+            self._record(prio_name, errors=1)
+            raise err
+        self._record(prio_name, retries=1)
+        delay = _backoff(attempt, err)
+        logging.warning("[llm] %s, retry %d tra %.1fs", type(err).__name__, attempt + 1, delay)
+        return delay
+
+    def call(self, fn: Callable[[], ChatResult], messages: List[BaseMessage], prio_name: str,
+             model: str = "") -> ChatResult:
+        prio = PRIORITIES.get(prio_name, 1)
+        estimate = _estimate_tokens(messages)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            t0 = time.monotonic()
+            wait = self._reserve(estimate)
+            if wait:
+                time.sleep(wait)
+            self.limiter.acquire(prio)
+            try:
+                self._record_wait(prio_name, time.monotonic() - t0)
+                try:
+                    with span("llm", model):
+                        result = fn()
+                except _RETRYABLE as e:
+                    err = e
+                    self._refund(estimate)
+                else:
+                    self._settle(prio_name, estimate, _usage(result), model)
+                    return result
+            finally:
+                self.limiter.release()
+            time.sleep(self._retry_or_raise(prio_name, attempt, err))
+
+    async def acall(self, fn: Callable[[], Any], messages: List[BaseMessage], prio_name: str,
+                    model: str = "") -> ChatResult:
+        prio = PRIORITIES.get(prio_name, 1)
+        estimate = _estimate_tokens(messages)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            t0 = time.monotonic()
+            wait = self._reserve(estimate)
+            if wait:
+                await asyncio.sleep(wait)
+            await self.limiter.aacquire(prio)
+            try:
+                self._record_wait(prio_name, time.monotonic() - t0)
+                try:
+                    with span("llm", model):
+                        result = await fn()
+                except _RETRYABLE as e:
+                    err = e
+                    self._refund(estimate)
+                else:
+                    self._settle(prio_name, estimate, _usage(result), model)
+                    return result
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(self._retry_or_raise(prio_name, attempt, err))
+
+    def stream(self, open_stream: Callable[[], Iterator[ChatGenerationChunk]], messages: List[BaseMessage],
+               prio_name: str, model: str = "") -> Iterator[ChatGenerationChunk]:
+        """
+        Stream attraverso il gateway: stesso budget, posto nel limitatore per tutta la durata,
+        retry solo se l'errore arriva prima del primo chunk, conguaglio token a fine stream.
+        """
+        prio = PRIORITIES.get(prio_name, 1)
+        estimate = _estimate_tokens(messages)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            t0 = time.monotonic()
+            wait = self._reserve(estimate)
+            if wait:
+                time.sleep(wait)
+            self.limiter.acquire(prio)
+            acc = _StreamUsage(estimate)
+            try:
+                self._record_wait(prio_name, time.monotonic() - t0)
+                try:
+                    with span("llm", model):
+                        for chunk in open_stream():
+                            acc.add(chunk)
+                            yield chunk
+                except _RETRYABLE as e:
+                    if acc.started:
+                        self._record(prio_name, errors=1)
+                        self._settle(prio_name, estimate, acc.usage(), model)
+                        raise
+                    err = e
+                    self._refund(estimate)
+                else:
+                    self._settle(prio_name, estimate, acc.usage(), model)
+                    return
+            finally:
+                self.limiter.release()
+            time.sleep(self._retry_or_raise(prio_name, attempt, err))
+
+    async def astream(self, open_stream: Callable[[], AsyncIterator[ChatGenerationChunk]],
+                      messages: List[BaseMessage], prio_name: str,
+                      model: str = "") -> AsyncIterator[ChatGenerationChunk]:
+        prio = PRIORITIES.get(prio_name, 1)
+        estimate = _estimate_tokens(messages)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            t0 = time.monotonic()
+            wait = self._reserve(estimate)
+            if wait:
+                await asyncio.sleep(wait)
+            await self.limiter.aacquire(prio)
+            acc = _StreamUsage(estimate)
+            try:
+                self._record_wait(prio_name, time.monotonic() - t0)
+                try:
+                    with span("llm", model):
+                        async for chunk in open_stream():
+                            acc.add(chunk)
+                            yield chunk
+                except _RETRYABLE as e:
+                    if acc.started:
+                        self._record(prio_name, errors=1)
+                        self._settle(prio_name, estimate, acc.usage(), model)
+                        raise
+                    err = e
+                    self._refund(estimate)
+                else:
+                    self._settle(prio_name, estimate, acc.usage(), model)
+                    return
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(self._retry_or_raise(prio_name, attempt, err))
+
+    def _settle(self, prio_name: str, estimate: int, usage: Dict[str, int], model: str) -> None:
+        used = usage.get("total_tokens")
+        if used is None:
+            return
+        if self.bucket:
+            self.bucket.adjust(used - estimate)
+        self._record(prio_name, tokens=used)
+        record_tokens(model, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+
+gateway = LLMGateway()
+
+Gauge("llm_mcp_llm_inflight", "Chiamate LLM in volo nel gateway").set_function(lambda: gateway.limiter.active)
+Gauge("llm_mcp_llm_queued", "Chiamate LLM in coda nel gateway").set_function(gateway.limiter.queued)
+
+def gateway_stats() -> Dict[str, Any]:
+    return gateway.stats()
+
+
+# ───────────────────────── ChatModel LangChain ─────────────────────────
+
+class GatedChatModel(BaseChatModel):
+    """ChatModel che inoltra a `inner` passando per il gateway di processo."""
+
+    inner: BaseChatModel
+    priority: str = "default"
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gated-{self.inner._llm_type}"
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.inner, "model_name", "") or ""
+
+    def _prio(self) -> str:
+        return _priority_override.get() or self.priority
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        return gateway.call(
+            lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            messages, self._prio(), self.model_name,
+        )
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        return await gateway.acall(
+            lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            messages, self._prio(), self.model_name,
+        )
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        yield from gateway.stream(
+            lambda: self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            messages, self._prio(), self.model_name,
+        )
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in gateway.astream(
+            lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            messages, self._prio(), self.model_name,
+        ):
+            yield chunk
+
+
+def chat_model(model: str = "gpt-4o", temperature: float = 0.3, priority: str = "default", **kwargs: Any) -> BaseChatModel:
+    """
+    Unico punto di creazione dei modelli chat. I retry sono del gateway,
+    quindi il client OpenAI sottostante non ritenta da solo.
+    Con LLM_STANDIN=1 il modello sottostante è il sostituto locale (clients.standin).
+    """
+    if STANDIN:
+        inner = FakeChatModel(model_name=model)
+    else:
+        # stream_usage: l'ultimo chunk di uno stream riporta i token, per il conguaglio del gateway
+        kwargs.setdefault("stream_usage", True)
+        inner = ChatOpenAI(model=model, temperature=temperature, max_retries=0, **kwargs)
+    return GatedChatModel(inner=inner, priority=priority)
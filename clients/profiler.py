@@ -0,0 +1,188 @@
+# clients/profiler.py
+"""
+Profilazione statistica su richiesta, per singola richiesta HTTP.
+
+Si attiva solo se:
+- la richiesta porta `X-Profile: 1` e `X-Profile-Token` uguale a PROFILING_TOKEN, oppure
+- l'admin ha acceso il campionamento (POST /profiling {"sample_rate": 0.05, "endpoints": [...]}).
+
+Durante la richiesta un thread campiona ogni PROFILE_INTERVAL_MS lo stack del thread
+che la serve (sys._current_frames) e conta gli stack identici. Il profilo finisce quando
+il corpo della risposta è stato inviato (anche per le risposte in streaming/SSE), è
+salvato in PROFILES_DIR in formato "collapsed stack" (`a;b;c 42`), leggibile da
+flamegraph.pl, speedscope o inferno; l'id torna nell'header X-Profile-Id.
+
+Disattivato (default) costa un confronto per richiesta: nessun thread, nessun hook.
+In modalità ASGI il thread campionato è quello dell'event loop, condiviso con le altre
+richieste in volo: il profilo va letto come "cosa faceva il loop" durante la richiesta.
+Il lavoro spostato in thread con asyncio.to_thread / run_in_executor(None, …) è campionato
+anche lui: il profilo attivo viaggia in una contextvar e ProfilingExecutor (executor di
+default del loop) aggiunge il thread worker al profilo per la durata del compito.
+"""
+from __future__ import annotations
+import collections, contextvars, hmac, os, random, sys, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_MAX_S = float(os.getenv("PROFILE_MAX_S", 120))       # oltre, il campionamento si ferma
+PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50))
+
+_CWD = os.getcwd()
+_lock = threading.Lock()
+_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+_endpoints: Optional[set] = None
+_index: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+_current: "contextvars.ContextVar[Optional[Profile]]" = contextvars.ContextVar("profile", default=None)
+
+
+# ───────────────────────── configurazione ─────────────────────────
+
+def authorized(token: Optional[str]) -> bool:
+    return bool(PROFILING_TOKEN) and hmac.compare_digest(token or "", PROFILING_TOKEN)
+
+def configure(sample_rate: float, endpoints: Optional[List[str]] = None) -> Dict[str, Any]:
+    global _sample_rate, _endpoints
+    with _lock:
+        _sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        _endpoints = set(endpoints) if endpoints else None
+    return settings()
+
+def settings() -> Dict[str, Any]:
+    return {
+        "sample_rate": _sample_rate,
+        "endpoints": sorted(_endpoints) if _endpoints else None,
+        "interval_ms": PROFILE_INTERVAL_MS,
+        "header_enabled": bool(PROFILING_TOKEN),
+    }
+
+def should_profile(endpoint: str, header: Optional[str], token: Optional[str]) -> bool:
+    if header is None and not _sample_rate:
+        return False
+    if header is not None:
+        return header == "1" and authorized(token)
+    if _endpoints is not None and endpoint not in _endpoints:
+        return False
+    return random.random() < _sample_rate
+
+
+# ───────────────────────── campionatore ─────────────────────────
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    short = os.path.relpath(path, _CWD) if path.startswith(_CWD) else os.path.basename(path)
+    return f"{code.co_name} ({short}:{code.co_firstlineno})".replace(";", ":")
+
+class Profile:
+    def __init__(self, endpoint: str, thread_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.thread_id = thread_id or threading.get_ident()
+        self._threads = {self.thread_id}     # + worker attaccati con attach()
+        self.counts: "collections.Counter[str]" = collections.Counter()
+        self.samples = 0
+        self.started = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+        self._thread.start()
+
+    def attach(self) -> None:
+        """Campiona anche il thread corrente (worker che esegue lavoro della richiesta)."""
+        with _lock:
+            self._threads.add(threading.get_ident())
+
+    def detach(self) -> None:
+        tid = threading.get_ident()
+        if tid != self.thread_id:
+            with _lock:
+                self._threads.discard(tid)
+
+    def _run(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000
+        deadline = time.monotonic() + PROFILE_MAX_S
+        while not self._stop.wait(interval) and time.monotonic() < deadline:
+            with _lock:
+                threads = list(self._threads)
+            frames = sys._current_frames()
+            for tid in threads:
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def finish(self) -> str:
+        """Ferma il campionamento, salva il profilo e ritorna l'id."""
+        self._stop.set()
+        self._thread.join()
+        duration = time.time() - self.started
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        path = os.path.join(PROFILES_DIR, f"{self.id}.folded")
+        with open(path, "w", encoding="utf-8") as fh:
+            for stack, n in self.counts.most_common():
+                fh.write(f"{stack} {n}\n")
+        meta = {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "started_at": self.started,
+            "duration_ms": round(duration * 1000, 1),
+            "samples": self.samples,
+        }
+        with _lock:
+            _index[self.id] = meta
+            while len(_index) > PROFILE_KEEP:
+                old, _ = _index.popitem(last=False)
+                try:
+                    os.unlink(os.path.join(PROFILES_DIR, f"{old}.folded"))
+                except OSError:
+                    pass
+        return self.id
+
+
+def start(endpoint: str) -> Profile:
+    return Profile(endpoint)
+
+def activate(prof: Profile) -> contextvars.Token:
+    """Rende `prof` il profilo del contesto corrente (lo ereditano i task e to_thread)."""
+    return _current.set(prof)
+
+def deactivate(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+class ProfilingExecutor(ThreadPoolExecutor):
+    """
+    Executor di default per il loop ASGI: se il compito è sottomesso da una richiesta
+    profilata, il thread worker viene campionato mentre lo esegue.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        prof = _current.get()
+        if prof is None:
+            return super().submit(fn, *args, **kwargs)
+
+        def _run():
+            prof.attach()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                prof.detach()
+        return super().submit(_run)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    with _lock:
+        return list(reversed(_index.values()))
+
+def profile_path(profile_id: str) -> Optional[str]:
+    with _lock:
+        if profile_id not in _index:
+            return None
+    return os.path.join(PROFILES_DIR, f"{profile_id}.folded")
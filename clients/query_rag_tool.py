@@ -1,19 +1,24 @@
 import os
+from typing import List, Tuple
+
 import psycopg2
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
 from langchain.tools import StructuredTool
 
+from clients.embeddings import get_embeddings
+from clients.telemetry import span
+
 load_dotenv()
 
-def query_rag(question: str, top_k: int = 3) -> str:
+def query_rag_chunks(question: str, top_k: int = 3) -> List[Tuple[str, int, str]]:
     """
-    Recupera i chunk di testo più rilevanti per una domanda, dal database PostgreSQL con pgvector.
+    Chunk più vicini alla domanda come tuple (source, page, chunk_text), dal database
+    PostgreSQL con pgvector. Le eccezioni (DB, embedding) arrivano al chiamante.
     """
-    try:
-        embeddings = OpenAIEmbeddings()
-        query_vector = embeddings.embed_query(question)
+    with span("embed", "query"):
+        query_vector = get_embeddings().embed_query(question)
 
+    with span("db", "rag_search"):
         conn = psycopg2.connect(
             host=os.getenv("DB_HOST"),
             port=os.getenv("DB_PORT"),
@@ -33,22 +38,57 @@ def query_rag(question: str, top_k: int = 3) -> str:
         results = cursor.fetchall()
         cursor.close()
         conn.close()
+    return results
 
-        if not results:
-            return "Nessun risultato rilevante trovato nei documenti."
+def query_rag(question: str, top_k: int = 3) -> str:
+    """
+    Recupera i chunk di testo più rilevanti per una domanda, dal database PostgreSQL con pgvector.
+    """
+    try:
+        return _format_results(query_rag_chunks(question, top_k))
+    except Exception as e:
+        return f"Errore nel retrieval dal database: {str(e)}"
 
-        formatted = "\n---\n".join(
-            f"[{source} - pagina {page}]\n{chunk}"
-            for source, page, chunk in results
-        )
+async def aquery_rag_chunks(question: str, top_k: int = 3) -> List[Tuple[str, int, str]]:
+    """Versione async di query_rag_chunks (modalità ASGI): embedding async + pool asyncpg."""
+    from clients.async_db import get_pool
 
-        return f"Contesto recuperato:\n{formatted}"
+    with span("embed", "query"):
+        query_vector = await get_embeddings().aembed_query(question)
+    with span("db", "rag_search"):
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            results = await conn.fetch("""
+                SELECT source, page, chunk_text
+                FROM documents
+                ORDER BY embedding <=> $1::vector
+                LIMIT $2
+            """, str(query_vector), top_k)
+    return [tuple(r) for r in results]
 
+async def aquery_rag(question: str, top_k: int = 3) -> str:
+    """
+    Versione async di query_rag (modalità ASGI): embedding async + pool asyncpg.
+    """
+    try:
+        return _format_results(await aquery_rag_chunks(question, top_k))
     except Exception as e:
         return f"Errore nel retrieval dal database: {str(e)}"
 
+def _format_results(results) -> str:
+    if not results:
+        return "Nessun risultato rilevante trovato nei documenti."
+
+    formatted = "\n---\n".join(
+        f"[{source} - pagina {page}]\n{chunk}"
+        for source, page, chunk in results
+    )
+
+    return f"Contesto recuperato:\n{formatted}"
+
 query_rag_tool = StructuredTool.from_function(
     func=query_rag,
+    coroutine=aquery_rag,
     name="RAG_Query",
     description="Recupera contenuto rilevante dal database (pgvector) in base a una domanda semantica. Usa top_k=3 di default."
 )
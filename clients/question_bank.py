@@ -0,0 +1,258 @@
+# clients/question_bank.py
+"""
+Banca domande pre-generate per (materia, argomento, livello).
+
+- Le domande validate sono salvate in Postgres (tabella question_bank);
+  per il Latino si salva l'intera versione (testo + traduzione + 5 domande).
+- sample_exam() compone un esame campionando dal pool: nessuna chiamata LLM, ma solo
+  quando il pool è almeno il doppio dell'esame (sotto, gli esami si ripeterebbero).
+- Un pool sotto soglia viene servito con esami generati al momento (che lo alimentano)
+  e fa partire un rabbocco in background al primo mancato prelievo (alzare
+  BANK_TOPUP_MIN_SAMPLES per aspettare più richieste), con al più
+  BANK_TOPUP_CONCURRENCY rabbocchi contemporanei, BANK_TOPUP_ROUNDS generazioni
+  ciascuno e BANK_MAX_POOLS pool in tutto.
+
+USO DA TERMINALE (pre-generazione):
+    python -m clients.question_bank --subject storia --topic "Impero romano" --level medium --target 40
+    python -m clients.question_bank --subject latino --topic "Cesare" --level medium --target 10
+"""
+from __future__ import annotations
+import logging, os, random, threading, uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import Json
+
+from clients.exam_tool import Exam, Question
+from clients.telemetry import span
+
+BANK_LOW_WATER = int(os.getenv("BANK_LOW_WATER", 20))      # domande (o versioni) minime per pool
+BANK_TARGET = int(os.getenv("BANK_TARGET", 40))            # livello di rabbocco
+BANK_LATIN_TARGET = int(os.getenv("BANK_LATIN_TARGET", 6))
+BANK_MAX_POOLS = int(os.getenv("BANK_MAX_POOLS", 200))    # pool distinti nella tabella
+BANK_TOPUP_MIN_SAMPLES = int(os.getenv("BANK_TOPUP_MIN_SAMPLES", 1))
+BANK_TOPUP_CONCURRENCY = int(os.getenv("BANK_TOPUP_CONCURRENCY", 2))
+BANK_TOPUP_ROUNDS = int(os.getenv("BANK_TOPUP_ROUNDS", 3))  # generazioni per rabbocco in background
+_GEN_BATCH = 10                                            # domande per chiamata di generazione
+
+def _conn():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+    )
+
+def ensure_bank_schema() -> None:
+    with _conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS question_bank (
+          id         BIGSERIAL PRIMARY KEY,
+          subject    TEXT NOT NULL,
+          topic      TEXT NOT NULL,
+          level      TEXT NOT NULL,
+          kind       TEXT NOT NULL,          -- 'question' | 'version'
+          text_key   TEXT NOT NULL,          -- testo normalizzato, per deduplica
+          data       JSONB NOT NULL,
+          created_at TIMESTAMP DEFAULT NOW(),
+          UNIQUE (subject, topic, level, kind, text_key)
+        );
+        CREATE INDEX IF NOT EXISTS question_bank_pool_idx
+          ON question_bank (subject, topic, level, kind);
+        """)
+        conn.commit()
+
+# ─────────────────────────── helper ───────────────────────────
+
+def _norm(s: Optional[str]) -> str:
+    return " ".join((s or "").lower().split())
+
+def _pool_key(subject: Optional[str], topic: str, level: str) -> Tuple[str, str, str]:
+    return _norm(subject), _norm(topic), _norm(level) or "medium"
+
+def _is_latin(subject: Optional[str]) -> bool:
+    return _norm(subject) == "latino"
+
+def _valid_question(q: Question) -> bool:
+    """Stessi vincoli del prompt: MCQ con UNA opzione corretta, aperte con ideal_answer."""
+    if not q.text.strip():
+        return False
+    if q.qtype == "mcq":
+        opts = q.options or []
+        return len(opts) >= 2 and sum(o.is_correct for o in opts) == 1
+    return bool((q.ideal_answer or "").strip())
+
+# ─────────────────────────── scrittura ───────────────────────────
+
+def _pool_allowed(cur, subj: str, top: str, lvl: str, kind: str) -> bool:
+    """Un pool esistente accetta sempre domande; uno nuovo solo sotto BANK_MAX_POOLS."""
+    cur.execute(
+        "SELECT 1 FROM question_bank WHERE subject=%s AND topic=%s AND level=%s AND kind=%s LIMIT 1",
+        (subj, top, lvl, kind),
+    )
+    if cur.fetchone():
+        return True
+    cur.execute("SELECT COUNT(*) FROM (SELECT DISTINCT subject, topic, level, kind FROM question_bank) AS p")
+    return cur.fetchone()[0] < BANK_MAX_POOLS
+
+def store_exam(exam: Exam, subject: Optional[str], topic: str, level: str) -> int:
+    """
+    Salva nel pool le domande valide di un esame (o l'intera versione per il Latino).
+    I duplicati (stesso testo normalizzato) sono ignorati. Ritorna il numero di righe inserite.
+    """
+    subj, top, lvl = _pool_key(subject, topic, level)
+    if _is_latin(subject):
+        if not (exam.version_latin and exam.solution_translation):
+            return 0
+        qs = [q for q in exam.questions if _valid_question(q)]
+        if not qs:
+            return 0
+        rows = [("version", _norm(exam.version_latin), exam.model_copy(update={"questions": qs}).model_dump())]
+    else:
+        rows = [("question", _norm(q.text), q.model_dump()) for q in exam.questions if _valid_question(q)]
+
+    inserted = 0
+    with span("db", "bank_store_exam"), _conn() as conn, conn.cursor() as cur:
+        if not _pool_allowed(cur, subj, top, lvl, rows[0][0] if rows else "question"):
+            return 0
+        for kind, text_key, data in rows:
+            cur.execute(
+                "INSERT INTO question_bank (subject, topic, level, kind, text_key, data) "
+                "VALUES (%s,%s,%s,%s,%s,%s) ON CONFLICT DO NOTHING",
+                (subj, top, lvl, kind, text_key, Json(data)),
+            )
+            inserted += cur.rowcount
+        conn.commit()
+    return inserted
+
+def pool_size(subject: Optional[str], topic: str, level: str) -> int:
+    subj, top, lvl = _pool_key(subject, topic, level)
+    kind = "version" if _is_latin(subject) else "question"
+    with span("db", "bank_pool_size"), _conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT COUNT(*) FROM question_bank WHERE subject=%s AND topic=%s AND level=%s AND kind=%s",
+            (subj, top, lvl, kind),
+        )
+        return cur.fetchone()[0]
+
+def fill_pool(subject: Optional[str], topic: str, level: str = "medium",
+              target: Optional[int] = None, max_rounds: int = 8) -> int:
+    """
+    Genera (LLM) finché il pool non raggiunge `target` elementi. Ritorna il totale nel pool.
+    """
+    from clients.exam_tool import _generate_exam_llm
+
+    target = target or (BANK_LATIN_TARGET if _is_latin(subject) else BANK_TARGET)
+    size = pool_size(subject, topic, level)
+    for _ in range(max_rounds):
+        if size >= target:
+            break
+        exam = _generate_exam_llm(topic, _GEN_BATCH, level, subject)
+        if store_exam(exam, subject, topic, level) == 0:
+            break  # il modello ripete solo duplicati: inutile insistere
+        size = pool_size(subject, topic, level)
+    return size
+
+# ─────────────────────── rabbocco in background ───────────────────────
+
+_topup_inflight: set = set()
+_topup_lock = threading.Lock()
+_samples: "OrderedDict[Tuple[str, str, str], int]" = OrderedDict()   # richieste per pool (LRU)
+_SAMPLES_MAX = 4 * BANK_MAX_POOLS
+
+def _count_sample(key: Tuple[str, str, str]) -> int:
+    with _topup_lock:
+        n = _samples.pop(key, 0) + 1
+        _samples[key] = n
+        while len(_samples) > _SAMPLES_MAX:
+            _samples.popitem(last=False)
+        return n
+
+def schedule_topup(subject: Optional[str], topic: str, level: str) -> bool:
+    """
+    Avvia fill_pool in un thread daemon (al massimo uno per pool e BANK_TOPUP_CONCURRENCY
+    in tutto, BANK_TOPUP_ROUNDS generazioni). True se avviato.
+    """
+    key = _pool_key(subject, topic, level)
+    with _topup_lock:
+        if key in _topup_inflight or len(_topup_inflight) >= BANK_TOPUP_CONCURRENCY:
+            return False
+        _topup_inflight.add(key)
+
+    def _run():
+        try:
+            fill_pool(subject, topic, level, max_rounds=BANK_TOPUP_ROUNDS)
+        except Exception:
+            logging.exception("Question bank top-up failed for %s", key)
+        finally:
+            with _topup_lock:
+                _topup_inflight.discard(key)
+
+    threading.Thread(target=_run, name=f"bank-topup-{key[1][:20]}", daemon=True).start()
+    return True
+
+# ─────────────────────────── lettura ───────────────────────────
+
+def sample_exam(subject: Optional[str], topic: str, level: str = "medium", n: int = 5) -> Optional[Exam]:
+    """
+    Compone un Exam campionando dal pool (nessuna chiamata LLM).
+    Campiona solo se il pool è ben più grande dell'esame (almeno il doppio delle domande,
+    BANK_LOW_WATER, o metà di BANK_LATIN_TARGET versioni): con un pool piccolo gli stessi
+    elementi tornerebbero a ogni richiesta. Altrimenti ritorna None (il chiamante genera
+    un esame nuovo e lo salva nel pool) e programma un rabbocco in background.
+    """
+    subj, top, lvl = _pool_key(subject, topic, level)
+    latin = _is_latin(subject)
+    kind = "version" if latin else "question"
+    want = 1 if latin else n
+    low_water = max(1, BANK_LATIN_TARGET // 2) if latin else max(BANK_LOW_WATER, 2 * n)
+
+    with span("db", "bank_sample_exam"), _conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT COUNT(*) FROM question_bank WHERE subject=%s AND topic=%s AND level=%s AND kind=%s",
+            (subj, top, lvl, kind),
+        )
+        size = cur.fetchone()[0]
+        rows: List[Dict] = []
+        if size >= low_water:
+            cur.execute(
+                "SELECT data FROM question_bank WHERE subject=%s AND topic=%s AND level=%s AND kind=%s "
+                "ORDER BY random() LIMIT %s",
+                (subj, top, lvl, kind, want),
+            )
+            rows = [r[0] for r in cur.fetchall()]
+
+    if size < low_water:
+        if _count_sample((subj, top, lvl)) >= BANK_TOPUP_MIN_SAMPLES:
+            schedule_topup(subject, topic, level)
+        return None
+    if len(rows) < want:
+        return None
+
+    if latin:
+        exam = Exam(**rows[0])
+        return exam.model_copy(update={"title": exam.title or f"Versione di latino: {topic}"})
+
+    questions = [Question(**r) for r in rows]
+    random.shuffle(questions)
+    for q in questions:
+        q.id = str(uuid.uuid4())  # id unici per esame (la stessa domanda può tornare in esami diversi)
+    return Exam(title=f"Esame: {topic}", questions=questions)
+
+
+# ---------- CLI entry-point ---------- #
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-genera domande nella banca (question_bank)")
+    parser.add_argument("--subject", "-s", default="", help="Materia (es. storia, latino)")
+    parser.add_argument("--topic", "-t", required=True, help="Argomento")
+    parser.add_argument("--level", "-l", default="medium", help="easy | medium | hard")
+    parser.add_argument("--target", "-n", type=int, default=None, help="Dimensione desiderata del pool")
+    args = parser.parse_args()
+
+    ensure_bank_schema()
+    total = fill_pool(args.subject, args.topic, args.level, target=args.target)
+    print(f"Pool ({args.subject or '-'}, {args.topic}, {args.level}): {total} elementi")
@@ -0,0 +1,142 @@
+# clients/singleflight.py
+"""
+Coalescenza "single-flight" delle generazioni identiche concorrenti.
+
+Quando molti studenti chiedono nello stesso momento la stessa mappa concettuale
+(o riassunto, piano, slide), solo la prima richiesta esegue RAG + LLM; le altre
+con la stessa chiave attendono quel calcolo e ne condividono il risultato
+(o l'eccezione). Finito il calcolo la chiave si libera: non è una cache.
+
+In modalità async il calcolo gira in un task separato che tutti (primo chiamante
+compreso) attendono con asyncio.shield: la cancellazione di una richiesta non tocca
+le altre, e il task viene cancellato solo quando non resta nessuno ad aspettarlo.
+"""
+from __future__ import annotations
+import asyncio, hashlib, json, threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def _norm(v: Any) -> Any:
+    if isinstance(v, str):
+        return " ".join(v.lower().split())
+    if isinstance(v, dict):
+        return {k: _norm(x) for k, x in sorted(v.items())}
+    if isinstance(v, (list, tuple)):
+        return [_norm(x) for x in v]
+    return v
+
+def make_key(name: str, **params: Any) -> str:
+    """Chiave sui parametri normalizzati (minuscolo, spazi compattati, ordine stabile)."""
+    blob = json.dumps(_norm(params), sort_keys=True, ensure_ascii=False, default=str)
+    return f"{name}:{hashlib.sha256(blob.encode()).hexdigest()[:32]}"
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _AsyncCall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._acalls: Dict[str, _AsyncCall] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Esegue fn una sola volta per tutte le chiamate concorrenti con la stessa key."""
+        with self._lock:
+            self._bump(key, "calls")
+            call = self._calls.get(key)
+            if call is not None:
+                self._bump(key, "coalesced")
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._bump(key, "executions")
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Variante async (modalità ASGI): tutti i chiamanti attendono lo stesso task."""
+        with self._lock:
+            self._bump(key, "calls")
+            call = self._acalls.get(key)
+            if call is None:
+                call = self._acalls[key] = _AsyncCall(asyncio.ensure_future(fn()))
+                call.task.add_done_callback(lambda t, k=key: self._adone(k, t))
+                self._bump(key, "executions")
+            else:
+                self._bump(key, "coalesced")
+            call.waiters += 1
+
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done():
+                with self._lock:
+                    call.waiters -= 1
+                    orphan = call.waiters == 0
+                    if orphan and self._acalls.get(key) is call:
+                        del self._acalls[key]   # chi arriva ora riparte da un task nuovo
+                if orphan:
+                    call.task.cancel()      # nessuno aspetta più il risultato
+            raise
+
+    def _adone(self, key: str, task: "asyncio.Task") -> None:
+        with self._lock:
+            if self._acalls.get(key) is not None and self._acalls[key].task is task:
+                del self._acalls[key]
+        if not task.cancelled():
+            task.exception()  # segna l'eccezione come letta anche se nessuno la riceve
+
+    def _bump(self, key: str, field: str) -> None:
+        name = key.split(":", 1)[0]
+        s = self._stats.setdefault(name, {"calls": 0, "executions": 0, "coalesced": 0})
+        s[field] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            per_name = {k: dict(v) for k, v in self._stats.items()}
+            inflight = len(self._calls) + len(self._acalls)
+        total_calls = sum(v["calls"] for v in per_name.values())
+        total_coalesced = sum(v["coalesced"] for v in per_name.values())
+        return {
+            "calls": total_calls,
+            "coalesced": total_coalesced,
+            "coalesced_ratio": round(total_coalesced / total_calls, 3) if total_calls else 0.0,
+            "inflight": inflight,
+            "by_function": per_name,
+        }
+
+
+# istanza di processo condivisa dagli endpoint
+flights = SingleFlight()
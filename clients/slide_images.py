@@ -0,0 +1,236 @@
+# clients/slide_images.py
+"""
+Immagini per le slide: una per slide, cercata su Brave Images con "argomento + titolo".
+
+Ricerche e download di tutte le slide partono insieme su un pool di thread condiviso,
+ognuno con il proprio timeout; il deck aspetta al massimo SLIDE_IMAGE_BUDGET_S in
+totale e le slide rimaste senza immagine restano solo testo. Le immagini scaricate sono
+ridotte a SLIDE_IMAGE_MAX_PX sul lato lungo (la risoluzione del riquadro nella slide),
+ricodificate e salvate su disco con chiave SHA-256 dell'URL: una seconda presentazione
+sullo stesso argomento non scarica più nulla. Oltre SLIDE_IMAGE_CACHE_MAX_MB si eliminano le
+immagini usate meno di recente (come clients.artifact_cache: a ogni hit si aggiorna l'mtime,
+così l'ordine sopravvive ai riavvii). Le ricerche usano la cache TTL di web_search_tool.
+"""
+from __future__ import annotations
+import collections, hashlib, io, logging, os, threading, time, uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence
+
+import requests
+from PIL import Image
+
+from clients.web_search_tool import brave_image_search
+
+SLIDE_IMAGE_CACHE_DIR = os.getenv("SLIDE_IMAGE_CACHE_DIR", "image_cache")
+SLIDE_IMAGE_CACHE_MAX_MB = float(os.getenv("SLIDE_IMAGE_CACHE_MAX_MB", 256))
+SLIDE_IMAGE_MAX_PX = int(os.getenv("SLIDE_IMAGE_MAX_PX", 800))           # lato lungo dopo il ridimensionamento
+SLIDE_IMAGE_TIMEOUT_S = float(os.getenv("SLIDE_IMAGE_TIMEOUT_S", 4))      # per ricerca / download
+SLIDE_IMAGE_BUDGET_S = float(os.getenv("SLIDE_IMAGE_BUDGET_S", 8))        # attesa massima per l'intero deck
+SLIDE_IMAGE_WORKERS = int(os.getenv("SLIDE_IMAGE_WORKERS", 8))
+SLIDE_IMAGE_MAX_DOWNLOAD_MB = float(os.getenv("SLIDE_IMAGE_MAX_DOWNLOAD_MB", 8))
+SLIDE_IMAGE_CANDIDATES = 3          # risultati provati per slide, nell'ordine di Brave
+
+_USER_AGENT = "Mozilla/5.0 (compatible; llm-MCP slide builder)"
+
+
+class SlideImages:
+    def __init__(self, root: str, workers: int, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="slide-img")
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._index: "collections.OrderedDict[str, int]" = collections.OrderedDict()   # LRU: nome file → byte
+        self._bytes = 0
+        self._loaded = False
+        self._hits = self._downloads = self._failures = self._timeouts = self._evictions = 0
+
+    # ── cache su disco ──
+    def _name(self, url: str) -> str:
+        return hashlib.sha256(f"{SLIDE_IMAGE_MAX_PX}:{url}".encode()).hexdigest()
+
+    def _load(self) -> None:
+        """Indicizza le immagini già presenti (ordine LRU dall'mtime). Da chiamare col lock."""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for name in os.listdir(self.root):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.root, name))
+            except OSError:
+                continue
+            found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self._index[name] = size
+            self._bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            name, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self._evictions += 1
+            try:
+                os.unlink(os.path.join(self.root, name))
+            except OSError:
+                pass
+
+    def _cached(self, url: str) -> Optional[bytes]:
+        name = self._name(url)
+        path = os.path.join(self.root, name)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except OSError:
+            return None
+        with self._lock:
+            self._load()
+            if name in self._index:
+                self._index.move_to_end(name)
+            self._hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _store(self, url: str, data: bytes) -> None:
+        name = self._name(url)
+        path = os.path.join(self.root, name)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        os.makedirs(self.root, exist_ok=True)
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._load()
+            self._bytes += len(data) - self._index.pop(name, 0)
+            self._index[name] = len(data)
+            self._evict()
+
+    # ── rete ──
+    def _search(self, query: str) -> List[str]:
+        results = brave_image_search(query, count=SLIDE_IMAGE_CANDIDATES, timeout=SLIDE_IMAGE_TIMEOUT_S)
+        return [u for r in results for u in (r.get("url"), r.get("thumbnail")) if u]
+
+    def _download(self, url: str) -> Optional[bytes]:
+        limit = int(SLIDE_IMAGE_MAX_DOWNLOAD_MB * 1024 * 1024)
+        deadline = time.monotonic() + SLIDE_IMAGE_TIMEOUT_S
+        with requests.get(url, stream=True, timeout=SLIDE_IMAGE_TIMEOUT_S,
+                          headers={"User-Agent": _USER_AGENT}) as r:
+            r.raise_for_status()
+            if not r.headers.get("Content-Type", "image/").startswith("image/"):
+                return None
+            buf = bytearray()
+            for chunk in r.iter_content(64 * 1024):
+                buf += chunk
+                if len(buf) > limit or time.monotonic() > deadline:
+                    return None
+        return _downscale(bytes(buf))
+
+    def _fetch(self, url: str) -> Optional[bytes]:
+        data = self._cached(url)
+        if data is not None:
+            return data
+        try:
+            data = self._download(url)
+        except Exception as e:
+            logging.debug("[slide_images] %s: %s", url[:120], e)
+            data = None
+        with self._lock:
+            if data is None:
+                self._failures += 1
+            else:
+                self._downloads += 1
+        if data is not None:
+            self._store(url, data)
+        return data
+
+    def _image_for(self, query: str) -> Optional[bytes]:
+        for url in self._search(query)[:SLIDE_IMAGE_CANDIDATES * 2]:
+            data = self._fetch(url)
+            if data is not None:
+                return data
+        return None
+
+    # ── API ──
+    def submit(self, query: str) -> Future:
+        """Avvia in background ricerca + download per una slide; richieste uguali condividono il future."""
+        with self._lock:
+            fut = self._inflight.get(query)
+            if fut is not None:
+                return fut
+            fut = self._pool.submit(self._image_for, query)
+            self._inflight[query] = fut
+        fut.add_done_callback(lambda _f, q=query: self._forget(q))     # fuori dal lock: può girare subito
+        return fut
+
+    def _forget(self, query: str) -> None:
+        with self._lock:
+            self._inflight.pop(query, None)
+
+    def collect(self, futures: Sequence[Future], budget: float = SLIDE_IMAGE_BUDGET_S) -> List[Optional[bytes]]:
+        """Risultati nell'ordine dato; dopo `budget` secondi le immagini mancanti diventano None."""
+        deadline = time.monotonic() + budget
+        pending = set(futures)
+        while pending:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            _, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+        if pending:
+            with self._lock:
+                self._timeouts += len(pending)
+        out: List[Optional[bytes]] = []
+        for f in futures:
+            try:
+                out.append(f.result() if f.done() else None)
+            except Exception:
+                out.append(None)
+        return out
+
+    def fetch(self, queries: Sequence[str], budget: float = SLIDE_IMAGE_BUDGET_S) -> List[Optional[bytes]]:
+        return self.collect([self.submit(q) for q in queries], budget)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cache_hits": self._hits,
+                "downloads": self._downloads,
+                "failures": self._failures,
+                "timeouts": self._timeouts,
+                "inflight": len(self._inflight),
+                "cache_entries": len(self._index),
+                "cache_bytes": self._bytes,
+                "evictions": self._evictions,
+            }
+
+
+def _downscale(data: bytes) -> Optional[bytes]:
+    """Riduce al lato lungo SLIDE_IMAGE_MAX_PX e ricodifica (JPEG, PNG se c'è trasparenza)."""
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.draft("RGB", (SLIDE_IMAGE_MAX_PX, SLIDE_IMAGE_MAX_PX))     # JPEG: decodifica già ridotta
+        img.load()
+    except Exception:
+        return None
+    img.thumbnail((SLIDE_IMAGE_MAX_PX, SLIDE_IMAGE_MAX_PX))
+    out = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img.convert("RGBA").save(out, "PNG", optimize=True)
+    else:
+        img.convert("RGB").save(out, "JPEG", quality=82, optimize=True)
+    return out.getvalue()
+
+def image_query(topic: str, title: str) -> str:
+    return f"{topic} {title}".strip()
+
+
+slide_images = SlideImages(SLIDE_IMAGE_CACHE_DIR, SLIDE_IMAGE_WORKERS, int(SLIDE_IMAGE_CACHE_MAX_MB * 1024 * 1024))
+
+def slide_image_stats() -> Dict[str, Any]:
+    return slide_images.stats()
@@ -1,11 +1,18 @@
 # clients/slide_tool.py
 from __future__ import annotations
-import io, json, re
-from typing import List
+import asyncio, hashlib, io
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
+from PIL import Image
 from pptx import Presentation
-from pptx.util import Pt
+from pptx.util import Inches, Pt
+
+from clients.artifact_cache import Artifact, artifacts, model_digest
+from clients.llm_gateway import chat_model
+from clients.slide_images import image_query, slide_images
+from clients.structured import agenerate_structured, astream_structured, generate_structured, stream_structured
+from clients.telemetry import span
 
 class Slide(BaseModel):
     title: str
@@ -16,10 +23,8 @@ class SlideDeck(BaseModel):
     topic: str
     slides: List[Slide]
 
-def _draft_slides(subject: str, topic: str, n_slides: int) -> SlideDeck:
-    """Chiede all'LLM un outline JSON con titoli + bullet."""
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-    prompt = f"""
+def _outline_prompt(subject: str, topic: str, n_slides: int) -> str:
+    return f"""
 Sei un docente delle scuole superiori italiane.
 Crea un piano di {n_slides} slide per la materia "{subject}" con argomento "{topic}".
 Rispondi SOLO con JSON nel formato:
@@ -28,13 +33,38 @@ Rispondi SOLO con JSON nel formato:
 - Linguaggio semplice e didattico
 - Niente markdown
 """
-    text = llm.invoke(prompt).content
-    m = re.search(r"\{[\s\S]*\}", text)
-    payload = json.loads(m.group(0) if m else text)
-    slides = [Slide(**s) for s in payload["slides"]][:max(1, n_slides)]
-    return SlideDeck(subject=subject, topic=topic, slides=slides)
 
-def _build_pptx(deck: SlideDeck) -> io.BytesIO:
+def _prepare_deck(payload: dict, subject: str, topic: str, n_slides: int) -> dict:
+    return {"subject": subject, "topic": topic, "slides": (payload.get("slides") or [])[:max(1, n_slides)]}
+
+def _slides_llm():
+    return chat_model("gpt-4o", temperature=0.3)
+
+def _draft_slides(subject: str, topic: str, n_slides: int) -> SlideDeck:
+    """Chiede all'LLM un outline JSON con titoli + bullet."""
+    llm = _slides_llm()
+    return generate_structured(llm, _outline_prompt(subject, topic, n_slides), SlideDeck, name="slides",
+                               prepare=lambda d: _prepare_deck(d, subject, topic, n_slides))
+
+async def _adraft_slides(subject: str, topic: str, n_slides: int) -> SlideDeck:
+    llm = _slides_llm()
+    return await agenerate_structured(llm, _outline_prompt(subject, topic, n_slides), SlideDeck, name="slides",
+                                      prepare=lambda d: _prepare_deck(d, subject, topic, n_slides))
+
+# riquadro immagine a destra del testo (slide 4:3 da 10" × 7.5")
+_IMG_LEFT, _IMG_TOP, _IMG_W, _IMG_H = Inches(5.9), Inches(1.75), Inches(3.6), Inches(4.9)
+_TEXT_W_WITH_IMG = Inches(5.2)
+
+def _add_picture(sl, data: bytes) -> None:
+    """Immagine centrata nel riquadro, proporzioni conservate; il testo si restringe a sinistra."""
+    w, h = Image.open(io.BytesIO(data)).size
+    scale = min(_IMG_W / w, _IMG_H / h)
+    pw, ph = int(w * scale), int(h * scale)
+    sl.shapes.add_picture(io.BytesIO(data), _IMG_LEFT + (_IMG_W - pw) // 2, _IMG_TOP + (_IMG_H - ph) // 2, pw, ph)
+    sl.placeholders[1].width = _TEXT_W_WITH_IMG
+
+@span("render", "pptx")
+def _build_pptx(deck: SlideDeck, images: Optional[Sequence[Optional[bytes]]] = None) -> io.BytesIO:
     prs = Presentation()
 
     # Copertina
@@ -45,9 +75,11 @@ def _build_pptx(deck: SlideDeck) -> io.BytesIO:
 
     # Slide contenuto
     content_layout = prs.slide_layouts[1]
-    for s in deck.slides:
+    for idx, s in enumerate(deck.slides):
         sl = prs.slides.add_slide(content_layout)
         sl.shapes.title.text = s.title
+        if images and idx < len(images) and images[idx]:
+            _add_picture(sl, images[idx])
         tf = sl.placeholders[1].text_frame
         tf.clear()
         for i, b in enumerate(s.bullets):
@@ -65,7 +97,82 @@ def _build_pptx(deck: SlideDeck) -> io.BytesIO:
     buf.seek(0)
     return buf
 
-def generate_slides_pptx(subject: str, topic: str, n_slides: int = 10):
-    """Ritorna un BytesIO del PPTX generato."""
+def _deck_images(deck: SlideDeck, started: Optional[Dict[str, Future]] = None) -> List[Optional[bytes]]:
+    """Un'immagine per slide (None se non trovata in tempo); `started` = ricerche già avviate per titolo."""
+    started = started or {}
+    return slide_images.collect([started.get(s.title) or slide_images.submit(image_query(deck.topic, s.title))
+                                 for s in deck.slides])
+
+def _render_deck(deck: SlideDeck, images: bool = False, started: Optional[Dict[str, Future]] = None) -> io.BytesIO:
+    return _build_pptx(deck, _deck_images(deck, started) if images else None)
+
+def generate_slides_pptx(subject: str, topic: str, n_slides: int = 10, images: bool = False):
+    """Ritorna un BytesIO del PPTX generato (con images=True un'immagine web per slide)."""
     deck = _draft_slides(subject, topic, n_slides)
-    return _build_pptx(deck)
+    return _render_deck(deck, images)
+
+async def agenerate_slides_pptx(subject: str, topic: str, n_slides: int = 10, images: bool = False):
+    """Versione async (modalità ASGI): outline via ainvoke, immagini e rendering PPTX in un thread."""
+    deck = await _adraft_slides(subject, topic, n_slides)
+    return await asyncio.to_thread(_render_deck, deck, images)
+
+def deck_pptx_artifact(deck: SlideDeck, digest: Optional[str] = None, images: bool = False,
+                       started: Optional[Dict[str, Future]] = None) -> Artifact:
+    """
+    PPTX del deck dalla cache degli artefatti: il rendering (e il download delle immagini) solo al primo uso.
+    Un deck con immagini mancanti (fuori budget o non trovate) va in cache sotto una chiave che
+    include quali slide hanno l'immagine: quando i download finiscono la richiesta successiva
+    produce il deck completo invece di riusare per sempre quello parziale.
+    """
+    if not images:
+        return artifacts.get_or_render("pptx", deck, lambda: _render_deck(deck).getvalue(), digest)
+    digest = digest or model_digest("pptx+images", deck)
+    art = artifacts.get(digest)
+    if art is not None:
+        return art
+    pics = _deck_images(deck, started)
+    if not all(pics):
+        present = "".join("1" if p else "0" for p in pics)
+        digest = hashlib.sha256(f"{digest}:{present}".encode()).hexdigest()
+    return artifacts.get_or_render("pptx", deck, lambda: _build_pptx(deck, pics).getvalue(), digest)
+
+def generate_slides_artifact(subject: str, topic: str, n_slides: int = 10, images: bool = False) -> Artifact:
+    return deck_pptx_artifact(_draft_slides(subject, topic, n_slides), images=images)
+
+async def agenerate_slides_artifact(subject: str, topic: str, n_slides: int = 10, images: bool = False) -> Artifact:
+    deck = await _adraft_slides(subject, topic, n_slides)
+    return await asyncio.to_thread(deck_pptx_artifact, deck, None, images)
+
+def stream_slides_artifact(subject: str, topic: str, n_slides: int = 10,
+                           images: bool = False) -> Iterator[Tuple[str, Any]]:
+    """
+    Eventi ("slide", Slide) mentre l'outline viene generato, poi ("done", Artifact) col PPTX in cache.
+    Con images=True la ricerca dell'immagine di ogni slide parte appena la slide è completa.
+    """
+    n = 0
+    started: Dict[str, Future] = {}
+    for path, obj in stream_structured(_slides_llm(), _outline_prompt(subject, topic, n_slides), SlideDeck,
+                                       name="slides", items={"slides[]": Slide},
+                                       prepare=lambda d: _prepare_deck(d, subject, topic, n_slides)):
+        if not path:
+            yield "done", deck_pptx_artifact(obj, images=images, started=started)
+        elif n < max(1, n_slides):
+            n += 1
+            if images:
+                started[obj.title] = slide_images.submit(image_query(topic, obj.title))
+            yield "slide", obj
+
+async def astream_slides_artifact(subject: str, topic: str, n_slides: int = 10,
+                                  images: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+    n = 0
+    started: Dict[str, Future] = {}
+    async for path, obj in astream_structured(_slides_llm(), _outline_prompt(subject, topic, n_slides), SlideDeck,
+                                              name="slides", items={"slides[]": Slide},
+                                              prepare=lambda d: _prepare_deck(d, subject, topic, n_slides)):
+        if not path:
+            yield "done", await asyncio.to_thread(deck_pptx_artifact, obj, None, images, started)
+        elif n < max(1, n_slides):
+            n += 1
+            if images:
+                started[obj.title] = slide_images.submit(image_query(topic, obj.title))
+            yield "slide", obj
@@ -0,0 +1,262 @@
+# clients/standin.py
+"""
+Modalità stand-in (LLM_STANDIN=1): sostituti locali e deterministici di ChatOpenAI
+e OpenAIEmbeddings, per i test di carico senza consumare token né dipendere da API esterne.
+
+- FakeChatModel risponde in base al prompt (hash → stesso prompt, stessa risposta):
+  JSON valido per Exam / ConceptMap / LessonPlan / SlideDeck quando è richiesto
+  uno schema (response_format json_schema, vedi clients.structured), verdetti per il
+  grading, markdown per i riassunti, testo semplice per la chat.
+- FakeEmbeddings produce vettori unitari derivati dall'hash del testo.
+- Latenza simulata: STANDIN_LATENCY_MS + jitter deterministico fino a STANDIN_JITTER_MS
+  + STANDIN_MS_PER_TOKEN per ogni token "generato"; embedding: STANDIN_EMBED_LATENCY_MS.
+
+DB e Brave restano quelli veri: senza Postgres il RAG ritorna il messaggio d'errore
+e le generazioni proseguono senza contesto.
+"""
+from __future__ import annotations
+import asyncio, hashlib, json, math, os, random, re, time
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+STANDIN = os.getenv("LLM_STANDIN", "0") == "1"
+STANDIN_LATENCY_MS = float(os.getenv("STANDIN_LATENCY_MS", 300))
+STANDIN_JITTER_MS = float(os.getenv("STANDIN_JITTER_MS", 200))
+STANDIN_MS_PER_TOKEN = float(os.getenv("STANDIN_MS_PER_TOKEN", 1))
+STANDIN_EMBED_LATENCY_MS = float(os.getenv("STANDIN_EMBED_LATENCY_MS", 30))
+STANDIN_EMBED_DIM = int(os.getenv("STANDIN_EMBED_DIM", 1536))
+
+_WORDS = (
+    "storia fonte impero guerra trattato riforma società economia cultura arte scienza "
+    "metodo causa effetto periodo territorio popolo governo legge religione commercio "
+    "innovazione crisi rivoluzione sviluppo conflitto alleanza città campagna lavoro"
+).split()
+
+
+def _rng(text: str) -> random.Random:
+    return random.Random(int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big"))
+
+def _words(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(n))
+
+def _find(pattern: str, text: str, default: str) -> str:
+    m = re.search(pattern, text)
+    return m.group(1).strip() if m else default
+
+
+# ───────────────────────── generatori per schema ─────────────────────────
+
+def _fake_exam(text: str, rng: random.Random) -> dict:
+    topic = _find(r"ARGOMENTO:\s*(.+)", text, "Argomento")
+    latin = "LATINO" in text
+    n = 5 if latin else int(_find(r"NUM_DOMANDE:\s*(\d+)", text, "5"))
+    questions = []
+    for i in range(n):
+        if rng.random() < 0.6:
+            correct = rng.randrange(4)
+            questions.append({
+                "id": f"q{i + 1}", "qtype": "mcq", "text": f"Domanda {i + 1} su {topic}: {_words(rng, 6)}?",
+                "options": [{"id": "ABCD"[j], "text": _words(rng, 3), "is_correct": j == correct} for j in range(4)],
+                "ideal_answer": None, "explanation": _words(rng, 10),
+            })
+        else:
+            questions.append({
+                "id": f"q{i + 1}", "qtype": "open", "text": f"Spiega {_words(rng, 4)} ({topic})",
+                "options": None, "ideal_answer": _words(rng, 20), "explanation": _words(rng, 10),
+            })
+    exam = {"title": f"Esame: {topic}", "questions": questions}
+    if latin:
+        exam.update(version_latin=" ".join(["Romani", "bellum", "gerebant"] * 30),
+                    solution_translation=_words(rng, 90))
+    else:
+        exam.update(version_latin=None, solution_translation=None)
+    return exam
+
+def _fake_concept_map(text: str, rng: random.Random) -> dict:
+    topic = _find(r"ARGOMENTO:\s*(.+)", text, "Argomento")
+    nodes = [{"key": "root", "text": topic}]
+    links = []
+    for c in range(1, rng.randint(6, 8) + 1):
+        nodes.append({"key": f"c{c}", "text": _words(rng, 2).title()})
+        links.append({"from": "root", "to": f"c{c}"})
+        for s in range(1, rng.randint(3, 4) + 1):
+            nodes.append({"key": f"c{c}_{s}", "text": _words(rng, 3)})
+            links.append({"from": f"c{c}", "to": f"c{c}_{s}"})
+    return {"nodeDataArray": nodes, "linkDataArray": links}
+
+def _fake_concept_outline(text: str, rng: random.Random) -> dict:
+    topic = _find(r"ARGOMENTO:\s*(.+)", text, "Argomento")
+    n = min(int(_find(r"al massimo (\d+)", text, "8")), rng.randint(6, 8))
+    nodes = [{"key": "root", "text": topic}] + [{"key": f"c{c}", "text": _words(rng, 2).title()} for c in range(1, n + 1)]
+    return {"nodeDataArray": nodes, "linkDataArray": [{"from": "root", "to": f"c{c}"} for c in range(1, n + 1)]}
+
+def _fake_concept_expand(text: str, rng: random.Random) -> dict:
+    n = int(_find(r"da 3 a (\d+)", text, "6"))
+    return {"children": [_words(rng, 3) for _ in range(rng.randint(3, max(3, n)))]}
+
+def _fake_lesson_plan(text: str, rng: random.Random) -> dict:
+    topic, subject = re.search(r'tratta "(.+?)" \((.+?)\)', text).groups() if 'tratta "' in text else ("Argomento", "Materia")
+    minutes = int(_find(r"dura (\d+) minuti", text, "45"))
+    lessons = [{
+        "lesson_number": i,
+        "title": f"{topic}: {_words(rng, 3)}",
+        "objectives": [_words(rng, 6) for _ in range(3)],
+        "activities": [_words(rng, 6) for _ in range(3)],
+        "materials": [_words(rng, 2)],
+        "assessment": _words(rng, 8),
+    } for i in range(1, 7)]
+    return {"subject": subject, "topic": topic, "grade": _find(r"docente di (.+?) italiano", text, "Scuola"),
+            "lesson_minutes": minutes, "global_goals": None, "lessons": lessons}
+
+def _fake_slides(text: str, rng: random.Random) -> dict:
+    n = int(_find(r"piano di (\d+) slide", text, "10"))
+    return {
+        "subject": _find(r'materia "(.+?)"', text, "Materia"),
+        "topic": _find(r'argomento "(.+?)"', text, "Argomento"),
+        "slides": [{"title": _words(rng, 3).title(), "bullets": [_words(rng, 7) for _ in range(rng.randint(3, 5))]}
+                   for _ in range(n)],
+    }
+
+_SCHEMA_FAKES = {
+    "exam": _fake_exam,
+    "concept_map": _fake_concept_map,
+    "concept_outline": _fake_concept_outline,
+    "concept_expand": _fake_concept_expand,
+    "lesson_plan": _fake_lesson_plan,
+    "slides": _fake_slides,
+}
+
+def _from_schema(schema: dict, node: dict, rng: random.Random) -> Any:
+    """Istanza generica di uno schema JSON (per generatori strutturati senza fake dedicato)."""
+    if "$ref" in node:
+        return _from_schema(schema, schema["$defs"][node["$ref"].rsplit("/", 1)[-1]], rng)
+    if "anyOf" in node:
+        return _from_schema(schema, next((s for s in node["anyOf"] if s.get("type") != "null"), {}), rng)
+    if "enum" in node:
+        return rng.choice(node["enum"])
+    t = node.get("type")
+    if t == "object":
+        return {k: _from_schema(schema, v, rng) for k, v in node.get("properties", {}).items()}
+    if t == "array":
+        return [_from_schema(schema, node.get("items", {}), rng) for _ in range(rng.randint(2, 4))]
+    if t == "integer":
+        return rng.randint(1, 10)
+    if t == "number":
+        return round(rng.random(), 3)
+    if t == "boolean":
+        return rng.random() < 0.5
+    if t == "null":
+        return None
+    return _words(rng, 4)
+
+
+# ───────────────────────── risposte libere ─────────────────────────
+
+def _free_text(text: str, rng: random.Random) -> str:
+    if '"verdicts"' in text:
+        n = len(re.findall(r"^\[\d+\]$", text, re.M))
+        return json.dumps({"verdicts": [{"n": i, "correct": rng.random() < 0.7} for i in range(1, n + 1)]})
+    if "Rispondi solo YES" in text:
+        return "YES" if rng.random() < 0.7 else "NO"
+    if '"ok": "SI/NO/PARZIALE"' in text:
+        return json.dumps({"ok": rng.choice(["SI", "NO", "PARZIALE"]), "feedback": _words(rng, 25)})
+    if "riassunt" in text.lower() or "Riassunto" in text:
+        bullets = "\n".join(f"- {_words(rng, 8)}" for _ in range(8))
+        return f"# Riassunto\n{bullets}\n\n## Concetti chiave\n{bullets}\n\n## Domande di ripasso\n1. {_words(rng, 6)}?"
+    return f"Risposta simulata: {_words(rng, 30)}."
+
+
+# ───────────────────────── modelli ─────────────────────────
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    return "\n".join(m.content if isinstance(m.content, str) else json.dumps(m.content) for m in messages)
+
+class FakeChatModel(BaseChatModel):
+    model_name: str = "standin"
+
+    @property
+    def _llm_type(self) -> str:
+        return "standin"
+
+    def _respond(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> tuple[str, float, int]:
+        text = _prompt_text(messages)
+        rng = _rng(text)
+        rf = kwargs.get("response_format") or {}
+        if rf.get("type") == "json_schema":
+            spec = rf["json_schema"]
+            fake = _SCHEMA_FAKES.get(spec["name"])
+            content = json.dumps(fake(text, rng) if fake else _from_schema(spec["schema"], spec["schema"], rng),
+                                 ensure_ascii=False)
+        else:
+            content = _free_text(text, rng)
+        completion_tokens = max(1, len(content) // 4)
+        delay = (STANDIN_LATENCY_MS + rng.uniform(0, STANDIN_JITTER_MS)
+                 + STANDIN_MS_PER_TOKEN * completion_tokens) / 1000
+        return content, delay, completion_tokens
+
+    def _result(self, messages: List[BaseMessage], content: str, completion_tokens: int) -> ChatResult:
+        prompt_tokens = max(1, len(_prompt_text(messages)) // 4)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=content))],
+            llm_output={"token_usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }, "model_name": self.model_name},
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        content, delay, tokens = self._respond(messages, kwargs)
+        time.sleep(delay)
+        return self._result(messages, content, tokens)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        content, delay, tokens = self._respond(messages, kwargs)
+        await asyncio.sleep(delay)
+        return self._result(messages, content, tokens)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        content, delay, _ = self._respond(messages, kwargs)
+        pieces = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+        for piece in pieces:
+            time.sleep(delay / len(pieces))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        content, delay, _ = self._respond(messages, kwargs)
+        pieces = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+        for piece in pieces:
+            await asyncio.sleep(delay / len(pieces))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+
+class FakeEmbeddings(Embeddings):
+    def _vector(self, text: str) -> List[float]:
+        rng = _rng(text)
+        v = [rng.gauss(0, 1) for _ in range(STANDIN_EMBED_DIM)]
+        norm = math.sqrt(sum(x * x for x in v)) or 1.0
+        return [x / norm for x in v]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(STANDIN_EMBED_LATENCY_MS / 1000)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(STANDIN_EMBED_LATENCY_MS / 1000)
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(STANDIN_EMBED_LATENCY_MS / 1000)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(STANDIN_EMBED_LATENCY_MS / 1000)
+        return self._vector(text)
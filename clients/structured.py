@@ -0,0 +1,344 @@
+# clients/structured.py
+"""
+Generazione strutturata condivisa (Exam, ConceptMap, LessonPlan, SlideDeck, ...).
+
+generate_structured(llm, messages, Model, name=...):
+1. chiede all'LLM JSON vincolato allo schema del modello Pydantic
+   (response_format json_schema strict; se l'API rifiuta lo schema si ricade su json_object);
+2. estrae e ripara in locale i difetti piccoli (code fence, testo attorno,
+   virgole finali, virgolette tipografiche, letterali Python, parentesi non chiuse);
+3. se la validazione fallisce fa UNA sola richiesta mirata: rimanda la risposta
+   con gli errori di validazione e chiede di correggere solo quelli;
+4. conta per nome: ok al primo colpo, riparati in locale, re-ask, falliti.
+
+stream_structured / astream_structured fanno lo stesso sull'output in streaming ed
+emettono intanto gli elementi già completi (nodi, lezioni, slide) via clients.json_stream.
+"""
+from __future__ import annotations
+import ast, copy, json, logging, os, re, threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple, Type, TypeVar
+
+import openai
+from langchain_core.messages import AIMessage, HumanMessage, convert_to_messages
+from pydantic import BaseModel, ValidationError
+
+from clients.json_stream import JsonStreamParser
+from clients.telemetry import span
+
+STRUCTURED_SCHEMA = os.getenv("STRUCTURED_SCHEMA", "1") != "0"   # 0 = solo json_object
+MAX_ERRORS_IN_REASK = 8
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+# errori che rendono una risposta "non valida" e giustificano il re-ask; TypeError, KeyError,
+# AttributeError in un `prepare` sono bug del chiamante e devono emergere, non costare una chiamata
+_INVALID = (ValidationError, json.JSONDecodeError, ValueError)
+
+
+# ───────────────────────── schema strict ─────────────────────────
+
+def _strictify(node: Any) -> None:
+    if isinstance(node, dict):
+        node.pop("default", None)
+        if node.get("type") == "object" and "properties" in node:
+            props = node["properties"]
+            required = set(node.get("required", []))
+            for key, sub in props.items():
+                if key not in required and not _nullable(sub):
+                    props[key] = {"anyOf": [sub, {"type": "null"}]}
+            node["required"] = list(props)
+            node["additionalProperties"] = False
+        for v in node.values():
+            _strictify(v)
+    elif isinstance(node, list):
+        for v in node:
+            _strictify(v)
+
+def _nullable(sub: dict) -> bool:
+    return sub.get("type") == "null" or any(s.get("type") == "null" for s in sub.get("anyOf", []))
+
+_SCHEMAS: Dict[type, dict] = {}
+
+def strict_schema(model: Type[BaseModel]) -> dict:
+    """Schema JSON del modello nel sottoinsieme accettato da OpenAI in modalità strict."""
+    if model not in _SCHEMAS:
+        schema = copy.deepcopy(model.model_json_schema(by_alias=True))
+        _strictify(schema)
+        _SCHEMAS[model] = schema
+    return _SCHEMAS[model]
+
+def _response_format(model: Type[BaseModel], name: str) -> dict:
+    if not STRUCTURED_SCHEMA or name in _schema_rejected:
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": re.sub(r"\W", "_", name)[:64], "schema": strict_schema(model), "strict": True},
+    }
+
+_schema_rejected: set = set()
+
+
+# ───────────────────────── parsing con riparazione locale ─────────────────────────
+
+_FENCE_RE = re.compile(r"```[a-zA-Z0-9]*|```")
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'"})
+
+def _outer_json(text: str) -> str:
+    text = _FENCE_RE.sub("", text or "").strip()
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        raise ValueError("Nessun JSON trovato nella risposta del modello.")
+    end = max(text.rfind("}"), text.rfind("]"))
+    return text[start:end + 1] if end > start else text[start:]
+
+def _close_brackets(text: str) -> str:
+    """Chiude stringhe e parentesi lasciate aperte da una risposta troncata."""
+    stack, in_str, esc = [], False, False
+    for ch in text:
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    tail = '"' if in_str else ""
+    body = _TRAILING_COMMA_RE.sub(r"\1", (text + tail).rstrip().rstrip(","))
+    return body + "".join(reversed(stack))
+
+def parse_json(raw: str) -> tuple[Any, bool]:
+    """(oggetto, riparato?) — riparato=True se è servita una correzione oltre all'estrazione."""
+    text = _outer_json(raw)
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    fixed = _TRAILING_COMMA_RE.sub(r"\1", text.translate(_SMART_QUOTES))
+    for candidate in (fixed, _close_brackets(fixed)):
+        try:
+            return json.loads(candidate), True
+        except json.JSONDecodeError:
+            pass
+    try:
+        return ast.literal_eval(fixed), True
+    except Exception as e:
+        raise ValueError("Impossibile estrarre JSON dal modello") from e
+
+def loads_json(raw: str) -> Any:
+    """Solo estrazione + riparazione locale (per output senza modello Pydantic)."""
+    return parse_json(raw)[0]
+
+def _drop_nulls(obj: Any) -> Any:
+    # lo schema strict rende null i campi facoltativi: togliendoli valgono i default del modello
+    if isinstance(obj, dict):
+        return {k: _drop_nulls(v) for k, v in obj.items() if v is not None}
+    if isinstance(obj, list):
+        return [_drop_nulls(v) for v in obj]
+    return obj
+
+
+# ───────────────────────── statistiche ─────────────────────────
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+def _bump(name: str, outcome: str) -> None:
+    with _stats_lock:
+        s = _stats.setdefault(name, {"calls": 0, "ok": 0, "repaired_local": 0, "reasked": 0, "failed": 0})
+        s["calls"] += 1
+        s[outcome] += 1
+
+def structured_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out = {k: dict(v) for k, v in _stats.items()}
+    for s in out.values():
+        s["failure_rate"] = round(s["failed"] / s["calls"], 3) if s["calls"] else 0.0
+        s["repair_rate"] = round((s["repaired_local"] + s["reasked"]) / s["calls"], 3) if s["calls"] else 0.0
+    return out
+
+
+# ───────────────────────── generazione ─────────────────────────
+
+def _validate(raw: str, model: Type[M], prepare: Optional[Callable[[dict], dict]]) -> tuple[M, bool]:
+    with span("parse", model.__name__):
+        data, repaired = parse_json(raw)
+        if not isinstance(data, dict):
+            raise ValueError(f"atteso un oggetto JSON, ricevuto {type(data).__name__}")
+        data = _drop_nulls(data)
+        if prepare is not None:
+            data = prepare(data)
+        return model.model_validate(data), repaired
+
+def _describe(err: Exception) -> str:
+    if isinstance(err, ValidationError):
+        lines = [f"- {'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in err.errors()[:MAX_ERRORS_IN_REASK]]
+        return "\n".join(lines)
+    return f"- {err}"
+
+def _reask_messages(messages: Any, raw: str, err: Exception) -> list:
+    base = convert_to_messages([("user", messages)] if isinstance(messages, str) else messages)
+    return base + [
+        AIMessage(content=raw),
+        HumanMessage(content=(
+            "Il JSON precedente non è valido per questi motivi:\n"
+            f"{_describe(err)}\n"
+            "Correggi SOLO questi problemi e restituisci di nuovo il JSON completo, senza altro testo."
+        )),
+    ]
+
+def _invoke(llm, messages: Any, model: Type[BaseModel], name: str) -> str:
+    try:
+        return llm.invoke(messages, response_format=_response_format(model, name)).content
+    except openai.BadRequestError:
+        if name in _schema_rejected or not STRUCTURED_SCHEMA:
+            raise
+        logging.warning("[structured] schema rifiutato per %s, uso json_object", name, exc_info=True)
+        _schema_rejected.add(name)
+        return llm.invoke(messages, response_format={"type": "json_object"}).content
+
+async def _ainvoke(llm, messages: Any, model: Type[BaseModel], name: str) -> str:
+    try:
+        return (await llm.ainvoke(messages, response_format=_response_format(model, name))).content
+    except openai.BadRequestError:
+        if name in _schema_rejected or not STRUCTURED_SCHEMA:
+            raise
+        logging.warning("[structured] schema rifiutato per %s, uso json_object", name, exc_info=True)
+        _schema_rejected.add(name)
+        return (await llm.ainvoke(messages, response_format={"type": "json_object"})).content
+
+def _finish(llm, messages: Any, model: Type[M], name: str, prepare: Optional[Callable[[dict], dict]], raw: str) -> M:
+    """Validazione della risposta completa; se non valida, UN re-ask mirato."""
+    try:
+        obj, repaired = _validate(raw, model, prepare)
+        _bump(name, "repaired_local" if repaired else "ok")
+        return obj
+    except _INVALID as e:
+        err = e
+    logging.info("[structured] %s non valido, re-ask mirato: %s", name, err)
+    raw2 = _invoke(llm, _reask_messages(messages, raw, err), model, name)
+    return _final(raw2, model, name, prepare)
+
+async def _afinish(llm, messages: Any, model: Type[M], name: str, prepare: Optional[Callable[[dict], dict]],
+                   raw: str) -> M:
+    try:
+        obj, repaired = _validate(raw, model, prepare)
+        _bump(name, "repaired_local" if repaired else "ok")
+        return obj
+    except _INVALID as e:
+        err = e
+    logging.info("[structured] %s non valido, re-ask mirato: %s", name, err)
+    raw2 = await _ainvoke(llm, _reask_messages(messages, raw, err), model, name)
+    return _final(raw2, model, name, prepare)
+
+def _final(raw2: str, model: Type[M], name: str, prepare: Optional[Callable[[dict], dict]]) -> M:
+    try:
+        obj, _ = _validate(raw2, model, prepare)
+    except _INVALID as e:
+        _bump(name, "failed")
+        logging.error("[structured] %s fallito dopo re-ask. Output:\n%s", name, raw2[:2000])
+        raise StructuredOutputError(f"Output non valido per {name}") from e
+    _bump(name, "reasked")
+    return obj
+
+def generate_structured(llm, messages: Any, model: Type[M], *, name: str,
+                        prepare: Optional[Callable[[dict], dict]] = None) -> M:
+    """
+    Genera un'istanza di `model`. `prepare` normalizza il dict prima della validazione
+    (default di dominio, tagli, id mancanti).
+    """
+    return _finish(llm, messages, model, name, prepare, _invoke(llm, messages, model, name))
+
+async def agenerate_structured(llm, messages: Any, model: Type[M], *, name: str,
+                               prepare: Optional[Callable[[dict], dict]] = None) -> M:
+    """Versione async di generate_structured."""
+    return await _afinish(llm, messages, model, name, prepare, await _ainvoke(llm, messages, model, name))
+
+
+# ───────────────────────── streaming ─────────────────────────
+
+def _text(chunk: Any) -> str:
+    content = getattr(chunk, "content", "")
+    return content if isinstance(content, str) else ""
+
+def _stream(llm, messages: Any, model: Type[BaseModel], name: str) -> Iterator[str]:
+    # l'eventuale rifiuto dello schema arriva al primo chunk: solo lì si ricade su json_object
+    stream = llm.stream(messages, response_format=_response_format(model, name))
+    try:
+        first = next(stream, None)
+    except openai.BadRequestError:
+        if name in _schema_rejected or not STRUCTURED_SCHEMA:
+            raise
+        logging.warning("[structured] schema rifiutato per %s, uso json_object", name, exc_info=True)
+        _schema_rejected.add(name)
+        stream = llm.stream(messages, response_format={"type": "json_object"})
+        first = next(stream, None)
+    if first is None:
+        return
+    yield _text(first)
+    for chunk in stream:
+        yield _text(chunk)
+
+async def _astream(llm, messages: Any, model: Type[BaseModel], name: str) -> AsyncIterator[str]:
+    stream = llm.astream(messages, response_format=_response_format(model, name))
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        return
+    except openai.BadRequestError:
+        if name in _schema_rejected or not STRUCTURED_SCHEMA:
+            raise
+        logging.warning("[structured] schema rifiutato per %s, uso json_object", name, exc_info=True)
+        _schema_rejected.add(name)
+        stream = llm.astream(messages, response_format={"type": "json_object"})
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            return
+    yield _text(first)
+    async for chunk in stream:
+        yield _text(chunk)
+
+def _item(item_model: Type[BaseModel], value: Any) -> Optional[BaseModel]:
+    try:
+        return item_model.model_validate(_drop_nulls(value))
+    except _INVALID:
+        return None    # elemento parziale o malformato: decide la validazione finale
+
+def stream_structured(llm, messages: Any, model: Type[M], *, name: str, items: Dict[str, Type[BaseModel]],
+                      prepare: Optional[Callable[[dict], dict]] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Come generate_structured, ma in streaming. `items` associa un percorso JSON al modello
+    dei suoi elementi (es. {"lessons[]": Lesson}): ogni elemento completato e valido esce
+    come (percorso, elemento) mentre il modello genera ancora; l'ultimo evento è
+    ("", oggetto completo), validato (ed eventualmente corretto) come in generate_structured.
+    Gli elementi sono un'anteprima: fa fede l'oggetto finale.
+    """
+    parser = JsonStreamParser(items)
+    for chunk in _stream(llm, messages, model, name):
+        for path, value in parser.feed(chunk):
+            item = _item(items[path], value)
+            if item is not None:
+                yield path, item
+    yield "", _finish(llm, messages, model, name, prepare, parser.text)
+
+async def astream_structured(llm, messages: Any, model: Type[M], *, name: str, items: Dict[str, Type[BaseModel]],
+                             prepare: Optional[Callable[[dict], dict]] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Versione async di stream_structured."""
+    parser = JsonStreamParser(items)
+    async for chunk in _astream(llm, messages, model, name):
+        for path, value in parser.feed(chunk):
+            item = _item(items[path], value)
+            if item is not None:
+                yield path, item
+    yield "", await _afinish(llm, messages, model, name, prepare, parser.text)
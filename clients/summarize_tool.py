@@ -1,9 +1,8 @@
 # clients/summarize_tool.py
 from __future__ import annotations
-import os, tempfile, pathlib
+import asyncio, os, tempfile, pathlib
 from typing import Optional, List, Dict
 from pydantic import BaseModel
-from langchain_openai import ChatOpenAI
 from langchain_community.document_loaders import (
     PyPDFLoader,
     UnstructuredWordDocumentLoader,
@@ -11,12 +10,16 @@ from langchain_community.document_loaders import (
 )
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from clients.llm_gateway import chat_model
+from clients.telemetry import span
+
 class SummaryPayload(BaseModel):
     topic: str
     length: str
     summary_md: str  # markdown pronto da mostrare
 
 # ---------- parsing file ----------
+@span("parse", "document")
 def _extract_text(file_path: str) -> str:
     ext = pathlib.Path(file_path).suffix.lower()
     if ext == ".pdf":
@@ -43,25 +46,23 @@ def _shrink(text: str, target_chars: int = 15000) -> List[str]:
     return out
 
 # ---------- LLM ----------
-def _summarize_chunks(topic: str, chunks: List[str], length: str) -> str:
-    """
-    map → reduce semplice: prima riassunti per chunk, poi fusione finale.
-    """
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.2)
-    # 1) map
-    partials: List[str] = []
-    for c in chunks:
-        prompt = f"""Sei un docente delle scuole superiori.
+def _bullets_target(length: str) -> int:
+    return {"short": 6, "medium": 10, "long": 16}.get(length, 10)
+
+def _target_chars(length: str) -> int:
+    return {"short": 8000, "medium": 15000, "long": 22000}.get(length, 15000)
+
+def _map_prompt(topic: str, chunk: str) -> str:
+    return f"""Sei un docente delle scuole superiori.
 Riassumi il seguente testo sull'argomento "{topic}" in italiano, in modo fedele e didattico.
 Usa punti elenco compatti e conserva termini tecnici rilevanti.
 
 TESTO:
-\"\"\"{c}\"\"\""""
-        partials.append(llm.invoke(prompt).content.strip())
+\"\"\"{chunk}\"\"\""""
 
-    # 2) reduce
-    bullets_target = {"short": 6, "medium": 10, "long": 16}.get(length, 10)
-    prompt_reduce = f"""Unifica e ripulisci i riassunti parziali sull'argomento "{topic}".
+def _reduce_prompt(topic: str, partials: List[str], length: str) -> str:
+    bullets_target = _bullets_target(length)
+    return f"""Unifica e ripulisci i riassunti parziali sull'argomento "{topic}".
 Produci **solo** markdown con questa struttura:
 
 # Riassunto: {topic}
@@ -80,19 +81,50 @@ Produci **solo** markdown con questa struttura:
 
 Riassunti parziali:
 \"\"\"{chr(10).join(partials)}\"\"\""""
-    return llm.invoke(prompt_reduce).content.strip()
+
+def _topic_only_prompt(topic: str, length: str) -> str:
+    bullets_target = _bullets_target(length)
+    return f"""Fornisci un riassunto didattico in italiano su "{topic}".
+Usa **markdown** con:
+- un elenco di max {bullets_target} punti chiave
+- sezione "Concetti chiave" (5–8 bullet)
+- sezione "Glossario" (5–10 voci)
+- sezione "Domande di ripasso" (3 domande)"""
+
+def _summarize_chunks(topic: str, chunks: List[str], length: str) -> str:
+    """
+    map → reduce semplice: prima riassunti per chunk, poi fusione finale.
+    """
+    llm = chat_model("gpt-4o", temperature=0.2)
+    # 1) map
+    partials: List[str] = []
+    for c in chunks:
+        partials.append(llm.invoke(_map_prompt(topic, c)).content.strip())
+
+    # 2) reduce
+    return llm.invoke(_reduce_prompt(topic, partials, length)).content.strip()
+
+async def _asummarize_chunks(topic: str, chunks: List[str], length: str) -> str:
+    """map (chunk in parallelo) → reduce, con ainvoke."""
+    llm = chat_model("gpt-4o", temperature=0.2)
+    partials = await asyncio.gather(*(llm.ainvoke(_map_prompt(topic, c)) for c in chunks))
+    reduced = await llm.ainvoke(_reduce_prompt(topic, [p.content.strip() for p in partials], length))
+    return reduced.content.strip()
 
 def summarize_topic_and_optional_file(
     topic: str,
     length: str = "medium",
     file_storage=None,  # Werkzeug FileStorage (opzionale)
     plain_text: Optional[str] = None,
+    file_path: Optional[str] = None,  # file già salvato su disco (es. job in background)
 ) -> SummaryPayload:
     """
     Se c'è un file: estrai testo e riassumi; altrimenti riassumi il plain_text (o il solo topic).
     """
     source_text = ""
-    if file_storage:
+    if file_path:
+        source_text = _extract_text(file_path)
+    elif file_storage:
         suffix = pathlib.Path(file_storage.filename or "upload").suffix or ".pdf"
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
             file_storage.save(tmp.name)
@@ -103,17 +135,45 @@ def summarize_topic_and_optional_file(
 
     if not source_text:
         # Riassunto “solo topic”
-        llm = ChatOpenAI(model="gpt-4o", temperature=0.2)
-        bullets_target = {"short": 6, "medium": 10, "long": 16}.get(length, 10)
-        prompt = f"""Fornisci un riassunto didattico in italiano su "{topic}".
-Usa **markdown** con:
-- un elenco di max {bullets_target} punti chiave
-- sezione "Concetti chiave" (5–8 bullet)
-- sezione "Glossario" (5–10 voci)
-- sezione "Domande di ripasso" (3 domande)"""
-        md = llm.invoke(prompt).content.strip()
+        llm = chat_model("gpt-4o", temperature=0.2)
+        md = llm.invoke(_topic_only_prompt(topic, length)).content.strip()
         return SummaryPayload(topic=topic, length=length, summary_md=md)
 
-    chunks = _shrink(source_text, target_chars={"short": 8000, "medium": 15000, "long": 22000}.get(length, 15000))
+    chunks = _shrink(source_text, target_chars=_target_chars(length))
     md = _summarize_chunks(topic, chunks, length)
     return SummaryPayload(topic=topic, length=length, summary_md=md)
+
+def _extract_text_from_bytes(data: bytes, filename: str) -> str:
+    suffix = pathlib.Path(filename or "upload").suffix or ".pdf"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(data)
+    try:
+        return _extract_text(tmp.name)
+    finally:
+        os.unlink(tmp.name)
+
+async def asummarize_topic_and_optional_file(
+    topic: str,
+    length: str = "medium",
+    file_bytes: Optional[bytes] = None,
+    filename: Optional[str] = None,
+    plain_text: Optional[str] = None,
+) -> SummaryPayload:
+    """
+    Versione async (modalità ASGI): il file arriva già letto in memoria
+    (UploadFile); parsing e split in un thread, chiamate LLM con ainvoke.
+    """
+    source_text = ""
+    if file_bytes:
+        source_text = await asyncio.to_thread(_extract_text_from_bytes, file_bytes, filename or "upload")
+    elif plain_text:
+        source_text = plain_text
+
+    if not source_text:
+        llm = chat_model("gpt-4o", temperature=0.2)
+        md = (await llm.ainvoke(_topic_only_prompt(topic, length))).content.strip()
+        return SummaryPayload(topic=topic, length=length, summary_md=md)
+
+    chunks = await asyncio.to_thread(_shrink, source_text, _target_chars(length))
+    md = await _asummarize_chunks(topic, chunks, length)
+    return SummaryPayload(topic=topic, length=length, summary_md=md)
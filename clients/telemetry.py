@@ -0,0 +1,95 @@
+# clients/telemetry.py
+"""
+Strumentazione a span e metriche Prometheus.
+
+- span(kind, name): misura una fase (embed, db, llm, llm_queue, render, parse) e la
+  registra nell'istogramma llm_mcp_span_duration_seconds{kind,name,endpoint};
+  si usa come context manager o come decoratore;
+- begin_request / end_request: durata per endpoint (llm_mcp_request_duration_seconds)
+  e riepilogo per fase della singola richiesta, restituito come header Server-Timing
+  e loggato per le richieste lente;
+- record_tokens: token prompt/completion per modello ed endpoint;
+- /metrics espone tutto in formato testo Prometheus (metrics_payload).
+
+L'endpoint corrente viaggia in una contextvar: gli span nei thread di asyncio.to_thread
+e nei task la ereditano; i ThreadPoolExecutor interni no (finiscono sotto endpoint="-").
+"""
+from __future__ import annotations
+import contextlib, contextvars, logging, os, time
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+SLOW_REQUEST_S = float(os.getenv("SLOW_REQUEST_S", 5))
+
+_REQ_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+_SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+
+REQUEST_SECONDS = Histogram(
+    "llm_mcp_request_duration_seconds", "Durata delle richieste HTTP per endpoint",
+    ["endpoint", "method", "status"], buckets=_REQ_BUCKETS,
+)
+SPAN_SECONDS = Histogram(
+    "llm_mcp_span_duration_seconds", "Durata delle fasi interne (embedding, DB, LLM, rendering, parsing)",
+    ["kind", "name", "endpoint"], buckets=_SPAN_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_mcp_llm_tokens_total", "Token LLM consumati",
+    ["model", "type", "endpoint"],
+)
+
+_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("telemetry_endpoint", default="-")
+_trace: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("telemetry_trace", default=None)
+
+
+def observe(kind: str, name: str, seconds: float) -> None:
+    SPAN_SECONDS.labels(kind, name, _endpoint.get()).observe(seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace[kind] = trace.get(kind, 0.0) + seconds
+
+@contextlib.contextmanager
+def span(kind: str, name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(kind, name, time.perf_counter() - t0)
+
+def record_tokens(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+    endpoint = _endpoint.get()
+    if prompt_tokens:
+        LLM_TOKENS.labels(model or "-", "prompt", endpoint).inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(model or "-", "completion", endpoint).inc(completion_tokens)
+
+
+# ───────────────────────── richieste ─────────────────────────
+
+def begin_request(endpoint: str) -> Tuple[float, contextvars.Token, contextvars.Token]:
+    return (
+        time.perf_counter(),
+        _endpoint.set(endpoint),
+        _trace.set({}),
+    )
+
+def end_request(state: Tuple[float, contextvars.Token, contextvars.Token], method: str, status: int) -> str:
+    """Chiude la richiesta e ritorna il valore dell'header Server-Timing."""
+    t0, ep_token, tr_token = state
+    elapsed = time.perf_counter() - t0
+    endpoint = _endpoint.get()
+    trace = _trace.get() or {}
+    REQUEST_SECONDS.labels(endpoint, method, str(status)).observe(elapsed)
+    _endpoint.reset(ep_token)
+    _trace.reset(tr_token)
+
+    if elapsed >= SLOW_REQUEST_S:
+        logging.info("[slow] %s %s %.0fms: %s", method, endpoint, elapsed * 1000,
+                     ", ".join(f"{k} {v * 1000:.0f}ms" for k, v in sorted(trace.items(), key=lambda kv: -kv[1])))
+    parts = [f"{k};dur={v * 1000:.1f}" for k, v in trace.items()]
+    parts.append(f"total;dur={elapsed * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def metrics_payload() -> Tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
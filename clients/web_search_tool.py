@@ -1,66 +1,223 @@
-import os, requests, logging
-from typing import Optional, List, Dict
+# clients/web_search_tool.py
+"""
+Ricerca web e immagini con Brave.
+
+Tutte le chiamate passano da una Session requests condivisa (connessioni keep-alive,
+un solo handshake TLS per connessione del pool) o, in modalità ASGI, da un
+httpx.AsyncClient condiviso. Le risposte riuscite restano in una cache in memoria
+per BRAVE_CACHE_TTL_S con chiave (endpoint, parametri): le ricerche ripetute
+dell'agente sullo stesso argomento non consumano quota. Le richieste identiche
+concorrenti sono coalescenti; *_many esegue più query in parallelo.
+"""
+from __future__ import annotations
+import asyncio, collections, logging, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
 from langchain_core.tools import Tool
 
+from clients.singleflight import SingleFlight, make_key
+
+# endpoint sovrascrivibile (p.es. uno stand-in HTTP locale nei test di carico)
+BRAVE_API_URL = os.getenv("BRAVE_API_URL", "https://api.search.brave.com/res/v1").rstrip("/")
+BRAVE_TIMEOUT_S = float(os.getenv("BRAVE_TIMEOUT_S", 12))
+BRAVE_POOL_SIZE = int(os.getenv("BRAVE_POOL_SIZE", 16))          # connessioni keep-alive verso l'API
+BRAVE_CACHE_TTL_S = float(os.getenv("BRAVE_CACHE_TTL_S", 900))
+BRAVE_CACHE_MAX = int(os.getenv("BRAVE_CACHE_MAX", 1024))
+
+_BASE_PARAMS = {"search_lang": "it-IT", "country": "it", "safesearch": "strict"}
+
 # --- utility: leggi la key al momento della chiamata (lazy) ---
 def _get_brave_key() -> Optional[str]:
     return os.getenv("BRAVE_API_KEY")
 
-# --- Web search (testo) ---
-def brave_search(query: str, count: Optional[int] = 3) -> str:
+
+# ───────────────────────── client condivisi ─────────────────────────
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_aclient: Optional[httpx.AsyncClient] = None
+_aclient_loop: Optional[asyncio.AbstractEventLoop] = None
+_multi_pool = ThreadPoolExecutor(max_workers=BRAVE_POOL_SIZE, thread_name_prefix="brave")
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=BRAVE_POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                s.headers.update({"accept": "application/json", "Accept-Encoding": "gzip"})
+                _session = s
+    return _session
+
+def _get_aclient() -> httpx.AsyncClient:
+    """AsyncClient condiviso, legato all'event loop corrente (ricreato se il loop cambia)."""
+    global _aclient, _aclient_loop
+    loop = asyncio.get_running_loop()
+    if _aclient is None or _aclient_loop is not loop:
+        _aclient = httpx.AsyncClient(
+            timeout=BRAVE_TIMEOUT_S,
+            headers={"accept": "application/json", "Accept-Encoding": "gzip"},
+            limits=httpx.Limits(max_connections=BRAVE_POOL_SIZE, max_keepalive_connections=BRAVE_POOL_SIZE),
+        )
+        _aclient_loop = loop
+    return _aclient
+
+async def aclose_brave_client() -> None:
+    """Da chiamare allo shutdown dell'app ASGI."""
+    global _aclient, _aclient_loop
+    if _aclient is not None:
+        await _aclient.aclose()
+        _aclient = _aclient_loop = None
+
+
+# ───────────────────────── cache TTL ─────────────────────────
+
+class _ResponseCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data: "collections.OrderedDict[str, Tuple[float, Any]]" = collections.OrderedDict()
+        self._hits = self._misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self._misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return item[1]
+
+    def put(self, key: str, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._data),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            }
+
+_cache = _ResponseCache(BRAVE_CACHE_TTL_S, BRAVE_CACHE_MAX)
+_flights = SingleFlight()
+
+
+def _request(endpoint: str, query: str, count: int) -> Tuple[str, str, Dict[str, Any], Dict[str, str]]:
     key = _get_brave_key()
     if not key:
-        return "Brave API Key non trovata (BRAVE_API_KEY assente)."
+        raise LookupError("BRAVE_API_KEY assente")
+    params = {"q": query, "count": count, **_BASE_PARAMS}
+    return (make_key(f"brave:{endpoint}", **params), f"{BRAVE_API_URL}/{endpoint}", params,
+            {"X-Subscription-Token": key})
 
-    url = "https://api.search.brave.com/res/v1/web/search"
-    headers = {"accept": "application/json", "X-Subscription-Token": key}
-    params = {"q": query, "count": count or 3, "search_lang": "it-IT", "country": "it", "safesearch": "strict"}
+def _get_json(endpoint: str, query: str, count: int, timeout: float = BRAVE_TIMEOUT_S) -> Dict[str, Any]:
+    """GET JSON con cache TTL e coalescenza; solleva su errore HTTP/rete (gli errori non vanno in cache)."""
+    ckey, url, params, headers = _request(endpoint, query, count)
+    cached = _cache.get(ckey)
+    if cached is not None:
+        return cached
 
-    try:
-        r = requests.get(url, headers=headers, params=params, timeout=12)
+    def _fetch() -> Dict[str, Any]:
+        r = _get_session().get(url, headers=headers, params=params, timeout=timeout)
+        r.raise_for_status()
+        data = r.json()
+        _cache.put(ckey, data)
+        return data
+    return _flights.do(ckey, _fetch)
+
+async def _aget_json(endpoint: str, query: str, count: int, timeout: float = BRAVE_TIMEOUT_S) -> Dict[str, Any]:
+    ckey, url, params, headers = _request(endpoint, query, count)
+    cached = _cache.get(ckey)
+    if cached is not None:
+        return cached
+
+    async def _fetch() -> Dict[str, Any]:
+        r = await _get_aclient().get(url, headers=headers, params=params, timeout=timeout)
         r.raise_for_status()
         data = r.json()
-        results = data.get("web", {}).get("results", [])
-        if not results:
-            return "Nessun risultato trovato"
-        formatted = "\n".join(f"{i+1}. {r['title']}: {r['url']}" for i, r in enumerate(results[:count]))
-        return f"Risultati da Brave Search:\n{formatted}"
+        _cache.put(ckey, data)
+        return data
+    return await _flights.ado(ckey, _fetch)
+
+
+# ───────────────────────── formattazione ─────────────────────────
+
+def _format_web(data: Dict[str, Any], count: int) -> str:
+    results = data.get("web", {}).get("results", [])
+    if not results:
+        return "Nessun risultato trovato"
+    formatted = "\n".join(f"{i+1}. {r['title']}: {r['url']}" for i, r in enumerate(results[:count]))
+    return f"Risultati da Brave Search:\n{formatted}"
+
+def _normalize_images(data: Dict[str, Any]) -> List[Dict]:
+    results = data.get("results") or data.get("images", {}).get("results") or []
+    out = []
+    for it in results:
+        out.append({
+            "url": it.get("url") or it.get("image") or it.get("img", {}).get("url"),
+            "thumbnail": (it.get("thumbnail") if isinstance(it.get("thumbnail"), str)
+                          else (it.get("thumbnail") or {}).get("url")),
+            "page_url": it.get("source") or it.get("page_url"),
+            "width": it.get("width") or (it.get("properties") or {}).get("width"),
+            "height": it.get("height") or (it.get("properties") or {}).get("height"),
+        })
+    return [x for x in out if x["url"]]
+
+
+# --- Web search (testo) ---
+def brave_search(query: str, count: Optional[int] = 3) -> str:
+    count = count or 3
+    try:
+        return _format_web(_get_json("web/search", query, count), count)
+    except LookupError:
+        return "Brave API Key non trovata (BRAVE_API_KEY assente)."
     except requests.HTTPError as e:
         return f"Errore HTTP Brave: {e} — {getattr(e.response, 'text', '')[:200]}"
     except Exception as e:
         return f"Errore durante la ricerca web: {e}"
 
+async def abrave_search(query: str, count: Optional[int] = 3) -> str:
+    """Versione async di brave_search (modalità ASGI), con httpx."""
+    count = count or 3
+    try:
+        return _format_web(await _aget_json("web/search", query, count), count)
+    except LookupError:
+        return "Brave API Key non trovata (BRAVE_API_KEY assente)."
+    except httpx.HTTPStatusError as e:
+        return f"Errore HTTP Brave: {e} — {e.response.text[:200]}"
+    except Exception as e:
+        return f"Errore durante la ricerca web: {e}"
+
 # --- Image search (immagini) ---
-def brave_image_search(query: str, count: Optional[int] = 6) -> List[Dict]:
+def brave_image_search(query: str, count: Optional[int] = 6, timeout: float = BRAVE_TIMEOUT_S) -> List[Dict]:
     """
     Ritorna una lista di dict immagine (url, source/page_url, width/height se disponibili).
     """
-    key = _get_brave_key()
-    if not key:
+    try:
+        return _normalize_images(_get_json("images/search", query, count or 6, timeout))
+    except LookupError:
         logging.info("[brave] BRAVE_API_KEY assente")
         return []
-
-    url = "https://api.search.brave.com/res/v1/images/search"
-    headers = {"accept": "application/json", "X-Subscription-Token": key}
-    params = {"q": query, "count": count or 6, "search_lang": "it-IT", "country": "it", "safesearch": "strict"}
-
-    try:
-        r = requests.get(url, headers=headers, params=params, timeout=12)
-        r.raise_for_status()
-        data = r.json()
-        results = data.get("results") or data.get("images", {}).get("results") or []
-        # normalizza i campi principali
-        out = []
-        for it in results:
-            out.append({
-                "url": it.get("url") or it.get("image") or it.get("img", {}).get("url"),
-                "thumbnail": (it.get("thumbnail") if isinstance(it.get("thumbnail"), str)
-                              else (it.get("thumbnail") or {}).get("url")),
-                "page_url": it.get("source") or it.get("page_url"),
-                "width": it.get("width") or (it.get("properties") or {}).get("width"),
-                "height": it.get("height") or (it.get("properties") or {}).get("height"),
-            })
-        return [x for x in out if x["url"]]
     except requests.HTTPError as e:
         logging.info(f"[brave] HTTP {e} — {getattr(e.response, 'text', '')[:200]}")
         return []
@@ -68,18 +225,84 @@ def brave_image_search(query: str, count: Optional[int] = 6) -> List[Dict]:
         logging.info(f"[brave] Errore images: {e}")
         return []
 
+async def abrave_image_search(query: str, count: Optional[int] = 6, timeout: float = BRAVE_TIMEOUT_S) -> List[Dict]:
+    try:
+        return _normalize_images(await _aget_json("images/search", query, count or 6, timeout))
+    except LookupError:
+        logging.info("[brave] BRAVE_API_KEY assente")
+        return []
+    except httpx.HTTPStatusError as e:
+        logging.info(f"[brave] HTTP {e} — {e.response.text[:200]}")
+        return []
+    except Exception as e:
+        logging.info(f"[brave] Errore images: {e}")
+        return []
+
+# --- Più query in parallelo ---
+def brave_search_many(queries: Sequence[str], count: Optional[int] = 3) -> Dict[str, str]:
+    """{query: risultati} per tutte le query, eseguite in parallelo sul pool di connessioni."""
+    unique = list(dict.fromkeys(queries))
+    return dict(zip(unique, _multi_pool.map(lambda q: brave_search(q, count), unique)))
+
+async def abrave_search_many(queries: Sequence[str], count: Optional[int] = 3) -> Dict[str, str]:
+    unique = list(dict.fromkeys(queries))
+    return dict(zip(unique, await asyncio.gather(*(abrave_search(q, count) for q in unique))))
+
+def brave_image_search_many(queries: Sequence[str], count: Optional[int] = 6) -> Dict[str, List[Dict]]:
+    unique = list(dict.fromkeys(queries))
+    return dict(zip(unique, _multi_pool.map(lambda q: brave_image_search(q, count), unique)))
+
+async def abrave_image_search_many(queries: Sequence[str], count: Optional[int] = 6) -> Dict[str, List[Dict]]:
+    unique = list(dict.fromkeys(queries))
+    return dict(zip(unique, await asyncio.gather(*(abrave_image_search(q, count) for q in unique))))
+
+def brave_stats() -> Dict[str, Any]:
+    return {"cache": _cache.stats(), "ttl_s": BRAVE_CACHE_TTL_S, "pool_size": BRAVE_POOL_SIZE}
+
+
+# --- Tool per l'agente: una query per riga = ricerche in parallelo ---
+def _split_queries(text: str) -> List[str]:
+    return [q.strip() for q in str(text).splitlines() if q.strip()]
+
+def _web_tool(text: str) -> str:
+    queries = _split_queries(text)
+    if len(queries) <= 1:
+        return brave_search(queries[0] if queries else str(text))
+    return "\n\n".join(f"### {q}\n{r}" for q, r in brave_search_many(queries).items())
+
+async def _aweb_tool(text: str) -> str:
+    queries = _split_queries(text)
+    if len(queries) <= 1:
+        return await abrave_search(queries[0] if queries else str(text))
+    return "\n\n".join(f"### {q}\n{r}" for q, r in (await abrave_search_many(queries)).items())
+
+def _images_tool(text: str):
+    queries = _split_queries(text)
+    if len(queries) <= 1:
+        return brave_image_search(queries[0] if queries else str(text), count=6)
+    return brave_image_search_many(queries, count=6)
+
+async def _aimages_tool(text: str):
+    queries = _split_queries(text)
+    if len(queries) <= 1:
+        return await abrave_image_search(queries[0] if queries else str(text), count=6)
+    return await abrave_image_search_many(queries, count=6)
+
 def get_brave_tool():
     # Nome senza spazi (pattern ^[a-zA-Z0-9_-]+$)
     return Tool.from_function(
-        func=brave_search,
+        func=_web_tool,
+        coroutine=_aweb_tool,
         name="Brave_Web_Search",
-        description="Cerca sul web (testo) con Brave."
+        description="Cerca sul web (testo) con Brave. Per più ricerche insieme scrivi una query per riga."
     )
 
 def get_brave_images_tool():
     # Ritorna JSON con elenco immagini normalizzato
     return Tool.from_function(
-        func=lambda q: brave_image_search(q, count=6),
+        func=_images_tool,
+        coroutine=_aimages_tool,
         name="Brave_Image_Search",
-        description="Cerca immagini (licenze varie) con Brave; ritorna una lista di oggetti {url, thumbnail, page_url, width, height}."
+        description="Cerca immagini (licenze varie) con Brave; ritorna una lista di oggetti {url, thumbnail, page_url, width, height}. "
+                    "Con una query per riga ritorna {query: lista} per ciascuna."
     )
@@ -0,0 +1,199 @@
+"""
+loadgen.py – generatore di carico per app.py / asgi.py
+-------------------------------------------------------
+Manda richieste a ritmo costante (open loop, --rps) a tutti gli endpoint secondo un mix
+pesato e riporta per endpoint: throughput, p50/p95/p99 e tassi di errore / 429.
+La latenza è misurata dall'istante programmato di invio, così le code lato client
+non nascondono i rallentamenti del server.
+
+Senza token né API esterne: avviare il server in modalità stand-in, p.es.
+    LLM_STANDIN=1 STANDIN_LATENCY_MS=500 python app.py
+    python loadgen.py --url http://localhost:5000 --rps 5 --duration 60
+    python loadgen.py --mix ask=4,generate_concept_map=2,generate_slides=1 --json report.json
+"""
+from __future__ import annotations
+import argparse, json, math, random, sys, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+TOPICS = [
+    "Rivoluzione francese", "Impero romano", "Prima guerra mondiale", "Rinascimento",
+    "Illuminismo", "Fotosintesi", "Sistema solare", "Unità d'Italia", "Guerra fredda",
+    "Medioevo", "Riforma protestante", "Rivoluzione industriale", "Antico Egitto",
+    "Grecia classica", "Seconda guerra mondiale", "Ciclo dell'acqua", "Cellula",
+    "Scoperte geografiche", "Risorgimento", "Costituzione italiana",
+]
+CHAT_QUESTIONS = [
+    "Chi era Napoleone?", "Spiegami la fotosintesi in breve", "Che cos'è l'Illuminismo?",
+    "fammi una mappa concettuale sulla {t}", "crea un quiz su {t}", "riassunto su {t}",
+]
+DEFAULT_MIX = {
+    "ask": 4, "generate_exam": 2, "grade_exam": 2, "grade_exam_bulk": 1, "generate_plan": 1,
+    "plan_pdf": 1, "generate_concept_map": 2, "expand_concept_node": 2, "generate_slides": 1, "summarize": 1,
+}
+
+Request = Tuple[str, str, Dict[str, Any]]   # (metodo, path, kwargs httpx)
+
+
+# ───────────────────────── scenari ─────────────────────────
+
+def _answers(exam: dict, rng: random.Random) -> Dict[str, str]:
+    out = {}
+    for q in exam.get("questions", []):
+        if q.get("qtype") == "mcq" and q.get("options"):
+            out[q["id"]] = rng.choice(q["options"])["id"]
+        else:
+            out[q["id"]] = rng.choice(["non lo so", q.get("ideal_answer") or "risposta", "una risposta parziale"])
+    return out
+
+def _scenarios(ctx: Dict[str, Any]) -> Dict[str, Callable[[random.Random, str, str], Request]]:
+    text = " ".join(["Il testo di prova descrive eventi, cause e conseguenze."] * 120)
+    sc: Dict[str, Callable[[random.Random, str, str], Request]] = {
+        "ask": lambda rng, t, cid: ("POST", "/ask", {"json": {"question": rng.choice(CHAT_QUESTIONS).format(t=t), "client_id": cid}}),
+        "generate_exam": lambda rng, t, cid: ("POST", "/generate_exam", {"json": {"subject": "Storia", "topic": t, "n": 5}}),
+        "generate_plan": lambda rng, t, cid: ("POST", "/generate_plan", {"json": {"subject": "Storia", "topic": t, "lesson_minutes": 45}}),
+        "generate_concept_map": lambda rng, t, cid: ("POST", "/generate_concept_map", {"json": {"topic": t}}),
+        "expand_concept_node": lambda rng, t, cid: ("POST", "/expand_concept_node", {"json": {
+            "topic": t, "key": f"c{rng.randint(1, 6)}", "text": rng.choice(TOPICS)}}),
+        "generate_slides": lambda rng, t, cid: ("POST", "/generate_slides", {"json": {"subject": "Storia", "topic": t, "n_slides": 8}}),
+        "summarize": lambda rng, t, cid: ("POST", "/summarize", {"json": {"topic": t, "length": "short", "text": text}}),
+    }
+    if ctx.get("exam"):
+        exam = ctx["exam"]
+        sc["grade_exam"] = lambda rng, t, cid: ("POST", "/grade_exam", {"json": {"exam": exam, "answers": _answers(exam, rng)}})
+        sc["grade_exam_bulk"] = lambda rng, t, cid: ("POST", "/grade_exam_bulk", {"json": {
+            "exam": exam, "submissions": {f"s{i}": _answers(exam, rng) for i in range(30)}}})
+    if ctx.get("plan"):
+        plan = ctx["plan"]
+        sc["plan_pdf"] = lambda rng, t, cid: ("POST", "/plan_pdf", {"json": {"plan": plan}})
+    return sc
+
+def _prefetch(client: httpx.Client) -> Dict[str, Any]:
+    """Esame e piano di riferimento per gli scenari che ne hanno bisogno."""
+    ctx: Dict[str, Any] = {}
+    for key, path, body in (
+        ("exam", "/generate_exam", {"subject": "Storia", "topic": TOPICS[0], "n": 5}),
+        ("plan", "/generate_plan", {"subject": "Storia", "topic": TOPICS[0], "lesson_minutes": 45}),
+    ):
+        try:
+            r = client.post(path, json=body, headers={"X-Client-Id": "loadgen-setup"})
+            r.raise_for_status()
+            ctx[key] = r.json()
+        except Exception as e:
+            print(f"[setup] {path} non disponibile ({e}): scenari dipendenti esclusi", file=sys.stderr)
+    return ctx
+
+
+# ───────────────────────── misure ─────────────────────────
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    return s[min(len(s), max(1, math.ceil(p / 100 * len(s)))) - 1]  # nearest-rank
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[Tuple[int, float]]] = defaultdict(list)   # (status, latenza s); status 0 = eccezione
+
+    def add(self, name: str, status: int, latency: float) -> None:
+        with self._lock:
+            self.samples[name].append((status, latency))
+
+    def report(self, duration: float) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for name, rows in sorted(self.samples.items()):
+            ok = [lat for st, lat in rows if 200 <= st < 300]
+            shed = sum(1 for st, _ in rows if st == 429)
+            errors = len(rows) - len(ok) - shed
+            out[name] = {
+                "sent": len(rows),
+                "ok": len(ok),
+                "shed_429": shed,
+                "errors": errors,
+                "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+                "shed_rate": round(shed / len(rows), 4) if rows else 0.0,
+                "throughput_rps": round(len(ok) / duration, 3) if duration else 0.0,
+                **{f"p{p}_ms": (round(v * 1000, 1) if (v := percentile(ok, p)) is not None else None)
+                   for p in (50, 95, 99)},
+            }
+        return out
+
+
+def _print_table(report: Dict[str, Dict[str, Any]]) -> None:
+    cols = ("sent", "ok", "shed_429", "errors", "error_rate", "throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+    print(f"{'endpoint':<22}" + "".join(f"{c:>15}" for c in cols))
+    for name, row in report.items():
+        print(f"{name:<22}" + "".join(f"{'-' if row[c] is None else row[c]:>15}" for c in cols))
+
+
+# ───────────────────────── esecuzione ─────────────────────────
+
+def run(url: str, rps: float, duration: float, mix: Dict[str, float], concurrency: int = 64,
+        clients: int = 50, seed: int = 1, timeout: float = 180.0) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    http = httpx.Client(base_url=url, timeout=timeout,
+                        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency))
+    scenarios = _scenarios(_prefetch(http))
+    weights = {k: w for k, w in mix.items() if k in scenarios and w > 0}
+    if not weights:
+        raise SystemExit("Nessuno scenario eseguibile nel mix.")
+    names, w = list(weights), list(weights.values())
+    rec = Recorder()
+
+    def _fire(name: str, req: Request, cid: str, scheduled: float) -> None:
+        method, path, kwargs = req
+        try:
+            r = http.request(method, path, headers={"X-Client-Id": cid}, **kwargs)
+            status = r.status_code
+        except Exception:
+            status = 0
+        rec.add(name, status, time.perf_counter() - scheduled)
+
+    total = int(rps * duration)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            scheduled = start + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = rng.choices(names, weights=w)[0]
+            cid = f"load-{rng.randrange(clients)}"
+            pool.submit(_fire, name, scenarios[name](rng, rng.choice(TOPICS), cid), cid, scheduled)
+    elapsed = time.perf_counter() - start
+    http.close()
+    return {
+        "url": url, "target_rps": rps, "duration_s": round(elapsed, 2), "requests": total,
+        "endpoints": rec.report(elapsed),
+    }
+
+
+def _parse_mix(spec: Optional[str]) -> Dict[str, float]:
+    if not spec:
+        return dict(DEFAULT_MIX)
+    return {k.strip(): float(v) for k, v in (part.split("=") for part in spec.split(","))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generatore di carico per gli endpoint llm-MCP")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--rps", type=float, default=2.0, help="richieste al secondo (open loop)")
+    parser.add_argument("--duration", type=float, default=30.0, help="secondi di invio")
+    parser.add_argument("--mix", default=None, help="es. ask=4,generate_slides=1 (default: tutti)")
+    parser.add_argument("--concurrency", type=int, default=64, help="richieste in volo massime lato client")
+    parser.add_argument("--clients", type=int, default=50, help="client_id distinti simulati")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", default=None, help="salva il report in JSON")
+    args = parser.parse_args()
+
+    result = run(args.url, args.rps, args.duration, _parse_mix(args.mix),
+                 concurrency=args.concurrency, clients=args.clients, seed=args.seed)
+    _print_table(result["endpoints"])
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2, ensure_ascii=False)
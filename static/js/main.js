@@ -8,13 +8,24 @@ const outputBox = $("#output-box");
 const quizBox = $("#quiz-box");
 const planBox = $("#plan-box");
 const conceptBox = $("#concept-box");
+const slidesBox = $("#slides-box");
 
 function showOutputSection(sectionEl) {
   outputBox?.classList.remove("d-none");
-  [quizBox, planBox, conceptBox].forEach((el) => el?.classList.add("d-none"));
+  [quizBox, planBox, conceptBox, slidesBox].forEach((el) => el?.classList.add("d-none"));
   sectionEl?.classList.remove("d-none");
 }
 
+// id client persistente: usato dal server per la memoria della conversazione e per le quote
+const CLIENT_ID = (() => {
+  let id = localStorage.getItem("client_id");
+  if (!id) {
+    id = (crypto.randomUUID && crypto.randomUUID()) || String(Date.now()) + Math.random().toString(16).slice(2);
+    localStorage.setItem("client_id", id);
+  }
+  return id;
+})();
+
 function escapeHtml(str) {
   return (str ?? "")
     .toString()
@@ -23,6 +34,42 @@ function escapeHtml(str) {
     .replaceAll(">", "&gt;");
 }
 
+// POST con risposta text/event-stream: onEvent(nome, dati) per ogni evento, nell'ordine di arrivo
+async function postEventStream(url, body, onEvent) {
+  const res = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
+    body: JSON.stringify({ ...body, stream: true }),
+  });
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({}));
+    throw new Error(err.error || `HTTP ${res.status}`);
+  }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buf.indexOf("\n\n")) >= 0) {
+      const block = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+      let event = "message";
+      let data = "";
+      block.split("\n").forEach((line) => {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      });
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === "error") throw new Error(payload.error || "generation failed");
+      onEvent(event, payload);
+    }
+  }
+}
+
 /* ---------- Chat ---------- */
 function appendMessage(role, text) {
   const wrapper = document.createElement("div");
@@ -48,8 +95,8 @@ async function sendMessage() {
   try {
     const res = await fetch("/ask", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ question: q }),
+      headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
+      body: JSON.stringify({ question: q, client_id: CLIENT_ID }),
     });
 
     if (!res.ok) {
@@ -59,7 +106,7 @@ async function sendMessage() {
     }
     const data = await res.json();
 
-    // Possibili chiavi: {answer}, {exam}, {concept_map}
+    // Possibili chiavi: {answer}, {exam}, {concept_map}, {plan}, {summary}
     if (data.exam) {
       renderQuiz(data.exam);
       showOutputSection(quizBox);
@@ -68,6 +115,14 @@ async function sendMessage() {
       renderConceptMap(data.concept_map);
       showOutputSection(conceptBox);
       appendMessage("ai", "Ecco la mappa concettuale.");
+    } else if (data.plan) {
+      CURRENT_PLAN = data.plan;
+      renderPlan(data.plan);
+      showOutputSection(planBox);
+      appendMessage("ai", "Ecco il piano delle lezioni.");
+    } else if (data.summary) {
+      showSummary(data.summary.summary_md || "Nessun contenuto generato.");
+      appendMessage("ai", "Ecco il riassunto.");
     } else if (data.answer !== undefined) {
       appendMessage("ai", String(data.answer));
     } else {
@@ -171,7 +226,7 @@ quizBtn?.addEventListener("click", async () => {
   try {
     const res = await fetch("/generate_exam", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
       body: JSON.stringify({ subject, topic, n, level }),
     });
     if (!res.ok) {
@@ -211,7 +266,7 @@ submitQuizBtn?.addEventListener("click", async () => {
   try {
     const res = await fetch("/grade_exam", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
       body: JSON.stringify({ exam: CURRENT_EXAM, answers }),
     });
     if (!res.ok) {
@@ -283,33 +338,51 @@ planBtn?.addEventListener("click", async () => {
   const lesson_minutes = parseInt($("#plan-duration").value || "45", 10);
   const global_goals = $("#plan-goals").value.trim();
 
+  // le lezioni compaiono una alla volta; l'evento finale porta il piano validato
+  CURRENT_PLAN = null;
+  renderPlan({ subject, topic, lessons: [] });
+  showOutputSection(planBox);
+  const tbody = planTable.querySelector("tbody");
   try {
-    const res = await fetch("/generate_plan", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({
-        subject,
-        topic,
-        grade,
-        lesson_minutes,
-        global_goals,
-      }),
-    });
-    if (!res.ok) {
-      const err = await res.json().catch(() => ({}));
-      alert(err.error || "Errore generazione piano.");
-      return;
-    }
-    const plan = await res.json();
-    CURRENT_PLAN = plan;
-    renderPlan(plan);
-    showOutputSection(planBox);
+    await postEventStream(
+      "/generate_plan",
+      { subject, topic, grade, lesson_minutes, global_goals },
+      (event, data) => {
+        if (event === "lesson") {
+          tbody.appendChild(planRow(data, tbody.children.length));
+        } else if (event === "done") {
+          CURRENT_PLAN = data;
+          renderPlan(data);
+        }
+      }
+    );
   } catch (e) {
     console.error(e);
-    alert("Problema di rete durante la generazione del piano.");
+    alert(e.message || "Problema di rete durante la generazione del piano.");
   }
 });
 
+function planRow(l, i) {
+  const tr = document.createElement("tr");
+  const objectives = Array.isArray(l.objectives)
+    ? l.objectives.join("\n")
+    : (l.objectives || "");
+  const activities = Array.isArray(l.activities)
+    ? l.activities.join("\n")
+    : (l.activities || "");
+  const materials = Array.isArray(l.materials)
+    ? l.materials.join("\n")
+    : (l.materials || "");
+  tr.innerHTML = `
+    <td class="text-center">${i + 1}</td>
+    <td>${escapeHtml(l.title || "")}</td>
+    <td style="white-space:pre-wrap">${escapeHtml(objectives)}</td>
+    <td style="white-space:pre-wrap">${escapeHtml(activities)}</td>
+    <td style="white-space:pre-wrap">${escapeHtml(materials)}</td>
+  `;
+  return tr;
+}
+
 function renderPlan(plan) {
   planTitle.textContent = `${plan.subject} – ${plan.topic}`;
   planTable.innerHTML = "";
@@ -328,26 +401,7 @@ function renderPlan(plan) {
 
   // Body
   const tbody = document.createElement("tbody");
-  (plan.lessons || []).forEach((l, i) => {
-    const tr = document.createElement("tr");
-    const objectives = Array.isArray(l.objectives)
-      ? l.objectives.join("\n")
-      : (l.objectives || "");
-    const activities = Array.isArray(l.activities)
-      ? l.activities.join("\n")
-      : (l.activities || "");
-    const materials = Array.isArray(l.materials)
-      ? l.materials.join("\n")
-      : (l.materials || "");
-    tr.innerHTML = `
-      <td class="text-center">${i + 1}</td>
-      <td>${escapeHtml(l.title || "")}</td>
-      <td style="white-space:pre-wrap">${escapeHtml(objectives)}</td>
-      <td style="white-space:pre-wrap">${escapeHtml(activities)}</td>
-      <td style="white-space:pre-wrap">${escapeHtml(materials)}</td>
-    `;
-    tbody.appendChild(tr);
-  });
+  (plan.lessons || []).forEach((l, i) => tbody.appendChild(planRow(l, i)));
   planTable.appendChild(tbody);
 }
 
@@ -356,7 +410,7 @@ pdfBtn?.addEventListener("click", async () => {
   try {
     const res = await fetch("/plan_pdf", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
       body: JSON.stringify({ plan: CURRENT_PLAN }),
     });
     if (!res.ok) {
@@ -392,6 +446,11 @@ const conceptFitBtn = $("#concept-fit");
 const conceptExportBtn = $("#concept-export");
 
 let diagram = null;
+let conceptTopic = "";   // argomento della mappa corrente (per /expand_concept_node)
+
+const NODE_FILL = "whitesmoke";
+const NODE_FILL_EXPANDABLE = "#e8f0fe";
+const NODE_FILL_LOADING = "#fff3cd";
 
 // Inizializza quando serve
 function ensureDiagram() {
@@ -406,11 +465,15 @@ function ensureDiagram() {
   diagram.nodeTemplate = $go(
     go.Node,
     "Auto",
-    $go(go.Shape, "RoundedRectangle", {
-      fill: "whitesmoke",
-      stroke: "#999",
-      strokeWidth: 1.5,
-    }),
+    { doubleClick: (e, node) => expandConceptNode(node.data) },
+    $go(
+      go.Shape,
+      "RoundedRectangle",
+      { fill: NODE_FILL, stroke: "#999", strokeWidth: 1.5 },
+      new go.Binding("fill", "", (d) =>
+        d.loading ? NODE_FILL_LOADING : d.expandable && !d.expanded ? NODE_FILL_EXPANDABLE : NODE_FILL
+      )
+    ),
     $go(
       go.TextBlock,
       {
@@ -434,15 +497,68 @@ function ensureDiagram() {
   return diagram;
 }
 
-function renderConceptMap(payload) {
+function renderConceptMap(payload, lazy = false) {
   ensureDiagram();
   const nda = payload.nodeDataArray || payload.nodes || [];
   // Link: chiave 'from' potrebbe essere aliasata; nel backend usi by_alias=True, quindi è 'from'
   const lda = payload.linkDataArray || payload.links || [];
+  // in modalità progressiva ogni nodo (tranne root) si può aprire con doppio clic
+  nda.forEach((n) => (n.expandable = lazy && n.key !== "root"));
   diagram.model = new go.GraphLinksModel(nda, lda);
   diagram.zoomToFit();
 }
 
+// Testi degli antenati del nodo (escluso root), dal più alto al più vicino
+function conceptPath(key) {
+  const path = [];
+  const seen = new Set([key]);
+  let k = key;
+  for (;;) {
+    const link = diagram.model.linkDataArray.find((l) => l.to === k);
+    if (!link || seen.has(link.from)) break;
+    k = link.from;
+    seen.add(k);
+    const n = diagram.model.findNodeDataForKey(k);
+    if (n && k !== "root") path.unshift(n.text);
+  }
+  return path;
+}
+
+async function expandConceptNode(data) {
+  if (!data || !data.expandable || data.expanded || data.loading) return;
+  const model = diagram.model;
+  model.setDataProperty(data, "loading", true);
+  try {
+    const res = await fetch("/expand_concept_node", {
+      method: "POST",
+      headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
+      body: JSON.stringify({
+        topic: conceptTopic,
+        key: data.key,
+        text: data.text,
+        path: conceptPath(data.key),
+        exclude: model.nodeDataArray.map((n) => n.text).slice(0, 80),
+      }),
+    });
+    if (!res.ok) {
+      const err = await res.json().catch(() => ({}));
+      alert(err.error || "Errore espansione nodo.");
+      return;
+    }
+    const sub = await res.json();
+    model.commit((m) => {
+      (sub.nodeDataArray || []).forEach((n) => m.addNodeData({ ...n, expandable: true }));
+      (sub.linkDataArray || []).forEach((l) => m.addLinkData(l));
+      m.setDataProperty(data, "expanded", true);
+    }, "expand node");
+  } catch (e) {
+    console.error(e);
+    alert("Problema di rete durante l'espansione del nodo.");
+  } finally {
+    model.setDataProperty(data, "loading", false);
+  }
+}
+
 openConceptPanel?.addEventListener("click", () => {
   $("#concept-config")?.classList.remove("d-none");
   outputBox?.classList.remove("d-none");
@@ -456,17 +572,38 @@ conceptBtn?.addEventListener("click", async () => {
   const topic = $("#concept-topic").value.trim();
   const max_nodes = parseInt($("#concept-nodes").value || "24", 10);
   const top_k = Math.min(12, Math.max(4, Math.floor(max_nodes / 2)));
+  const engine = $("#concept-engine")?.value || "llm";
+  // la mappa veloce è già completa: l'espansione progressiva vale solo per il motore LLM
+  const lazy = engine === "llm" && ($("#concept-lazy")?.checked ?? false);
 
   if (!topic) {
     alert("Inserisci l'argomento (titolo della mappa).");
     return;
   }
 
+  conceptTopic = topic;
+  if (engine === "llm" && !lazy) {
+    // mappa completa via LLM: nodi e link entrano nel diagramma man mano che arrivano
+    renderConceptMap({ nodeDataArray: [], linkDataArray: [] });
+    showOutputSection(conceptBox);
+    try {
+      await postEventStream("/generate_concept_map", { subject, topic, max_nodes, top_k }, (event, data) => {
+        if (event === "node") diagram.model.addNodeData(data);
+        else if (event === "link") diagram.model.addLinkData(data);
+        else if (event === "done") renderConceptMap(data);
+      });
+    } catch (e) {
+      console.error(e);
+      alert(e.message || "Problema di rete durante la generazione della mappa.");
+    }
+    return;
+  }
+
   try {
     const res = await fetch("/generate_concept_map", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ subject, topic, max_nodes, top_k }),
+      headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
+      body: JSON.stringify({ subject, topic, max_nodes, top_k, lazy, engine }),
     });
     if (!res.ok) {
       const err = await res.json().catch(() => ({}));
@@ -474,7 +611,7 @@ conceptBtn?.addEventListener("click", async () => {
       return;
     }
     const data = await res.json();
-    renderConceptMap(data);
+    renderConceptMap(data, lazy);
     showOutputSection(conceptBox);
   } catch (e) {
     console.error(e);
@@ -518,43 +655,38 @@ slidesBtn?.addEventListener("click", async () => {
   const subject = $("#slides-subject").value.trim();
   const topic = $("#slides-topic").value.trim();
   const n = parseInt($("#slides-n").value || "10", 10);
+  const images = $("#slides-images")?.checked || false;
 
   if (!topic) {
     alert("Inserisci l'argomento.");
     return;
   }
 
+  // anteprima delle slide mentre l'outline viene generato, poi download del PPTX
+  const list = $("#slides-preview");
+  list.innerHTML = "";
+  $("#slides-title").textContent = `${subject || "Materia"} – ${topic}`;
+  showOutputSection(slidesBox);
   try {
-    const res = await fetch("/generate_slides", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ subject, topic, n_slides: n }),
+    await postEventStream("/generate_slides", { subject, topic, n_slides: n, images }, (event, data) => {
+      if (event === "slide") {
+        const li = document.createElement("li");
+        li.className = "list-group-item";
+        li.innerHTML = `<strong>${escapeHtml(data.title)}</strong>
+          <ul class="mb-0">${(data.bullets || []).map((b) => `<li>${escapeHtml(b)}</li>`).join("")}</ul>`;
+        list.appendChild(li);
+      } else if (event === "done") {
+        const a = document.createElement("a");
+        a.href = data.url;
+        a.download = data.filename || "slides.pptx";
+        document.body.appendChild(a);
+        a.click();
+        a.remove();
+      }
     });
-
-    if (!res.ok) {
-      const err = await res.json().catch(() => ({}));
-      alert(err.error || "Errore durante la generazione.");
-      return;
-    }
-
-    // Scarica PPTX
-    const blob = await res.blob();
-    const dispo = res.headers.get("Content-Disposition") || "";
-    let filename = "slides.pptx";
-    const m = dispo.match(/filename\*=UTF-8''([^;]+)|filename="?([^"]+)"?/i);
-    if (m) filename = decodeURIComponent(m[1] || m[2]);
-
-    const url = window.URL.createObjectURL(blob);
-    const a = document.createElement("a");
-    a.href = url;
-    a.download = filename;
-    document.body.appendChild(a);
-    a.click();
-    a.remove();
-    window.URL.revokeObjectURL(url);
   } catch (e) {
     console.error(e);
-    alert("Problema di rete durante la generazione delle slide.");
+    alert(e.message || "Problema di rete durante la generazione delle slide.");
   }
 });
 
@@ -602,11 +734,11 @@ summaryBtn?.addEventListener("click", async () => {
       fd.append("topic", topic);
       fd.append("length", length);
       fd.append("file", file);
-      res = await fetch("/summarize", { method: "POST", body: fd });
+      res = await fetch("/summarize", { method: "POST", headers: { "X-Client-Id": CLIENT_ID }, body: fd });
     } else {
       res = await fetch("/summarize", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Client-Id": CLIENT_ID },
         body: JSON.stringify({ topic, length })
       });
     }
@@ -0,0 +1,93 @@
+# tests/test_email_outbox.py
+"""
+Outbox email contro uno stand-in SMTP locale (socketserver, nessuna rete esterna).
+
+    python -m pytest -q tests/test_email_outbox.py
+"""
+import os, socketserver, threading, unittest
+
+from clients.email_outbox import EmailOutbox
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Il minimo di SMTP che usa smtplib: EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def _reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        self.server.connections += 1
+        self._reply("220 standin")
+        while True:
+            line = self.rfile.readline().decode(errors="replace").strip()
+            if not line:
+                return
+            cmd = line.split(" ", 1)[0].upper()
+            if cmd in ("EHLO", "HELO"):
+                self._reply("250 standin")
+            elif cmd in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 ok")
+            elif cmd == "DATA":
+                self._reply("354 fine con .")
+                data = []
+                while (chunk := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(chunk)
+                self.server.messages.append(b"".join(data).decode(errors="replace"))
+                self._reply("250 accodato")
+            elif cmd == "QUIT":
+                self._reply("221 bye")
+                return
+            else:
+                self._reply("502 non supportato")
+
+
+class _SMTPStandin(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.messages, self.connections = [], 0
+
+
+class EmailOutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.server = _SMTPStandin()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self._env = {k: os.environ.get(k) for k in ("SMTP_SERVER", "SMTP_PORT", "SMTP_STARTTLS",
+                                                     "EMAIL_SENDER", "EMAIL_PASSWORD")}
+        os.environ.update(SMTP_SERVER="127.0.0.1", SMTP_PORT=str(self.server.server_address[1]),
+                          SMTP_STARTTLS="0", EMAIL_SENDER="docente@example.org", EMAIL_PASSWORD="")
+        self.outbox = EmailOutbox(senders=1)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for k, v in self._env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    def test_batch_reuses_one_connection(self):
+        queued = self.outbox.enqueue_many([(f"s{i}@example.org", "Voti", f"corpo {i}") for i in range(5)])
+        self.assertTrue(self.outbox.flush(timeout=10))
+        self.assertEqual([self.outbox.get(m.id).status for m in queued], ["sent"] * 5)
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_invalid_header_fails_only_that_message(self):
+        bad = self.outbox.enqueue("a@example.org", "Oggetto\ncon a capo", "x")
+        good = self.outbox.enqueue("b@example.org", "Oggetto", "y")
+        self.assertTrue(self.outbox.flush(timeout=10))
+        self.assertEqual(self.outbox.get(bad.id).status, "failed")
+        self.assertEqual(self.outbox.get(good.id).status, "sent")
+
+        # il mittente è ancora vivo
+        later = self.outbox.enqueue("c@example.org", "Dopo", "z")
+        self.assertTrue(self.outbox.flush(timeout=10))
+        self.assertEqual(self.outbox.get(later.id).status, "sent")
+
+
+if __name__ == "__main__":
+    unittest.main()